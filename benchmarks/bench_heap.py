@@ -0,0 +1,111 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+"""Measure heap scan throughput and accuracy on a synthetic heap.
+
+Fills --mb MB of memory with random words, zeros and stray pointers into the
+heap, then plants --lists linked lists of struct ListNode { int val; ListNode
+*next; } nodes in glibc-like malloc chunks. Reports scan rate, how many planted
+nodes were found and the precision of the scan, which must reach
+--min-precision.
+
+    python benchmarks/bench_heap.py --mb 256
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from visualize_links.lldb_plugin.heap import HeapLayout, HeapRegion, glibc_header, scan_heap
+
+BASE = 0x5555_0000_0000
+NODE_SIZE = 16
+# malloc chunks are a prev_size word (unused while allocated), size | PREV_INUSE
+# and the allocation. nodes take 32 byte chunks, as do all other small objects
+CHUNK_SIZES = [32, 48, 64, 96, 128]
+CHUNK_WEIGHTS = [0.4, 0.2, 0.2, 0.1, 0.1]
+
+
+def make_heap(
+    size: int, lists: int, length: int, stray: float, rng: np.random.Generator
+) -> tuple[np.ndarray, set[int]]:
+    words = rng.integers(0, 1 << 63, size // 8, dtype=np.uint64)
+    # roughly half of a real heap is zeros, some words point into the heap
+    words[rng.random(len(words)) < 0.5] = 0
+    strays = rng.random(len(words)) < stray
+    words[strays] = BASE + rng.integers(0, size // 8, strays.sum(), dtype=np.uint64) * 8
+
+    # carve the heap into chunks, nodes go into some of the 32 byte ones
+    sizes = rng.choice(CHUNK_SIZES, size // CHUNK_SIZES[0], p=CHUNK_WEIGHTS)
+    chunks = np.cumsum(sizes) - sizes
+    fits = chunks + sizes <= size
+    chunks, sizes = chunks[fits], sizes[fits]
+    words[chunks // 8 + 1] = sizes | 1
+
+    planted: set[int] = set()
+    slots = rng.choice(chunks[sizes == NODE_SIZE + 16], lists * length, replace=False)
+    for l in range(lists):
+        nodes = [int(s) + 16 for s in slots[l * length : (l + 1) * length]]
+        for i, offset in enumerate(nodes):
+            words[offset // 8] = i
+            words[offset // 8 + 1] = BASE + nodes[i + 1] if i + 1 < len(nodes) else 0
+            planted.add(BASE + offset)
+    return words, planted
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--mb", type=int, default=256)
+    parser.add_argument("--lists", type=int, default=100)
+    parser.add_argument("--length", type=int, default=100)
+    parser.add_argument("--stray", type=float, default=0.01, help="fraction of stray heap pointers")
+    parser.add_argument("--align", type=int, default=8, help="instance alignment")
+    parser.add_argument("--allocator", choices=["glibc", "none"], default="glibc")
+    # what remains are 32 byte chunks with a stray pointer to another one,
+    # exactly what a two node list looks like
+    parser.add_argument("--min-precision", type=float, default=0.75)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    size = args.mb << 20
+    words, planted = make_heap(size, args.lists, args.length, args.stray, np.random.default_rng(0))
+    memory = words.tobytes()
+
+    def read(addr: int, n: int):
+        offset = addr - BASE
+        if offset < 0 or offset + n > len(memory):
+            return None
+        return memory[offset : offset + n]
+
+    # as visualize-heap, malloc aligns chunks to two words
+    header = glibc_header(NODE_SIZE, 8) if args.allocator == "glibc" else None
+    layout = HeapLayout(
+        size=NODE_SIZE,
+        pointer_size=8,
+        little_endian=True,
+        self_offsets=[8],
+        other_offsets=[],
+        align=args.align if header is None else max(args.align, 16),
+        header=header,
+    )
+    regions = [HeapRegion(BASE, BASE + size)]
+
+    best = float("inf")
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        scan = scan_heap(regions, regions, read, layout)
+        best = min(best, time.perf_counter() - start)
+
+    found = set(scan.addresses.tolist())
+    precision = len(found & planted) / max(len(found), 1)
+    print(f"scanned {scan.bytes_scanned / (1 << 20):.0f} MB in {best:.2f}s: "
+          f"{scan.bytes_scanned / (1 << 20) / best:.0f} MB/s")
+    print(f"{scan.candidates} candidates, {len(found)} instances, {scan.linked} linked")
+    print(f"planted {len(planted)} nodes, found {len(found & planted)}, "
+          f"{len(found - planted)} false positives, precision {precision:.3f}")
+    assert precision >= args.min_precision, f"precision below {args.min_precision}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+"""Compare graph payload serialization paths on large synthetic graphs.
+
+Builds a linked list of --nodes nodes and reports the time and payload bytes per
+second of streaming it to the ui as Session.publish_graph_stream does: batches
+of --batch-size nodes are converted and serialized as ServedGraphBatch
+messages, followed by the name nodes. This runs without the fragment cache
+and with it: cold, republishing an unchanged or slightly changed graph, and
+re-requesting an already converted graph as a ServedGraph.
+
+A cold cache is not free: content keys are built for every node & link and
+interned after the graph was sent, which streams the first snapshot about
+10% slower than without a cache.
+
+    python benchmarks/bench_serialize.py --nodes 100000
+"""
+
+import argparse
+import gc
+import json
+import time
+from typing import Callable, Optional, TypeVar
+
+from visualize_links.lldb_plugin import model as M
+from visualize_links.lldb_plugin import served_model as S
+from visualize_links.lldb_plugin.cola_graph import ColaConverter
+from visualize_links.lldb_plugin.config import Config
+from visualize_links.lldb_plugin.serialize import JSON_BACKEND, FragmentCache
+
+T = TypeVar("T")
+
+
+def make_graph(n: int, changed: int = 0) -> M.Graph:
+    nodes = {
+        f"ADDR{i}": M.NodeDesc(
+            type=M.TypeDesc(name="ListNode"),
+            attrs={
+                "val": M.AttrValue(
+                    scalar=i + (1 if i < changed else 0), diff_type=None, old_scalar=None
+                )
+            },
+            names={"head": M.NameDesc(diff_type=None)} if i == 0 else {},
+        )
+        for i in range(n)
+    }
+    links = {
+        (f"ADDR{i}", f"ADDR{i + 1}"): M.LinkDesc(
+            accessors={"next": M.AccessorDesc(diff_type=None)}
+        )
+        for i in range(n - 1)
+    }
+    return M.Graph(nodes=nodes, links=links)
+
+
+def make_batches(g: M.Graph, batch_size: int) -> list[M.GraphBatch]:
+    """Split g as GraphBuilder.iter_extend hands it out, links with their target."""
+    ids = list(g.nodes)
+    incoming = {target: (source, target) for source, target in g.links}
+    batches = []
+    for start in range(0, len(ids), batch_size):
+        part = ids[start : start + batch_size]
+        links = [incoming[id] for id in part if id in incoming]
+        batches.append(
+            M.GraphBatch(
+                nodes={id: g.nodes[id] for id in part},
+                links={link: g.links[link] for link in links},
+                pruned_fields={},
+            )
+        )
+    return batches
+
+
+def stream(batches: list[M.GraphBatch], converter: ColaConverter) -> list[str]:
+    """Payloads of Session.publish_graph_stream, without interning."""
+    fragments = converter.fragments
+    payloads = []
+    nodes: dict[M.NodeId, M.NodeDesc] = {}
+    for batch in batches:
+        nodes.update(batch.nodes)
+        data = S.ServedGraphBatch(
+            stream=0,
+            nodes=converter.add_nodes(batch.nodes.items()),
+            links=[
+                S.ServedLinkUpdate(index=index, link=link)
+                for index, link in converter.add_links(batch.links.items())
+            ],
+        )
+        payloads.append(dump(data, fragments))
+    name_nodes, name_links = converter.finish(nodes.items())
+    data = S.ServedGraphBatch(
+        stream=0,
+        nodes=name_nodes,
+        links=[S.ServedLinkUpdate(index=index, link=link) for index, link in name_links],
+    )
+    payloads.append(dump(data, fragments))
+    return payloads
+
+
+def dump(data: S.ServedGraphBatch, fragments: Optional[FragmentCache]) -> str:
+    return data.model_dump_json() if fragments is None else data.dump_json(fragments)
+
+
+def publish(batches: list[M.GraphBatch], fragments: Optional[FragmentCache]) -> list[str]:
+    # new models are interned once the graph was sent
+    converter = ColaConverter(fragments)
+    payloads = stream(batches, converter)
+    converter.intern()
+    return payloads
+
+
+def measure(name: str, fn: Callable[[], T], runs: int) -> tuple[T, float]:
+    best = float("inf")
+    for _ in range(runs):
+        gc.collect()
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return out, best
+
+
+def report(name: str, seconds: float, size: int) -> None:
+    print(f"{name:>36}: {seconds * 1000:8.1f} ms  {size / seconds / 1e6:8.1f} MB/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=Config().batch_size)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    batches = make_batches(make_graph(args.nodes), args.batch_size)
+    # next snapshot with 1% of nodes changed
+    batches_changed = make_batches(
+        make_graph(args.nodes, changed=args.nodes // 100), args.batch_size
+    )
+    # long-lived snapshots, as in history, should not be rescanned by the gc
+    gc.collect()
+    gc.freeze()
+
+    print(f"json backend: {JSON_BACKEND}, nodes: {args.nodes}, batch size: {args.batch_size}")
+
+    # alternated, so both run with the same objects alive
+    uncached = cold = intern = float("inf")
+    for _ in range(args.runs):
+        expected, seconds = measure("uncached", lambda: publish(batches, None), 1)
+        uncached = min(uncached, seconds)
+        converter = ColaConverter(FragmentCache())
+        out, seconds = measure("cold", lambda: stream(batches, converter), 1)
+        cold = min(cold, seconds)
+        _, seconds = measure("intern", converter.intern, 1)
+        intern = min(intern, seconds)
+    size = sum(len(payload.encode()) for payload in expected)
+    print(f"payload: {size / 1e6:.1f} MB in {len(expected)} messages")
+    report("stream without cache", uncached, size)
+    report("fragments: stream, cold cache", cold, size)
+    report("fragments: + intern once sent", cold + intern, size)
+
+    fragments = FragmentCache()
+    publish(batches, fragments)
+    _, warm = measure("warm", lambda: publish(batches, fragments), args.runs)
+    report("fragments: stream unchanged", warm, size)
+    _, changed = measure("changed", lambda: publish(batches_changed, fragments), 1)
+    report("fragments: stream 1% changed", changed, size)
+
+    # a graph picked from history is sent whole, from the fragments streamed
+    converter = ColaConverter(fragments)
+    for batch in batches:
+        converter.add_nodes(batch.nodes.items())
+        converter.add_links(batch.links.items())
+    converter.finish((id, desc) for batch in batches for id, desc in batch.nodes.items())
+    converter.intern()
+    cached = S.ServedGraph(title="bench", graph=converter.graph(), index=0)
+    uncached_graph = cached.model_dump_json()
+    _, rerequest = measure("rerequest", lambda: cached.dump_json(fragments), args.runs)
+    report("fragments: re-request", rerequest, len(uncached_graph.encode()))
+
+    assert [json.loads(p) for p in out] == [
+        json.loads(p) for p in expected
+    ], "fragment output differs from pydantic"
+    assert json.loads(cached.dump_json(fragments)) == json.loads(
+        uncached_graph
+    ), "cached fragment output differs from pydantic"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+"""Measure how much importing the plugin adds to lldb startup.
+
+Runs lldb in batch mode without ~/.lldbinit, once bare, once importing the
+plugin and once also running a first command (which starts the server), and
+reports the median wall time of each.
+
+    python benchmarks/bench_startup.py --lldb lldb-19 --runs 10
+"""
+
+import argparse
+import statistics
+import subprocess
+import time
+
+CASES = {
+    "bare": [],
+    "import": ["command script import visualize_links"],
+    "import + first command": [
+        "command script import visualize_links",
+        "visualize-history",
+    ],
+}
+
+
+def run(lldb: str, commands: list[str]) -> float:
+    args = [lldb, "-b", "-x"]
+    for command in commands:
+        args += ["-o", command]
+
+    start = time.perf_counter()
+    subprocess.run(args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lldb", default="lldb-19")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    bare = None
+    for case, commands in CASES.items():
+        times = [run(args.lldb, commands) for _ in range(args.runs)]
+        median = statistics.median(times) * 1000
+        if bare is None:
+            bare = median
+        print(f"{case:>24}: {median:8.1f} ms  (+{median - bare:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
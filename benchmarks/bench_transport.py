@@ -0,0 +1,120 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+"""Compare websocket encodings of large graph payloads.
+
+Serializes a ServedGraph of a --nodes long linked list and reports, for plain
+json, json with permessage-deflate at several zlib levels and, when msgpack is
+installed, MessagePack with and without deflate: message size and encoding
+throughput in MB/s of json. Deflate uses the window & memory settings of the
+server. Then publishes the payload through a real Server to a websocket client
+over loopback, with compression disabled and at --level, and reports the
+delivery rate.
+
+    python benchmarks/bench_transport.py --nodes 100000
+"""
+
+import argparse
+import json
+import time
+import zlib
+from typing import Callable, Optional
+
+from websockets.sync.client import connect
+
+from bench_serialize import make_graph
+from visualize_links.lldb_plugin import served_model as S
+from visualize_links.lldb_plugin.cola_graph import convert_to_cola
+from visualize_links.lldb_plugin.config import Config
+from visualize_links.lldb_plugin.serialize import FragmentCache
+from visualize_links.lldb_plugin.server import Server
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# permessage-deflate settings of the server, see Server._extensions
+WINDOW_BITS = 12
+MEM_LEVEL = 5
+
+
+def deflate(data: bytes, level: int) -> bytes:
+    # a permessage-deflate frame is a raw deflate stream ending in a sync flush
+    c = zlib.compressobj(level, zlib.DEFLATED, -WINDOW_BITS, MEM_LEVEL)
+    return c.compress(data) + c.flush(zlib.Z_SYNC_FLUSH)
+
+
+def measure(fn: Callable[[], bytes], runs: int) -> tuple[bytes, float]:
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return out, best
+
+
+def report(name: str, size: int, seconds: Optional[float], raw: int) -> None:
+    rate = "" if seconds is None else f"{raw / seconds / 1e6:8.1f} MB/s"
+    print(f"{name:>24}: {size / 1e6:8.2f} MB  {raw / size:6.1f}x  {rate}")
+
+
+def deliver(payload: str, level: int, runs: int) -> float:
+    """Best time from publishing payload to a client having decoded it."""
+    server = Server(Config(port=8865, port_attempts=50, compression_level=level))
+    session = server.session("bench")
+    try:
+        with connect(server.url(), max_size=None) as ws:
+            ws.recv()  # sessions
+            ws.send(json.dumps({"type": "session", "name": "bench"}))
+            # answered once the session is watched
+            ws.send(json.dumps({"type": "history"}))
+            ws.recv()
+
+            best = float("inf")
+            for _ in range(runs):
+                start = time.perf_counter()
+                session.emit(payload)
+                ws.recv()
+                best = min(best, time.perf_counter() - start)
+            return best
+    finally:
+        server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=100_000)
+    parser.add_argument("--level", type=int, default=Config().compression_level)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    fragments = FragmentCache()
+    cg = convert_to_cola(make_graph(args.nodes), fragments)
+    payload = S.ServedGraph(title="bench", graph=cg, index=0).dump_json(fragments)
+    data = payload.encode()
+    raw = len(data)
+
+    print(f"nodes: {args.nodes}, msgpack: {'yes' if msgpack else 'not installed'}")
+    report("json", raw, None, raw)
+    for level in (1, 6, 9):
+        out, seconds = measure(lambda: deflate(data, level), args.runs)
+        report(f"json+deflate({level})", len(out), seconds, raw)
+
+    if msgpack is not None:
+        # the server holds json, msgpack has to transcode every message
+        out, seconds = measure(lambda: msgpack.packb(json.loads(data)), args.runs)
+        report("msgpack", len(out), seconds, raw)
+        packed = out
+        out, _ = measure(lambda: deflate(packed, args.level), args.runs)
+        report(f"msgpack+deflate({args.level})", len(out), None, raw)
+
+    print("delivery over loopback:")
+    for level in (0, args.level):
+        seconds = deliver(payload, level, args.runs)
+        name = "uncompressed" if level == 0 else f"deflate({level})"
+        print(f"{name:>24}: {seconds * 1000:8.1f} ms  {raw / seconds / 1e6:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,34 +5,43 @@
 # when ran as part of visualize-links-ui, simply ignore
 
 try:
-    from lldb import SBDebugger
+    from lldb import SBDebugger, SBCommandReturnObject
 
-    from .lldb_plugin.commands import (
-        SERVER_DICT_KEY,
-        visualize_expr,
-        visualize_type,
-        visualize_diff,
-        visualize_history,
-    )
+    # command registration stays cheap: the command implementations, along with
+    # pydantic, websockets and the server they start, are only imported once a
+    # visualize-* command is first run.
 
-    from .lldb_plugin.server import Server
+    COMMANDS = ["expr", "type", "heap", "diff", "history", "export", "query"]
+
+    def _lazy_command(name: str):
+        def command(
+            debugger: SBDebugger,
+            command: str,
+            result: SBCommandReturnObject,
+            internal_dict: dict,
+        ):
+            from .lldb_plugin import commands
+
+            getattr(commands, f"visualize_{name}")(
+                debugger, command, result, internal_dict
+            )
+
+        command.__name__ = f"visualize_{name}"
+        return command
+
+    visualize_expr = _lazy_command("expr")
+    visualize_type = _lazy_command("type")
+    visualize_heap = _lazy_command("heap")
+    visualize_diff = _lazy_command("diff")
+    visualize_history = _lazy_command("history")
+    visualize_export = _lazy_command("export")
+    visualize_query = _lazy_command("query")
 
     def __lldb_init_module(debugger: SBDebugger, internal_dict: dict):
-        debugger.HandleCommand(
-            "command script add --overwrite -f visualize_links.visualize_expr visualize-expr"
-        )
-        debugger.HandleCommand(
-            "command script add --overwrite -f visualize_links.visualize_type visualize-type"
-        )
-        debugger.HandleCommand(
-            "command script add --overwrite -f visualize_links.visualize_diff visualize-diff"
-        )
-        debugger.HandleCommand(
-            "command script add --overwrite -f visualize_links.visualize_history visualize-history"
-        )
-
-        if SERVER_DICT_KEY not in internal_dict:
-            internal_dict[SERVER_DICT_KEY] = Server()
+        for name in COMMANDS:
+            debugger.HandleCommand(
+                f"command script add --overwrite -f visualize_links.visualize_{name} visualize-{name}"
+            )
 
 except ImportError:
     pass
@@ -2,102 +2,233 @@
 # Licensed under the MIT License.
 
 from collections import OrderedDict, defaultdict
+from itertools import chain
+from typing import Hashable, Iterable, Optional
+
+from pydantic import BaseModel
 
 from . import model as M
 from . import cola_model as C
-
-
-def convert_to_cola(g: M.Graph) -> C.Graph:
-    nodes: OrderedDict[M.NodeId, C.Node] = OrderedDict()
-    node_id2index: dict[M.NodeId, C.NodeIndex] = dict()
-
-    # add value nodes
-    for node, desc in g.nodes.items():
-        assert node not in nodes, "Node ids must be unique!"
-
-        label = desc.attrs_to_label()
-
-        nodes[node] = C.Node(id=node, label=label, tag="value")
-        node_id2index[node] = len(nodes) - 1
-
-    # condense bi-directional links & add value links
-    links_condensed: OrderedDict[M.LinkId, C.Link] = OrderedDict()
-    for link, desc in g.links.items():
-        source, target = link
-        source_index = node_id2index[source]
-        target_index = node_id2index[target]
-
-        assert (
-            link not in links_condensed
-        ), "Multi-edges are impossible by construction!"
-
-        if (target, source) in links_condensed:
-            # bi-directional edge
-            links_condensed[(target, source)].backward_labels = [
-                C.LinkLabel(label=l[0], diff_type=l[1])
-                for l in desc.accessors_to_label()
-            ]
-        else:
-            # add new edge
-            links_condensed[(source, target)] = C.Link(
-                source=source_index,
-                target=target_index,
-                forward_labels=[
-                    C.LinkLabel(label=l[0], diff_type=l[1])
-                    for l in desc.accessors_to_label()
-                ],
-                backward_labels=[],
-                tag="value",
-                diff_type="",
-            )
-
-    # condense name nodes & links
-    name_adj_list: defaultdict[
-        str, defaultdict[M.NameDiffType | None, set[M.NodeId]]
-    ] = defaultdict(lambda: defaultdict(set))
-    for node, desc in g.nodes.items():
-        for name, name_desc in desc.names.items():
-            name_adj_list[name][name_desc.diff_type].add(node)
-
-    inv_name_adj_list: defaultdict[
-        frozenset[tuple[M.NameDiffType | None, frozenset[M.NodeId]]], list[str]
-    ] = defaultdict(list)
-    for name, name_links in name_adj_list.items():
-        frozen_name_links: frozenset[
-            tuple[M.NameDiffType | None, frozenset[M.NodeId]]
-        ] = frozenset(
-            (name_diff, frozenset(targets)) for name_diff, targets in name_links.items()
+from .serialize import FragmentCache
+
+LabelTuple = tuple[str, M.DiffType]
+
+
+class ColaConverter:
+    """Incrementally converts a graph to the layout consumed by the ui.
+
+    Nodes and links can be added batch by batch as traversal discovers them,
+    every call returns what the ui needs to apply. Name nodes are only added
+    by finish(), once every name is known.
+
+    When fragments is given, nodes & links equal to ones seen before are shared
+    from it instead of being rebuilt, so their serialized form is reused too.
+    New ones are only interned by intern(), once the graph was sent, and the
+    finished graph holds a reference to each, see FragmentCache.release_graph.
+    """
+
+    def __init__(self, fragments: Optional[FragmentCache] = None):
+        self.fragments = fragments
+        # nothing to share with an empty cache, e.g. for the first snapshot
+        self.shared = fragments is not None and len(fragments.models) > 0
+        # built by this converter, keyed by id() of the model
+        self.pending: dict[int, tuple[Hashable, BaseModel]] = {}
+
+        self.nodes: OrderedDict[M.NodeId, C.Node] = OrderedDict()
+        self.node_id2index: dict[M.NodeId, C.NodeIndex] = dict()
+
+        # condensed value links, a bi-directional pair shares one cola link
+        self.links: list[C.Link] = []
+        self.link_index: dict[M.LinkId, int] = dict()
+        self.link_labels: dict[M.LinkId, tuple[list[LabelTuple], list[LabelTuple]]] = dict()
+
+    def _lookup(self, key: Hashable) -> Optional[BaseModel]:
+        if not self.shared:
+            return None
+        return self.fragments.lookup(key)  # type: ignore[union-attr]
+
+    def _make_node(self, node_id: M.NodeId, label: list[str], tag: C.Tag) -> C.Node:
+        if self.fragments is None:
+            return C.Node(id=node_id, label=label, tag=tag)
+        key = (node_id, tuple(label), tag)
+        node = self._lookup(key)
+        if node is None:
+            node = C.Node(id=node_id, label=label, tag=tag)
+            self.pending[id(node)] = (key, node)
+        return node  # type: ignore[return-value]
+
+    def _make_link(
+        self,
+        source: C.NodeIndex,
+        target: C.NodeIndex,
+        forward_labels: list[LabelTuple],
+        backward_labels: list[LabelTuple],
+        tag: C.Tag,
+        diff_type: M.DiffType,
+    ) -> C.Link:
+        if self.fragments is not None:
+            key = (source, target, tuple(forward_labels), tuple(backward_labels), tag, diff_type)
+            shared = self._lookup(key)
+            if shared is not None:
+                return shared  # type: ignore[return-value]
+
+        link = C.Link(
+            source=source,
+            target=target,
+            forward_labels=[C.LinkLabel(label=l[0], diff_type=l[1]) for l in forward_labels],
+            backward_labels=[C.LinkLabel(label=l[0], diff_type=l[1]) for l in backward_labels],
+            tag=tag,
+            diff_type=diff_type,
         )
+        if self.fragments is not None:
+            self.pending[id(link)] = (key, link)
+        return link
+
+    def _replace_link(self, index: int, link: C.Link) -> None:
+        old = self.links[index]
+        self.links[index] = link
+        if self.fragments is not None and old is not None:
+            if self.pending.pop(id(old), None) is None:
+                self.fragments.release([old])
+
+    def add_nodes(self, nodes: Iterable[tuple[M.NodeId, M.NodeDesc]]) -> list[C.Node]:
+        """Add value nodes, returning the cola nodes appended."""
+        added: list[C.Node] = []
+        for node, desc in nodes:
+            assert node not in self.nodes, "Node ids must be unique!"
+
+            label = desc.attrs_to_label()
+
+            self.nodes[node] = self._make_node(node, label, "value")
+            self.node_id2index[node] = len(self.nodes) - 1
+            added.append(self.nodes[node])
+
+        return added
+
+    def add_links(
+        self, links: Iterable[tuple[M.LinkId, M.LinkDesc]]
+    ) -> list[tuple[int, C.Link]]:
+        """Add or update value links, returning the changed (index, cola link) pairs."""
+        changed: dict[int, C.Link] = {}
+        for link, desc in links:
+            source, target = link
+
+            if link in self.link_index:
+                # more accessors for a known edge
+                condensed = link
+                forward_labels = desc.accessors_to_label()
+                backward_labels = self.link_labels[condensed][1]
+            elif (target, source) in self.link_index:
+                # bi-directional edge
+                condensed = (target, source)
+                forward_labels = self.link_labels[condensed][0]
+                backward_labels = desc.accessors_to_label()
+            else:
+                # add new edge
+                condensed = link
+                forward_labels = desc.accessors_to_label()
+                backward_labels = []
+                self.link_index[condensed] = len(self.links)
+                self.links.append(None)  # type: ignore[arg-type]
+
+            self.link_labels[condensed] = (forward_labels, backward_labels)
+
+            index = self.link_index[condensed]
+            changed[index] = self._make_link(
+                self.node_id2index[condensed[0]],
+                self.node_id2index[condensed[1]],
+                forward_labels,
+                backward_labels,
+                "value",
+                "",
+            )
+            self._replace_link(index, changed[index])
+
+        return list(changed.items())
+
+    def finish(
+        self, nodes: Iterable[tuple[M.NodeId, M.NodeDesc]]
+    ) -> tuple[list[C.Node], list[tuple[int, C.Link]]]:
+        """Add name nodes & links for the names of all given nodes."""
+        nodes_added: list[C.Node] = []
+        links_added: list[tuple[int, C.Link]] = []
+
+        # condense name nodes & links
+        name_adj_list: defaultdict[
+            str, defaultdict[M.NameDiffType | None, set[M.NodeId]]
+        ] = defaultdict(lambda: defaultdict(set))
+        for node, desc in nodes:
+            for name, name_desc in desc.names.items():
+                name_adj_list[name][name_desc.diff_type].add(node)
+
+        inv_name_adj_list: defaultdict[
+            frozenset[tuple[M.NameDiffType | None, frozenset[M.NodeId]]], list[str]
+        ] = defaultdict(list)
+        for name, name_links in name_adj_list.items():
+            frozen_name_links: frozenset[
+                tuple[M.NameDiffType | None, frozenset[M.NodeId]]
+            ] = frozenset(
+                (name_diff, frozenset(targets)) for name_diff, targets in name_links.items()
+            )
 
-        inv_name_adj_list[frozen_name_links].append(name)
+            inv_name_adj_list[frozen_name_links].append(name)
 
-    # add name nodes & links
-    for name_link, names in inv_name_adj_list.items():
-        id = f"NAME{set(names)}"
+        # add name nodes & links
+        name_links_added: set[M.LinkId] = set()
+        for name_link, names in inv_name_adj_list.items():
+            id = f"NAME{set(names)}"
 
-        nodes[id] = C.Node(id=id, label=names, tag="name")
-        node_id2index[id] = len(nodes) - 1
+            self.nodes[id] = self._make_node(id, names, "name")
+            self.node_id2index[id] = len(self.nodes) - 1
+            nodes_added.append(self.nodes[id])
 
-        for name_diff, targets in name_link:
-            diff_type: M.DiffType = (
-                name_diff if (name_diff == "old" or name_diff == "new") else ""
-            )
-            source_index = node_id2index[id]
-            for target in targets:
-                target_index = node_id2index[target]
-
-                assert (
-                    id,
-                    target,
-                ) not in links_condensed, "Algorithm invariant failed!"
-
-                links_condensed[(id, target)] = C.Link(
-                    source=source_index,
-                    target=target_index,
-                    forward_labels=[],
-                    backward_labels=[],
-                    tag="name",
-                    diff_type=diff_type,
+            for name_diff, targets in name_link:
+                diff_type: M.DiffType = (
+                    name_diff if (name_diff == "old" or name_diff == "new") else ""
                 )
-
-    return C.Graph(nodes=list(nodes.values()), links=list(links_condensed.values()))
+                source_index = self.node_id2index[id]
+                for target in targets:
+                    target_index = self.node_id2index[target]
+
+                    assert (
+                        id,
+                        target,
+                    ) not in name_links_added, "Algorithm invariant failed!"
+                    name_links_added.add((id, target))
+
+                    link = self._make_link(
+                        source_index, target_index, [], [], "name", diff_type
+                    )
+                    self.links.append(link)
+                    links_added.append((len(self.links) - 1, link))
+
+        return nodes_added, links_added
+
+    def graph(self) -> C.Graph:
+        return C.Graph(nodes=list(self.nodes.values()), links=list(self.links))
+
+    def convert(self, g: M.Graph) -> C.Graph:
+        self.add_nodes(g.nodes.items())
+        self.add_links(g.links.items())
+        self.finish(g.nodes.items())
+        return self.graph()
+
+    def intern(self) -> None:
+        """Intern the nodes & links built so far, for later graphs to share."""
+        if self.fragments is not None:
+            self.fragments.add(self.pending.values())
+        self.pending.clear()
+
+    def release(self) -> None:
+        """Release the shared nodes & links of a graph that is discarded."""
+        if self.fragments is not None:
+            # models still pending were never interned and are skipped
+            self.fragments.release(chain(self.nodes.values(), self.links))
+        self.pending.clear()
+
+
+def convert_to_cola(g: M.Graph, fragments: Optional[FragmentCache] = None) -> C.Graph:
+    converter = ColaConverter(fragments)
+    cg = converter.convert(g)
+    converter.intern()
+    return cg
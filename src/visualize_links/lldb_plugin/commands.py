@@ -1,19 +1,154 @@
 # Copyright (c) Indrajit Banerjee
 # Licensed under the MIT License.
 
-from typing import Iterable
+import argparse
+import atexit
+import shlex
+import time
+from typing import Callable, Iterable, Iterator, Optional
 
+import lldb
 from lldb import (
     SBValue,
     SBDebugger,
     SBCommandReturnObject,
+    SBFrame,
+    SBProcess,
+    SBTarget,
+    SBType,
 )
 
 from . import lldb_utils as utils
+from . import model as M
+from .export import EXPORT_FORMATS, Snapshot, export_snapshots
+from .config import Config
 from .graph import GraphBuilder
+from .hub import HubClient
+from .query import QUERY_HELP, QueryError
 from .server import Server
+from .session import Session
 
 SERVER_DICT_KEY = "visualize_links_server"
+SESSION_DICT_KEY = "visualize_links_session"
+RESOLVER_DICT_KEY = "visualize_links_resolver"
+
+
+class _ArgumentParser(argparse.ArgumentParser):
+    # report errors back to the command instead of exiting lldb
+    def error(self, message: str):
+        raise ValueError(f"{self.prog}: {message}")
+
+
+# destroy callbacks are kept alive here, lldb only holds a borrowed reference
+_destroy_callbacks: list[Callable[[int], None]] = []
+
+
+def _stop_with_debugger(debugger: SBDebugger, stop: Callable[[], None]) -> None:
+    """Run stop once debugger is destroyed.
+
+    lldb doesn't finalize python when a debugger is destroyed, so atexit only
+    covers lldb exiting. Debugger destroy callbacks need lldb 17 or newer.
+    """
+
+    def callback(debugger_id: int) -> None:
+        stop()
+
+    add = getattr(debugger, "AddDestroyCallback", None) or getattr(
+        debugger, "SetDestroyCallback", None
+    )
+    if add is not None:
+        _destroy_callbacks.append(callback)
+        add(callback)
+    atexit.register(stop)
+
+
+def _get_session(
+    debugger: SBDebugger, internal_dict: dict, result: SBCommandReturnObject
+) -> Optional[Session | HubClient]:
+    """Return where this debugger publishes to, set up on first use.
+
+    A running hub is preferred, otherwise a server is started in process. A
+    hub connection that failed is replaced the same way on next use.
+    """
+    session = internal_dict.get(SESSION_DICT_KEY)
+    if isinstance(session, HubClient) and session.closed:
+        session.stop()
+        del internal_dict[SESSION_DICT_KEY]
+        result.AppendWarning("visualize-links lost the hub connection, reconnecting")
+
+    if SESSION_DICT_KEY not in internal_dict:
+        config = Config.from_env()
+        name = utils.get_session_name(debugger)
+
+        client = HubClient.connect(config, name)
+        if client is not None:
+            _stop_with_debugger(debugger, client.stop)
+            internal_dict[SESSION_DICT_KEY] = client
+            result.AppendMessage(
+                f"visualize-links publishing to hub {client.url()} as session {name}"
+            )
+        else:
+            try:
+                server = Server(config)
+            except OSError as e:
+                result.AppendWarning(str(e))
+                return None
+
+            _stop_with_debugger(debugger, server.stop)
+            internal_dict[SERVER_DICT_KEY] = server
+            internal_dict[SESSION_DICT_KEY] = server.session(name)
+            result.AppendMessage(
+                f"visualize-links server listening on {server.url()}, ui at {server.ui_url()}"
+            )
+
+    return internal_dict[SESSION_DICT_KEY]
+
+
+def _parse_args(
+    parser: argparse.ArgumentParser, command: str, result: SBCommandReturnObject
+) -> Optional[argparse.Namespace]:
+    try:
+        return parser.parse_intermixed_args(shlex.split(command))
+    except ValueError as e:
+        result.AppendWarning(f"{e}\n{parser.format_usage()}")
+        return None
+
+
+def _comma_set(arg: str) -> set[str]:
+    return {item.strip() for item in arg.split(",") if item.strip()}
+
+
+def _add_plan_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options compiled into the traversal plan, see GraphBuilder."""
+    parser.add_argument(
+        "--follow", type=_comma_set, help="only follow these pointer fields"
+    )
+    parser.add_argument("--attrs", type=_comma_set, help="only show these int fields")
+
+
+def _new_builder(
+    args: argparse.Namespace, allowed_types: Optional[set[str]]
+) -> GraphBuilder:
+    return GraphBuilder(
+        allowed_types=allowed_types, follow=args.follow, attrs=args.attrs
+    )
+
+
+def _append_pruned(builder: GraphBuilder, result: SBCommandReturnObject) -> None:
+    pruned = builder.pruned_fields()
+    if pruned:
+        result.AppendMessage(
+            "pruned fields: "
+            + ", ".join(f"{type}.{{{','.join(fields)}}}" for type, fields in pruned.items())
+        )
+
+
+_expr_parser = _ArgumentParser(prog="visualize-expr", add_help=False)
+_expr_parser.add_argument("expr")
+_expr_parser.add_argument(
+    "--types", type=_comma_set, help="only follow pointers to these types"
+)
+_add_plan_arguments(_expr_parser)
 
 
 def visualize_expr(
@@ -22,30 +157,61 @@ def visualize_expr(
     result: SBCommandReturnObject,
     internal_dict: dict,
 ):
-    args = command.strip().split()
-    if len(args) != 1:
-        result.AppendWarning(
-            "visualize-expr requires exactly one argument: an expression!"
-        )
+    args = _parse_args(_expr_parser, command, result)
+    if args is None:
         return
 
-    expr_str = args[0]
+    expr_str: str = args.expr
 
     frame = utils.get_current_frame(debugger)
-    value: SBValue = frame.EvaluateExpression(expr_str)
-    assert value.IsValid(), "Failed to evaluate given <expr>"
-
-    builder = GraphBuilder(allowed_types=None)
-    builder.extend_from_value(value, {expr_str})
-    g = builder.graph()
+    if RESOLVER_DICT_KEY not in internal_dict:
+        internal_dict[RESOLVER_DICT_KEY] = utils.ExpressionResolver()
+    resolver: utils.ExpressionResolver = internal_dict[RESOLVER_DICT_KEY]
+    try:
+        value, path = resolver.resolve(frame, expr_str)
+    except ValueError as e:
+        result.AppendWarning(str(e))
+        return
 
-    server: Server = internal_dict[SERVER_DICT_KEY]
+    session = _get_session(debugger, internal_dict, result)
+    if session is None:
+        return
 
     desc = f"expr: {expr_str}"
     label = utils.get_label_for_frame(frame, desc)
-    index = server.publish_new_graph(label, g)
 
-    result.AppendMessage(f"{index}: {label}")
+    # stream batches to the ui while traversal is still running
+    builder = _new_builder(args, args.types)
+    batches = builder.iter_extend([(value, {expr_str})], session.config.batch_size)
+    try:
+        index = session.publish_graph_stream(label, batches)
+    except ConnectionError as e:
+        result.AppendWarning(f"visualize-expr: {e}")
+        return
+
+    result.AppendMessage(f"{index}: {label} (resolved via {path})")
+    _append_pruned(builder, result)
+
+
+def _pointer_variables(frame: SBFrame, allowed_types: set[str]) -> Iterable[SBValue]:
+    """Initialized frame variables pointing to one of allowed_types."""
+
+    def filter_fn(value: SBValue) -> bool:
+        return (
+            value.IsValid()
+            and utils.is_pointer_to_type(value.type, allowed_types)
+            and utils.is_initialized_in_current_frame(value, frame)
+        )
+
+    return filter(filter_fn, frame.variables)
+
+
+_type_parser = _ArgumentParser(prog="visualize-type", add_help=False)
+_type_parser.add_argument("type")
+_type_parser.add_argument(
+    "--types", type=_comma_set, default=set(), help="also visualize these types"
+)
+_add_plan_arguments(_type_parser)
 
 
 def visualize_type(
@@ -54,62 +220,207 @@ def visualize_type(
     result: SBCommandReturnObject,
     internal_dict: dict,
 ):
-    args = command.strip().split()
-    if len(args) != 1:
-        result.AppendWarning("visualize requires exactly one argument: a type name!")
+    args = _parse_args(_type_parser, command, result)
+    if args is None:
         return
 
-    allowed_types = {args[0]}
+    allowed_types = {args.type} | args.types
 
     frame = utils.get_current_frame(debugger)
+    variables = _pointer_variables(frame, allowed_types)
 
-    def filter_fn(value: SBValue) -> bool:
-        return (
-            value.IsValid()
-            and utils.is_pointer_to_type(value.type, allowed_types)
-            and utils.is_initialized_in_current_frame(value, frame)
-        )
+    session = _get_session(debugger, internal_dict, result)
+    if session is None:
+        return
 
-    variables: Iterable[SBValue] = filter(filter_fn, frame.variables)
+    desc = f"type: {','.join([args.type, *sorted(args.types - {args.type})])}"
+    label = utils.get_label_for_frame(frame, desc)
 
-    builder = GraphBuilder(allowed_types=allowed_types)
-    for variable in variables:
-        builder.extend_from_value(variable, {variable.name})
-    g = builder.graph()
+    builder = _new_builder(args, allowed_types)
+    batches = builder.iter_extend(
+        ((variable, {variable.name}) for variable in variables),
+        session.config.batch_size,
+    )
+    try:
+        index = session.publish_graph_stream(label, batches)
+    except ConnectionError as e:
+        result.AppendWarning(f"visualize-type: {e}")
+        return
 
-    server: Server = internal_dict[SERVER_DICT_KEY]
+    result.AppendMessage(f"{index}: {label}")
+    _append_pruned(builder, result)
 
-    desc = f"type: {args[0]}"
-    label = utils.get_label_for_frame(frame, desc)
-    index = server.publish_new_graph(label, g)
 
-    result.AppendMessage(f"{index}: {label}")
+_heap_parser = _ArgumentParser(prog="visualize-heap", add_help=False)
+_heap_parser.add_argument("type")
+_heap_parser.add_argument("--align", type=int)
+_heap_parser.add_argument(
+    "--allocator",
+    choices=["glibc", "none"],
+    help="check the malloc chunk header before each instance, glibc on linux-gnu targets",
+)
+_add_plan_arguments(_heap_parser)
 
 
-def visualize_diff(
+def visualize_heap(
     debugger: SBDebugger,
     command: str,
     result: SBCommandReturnObject,
     internal_dict: dict,
 ):
-    args = command.strip().split()
-    if len(args) != 2:
+    args = _parse_args(_heap_parser, command, result)
+    if args is None:
+        return
+
+    try:
+        from . import heap
+    except ImportError:
         result.AppendWarning(
-            "visualize-diff requires exactly two arguments: a pair of graph indices!"
+            "visualize-heap requires numpy to be installed: pip install visualize-links[heap]"
         )
         return
 
-    try:
-        index1 = int(args[0])
-        index2 = int(args[1])
-    except ValueError:
+    target: SBTarget = debugger.GetSelectedTarget()
+    process: SBProcess = target.GetProcess()
+    struct_type: SBType = target.FindFirstType(args.type)
+    if not struct_type.IsValid() or struct_type.GetTypeClass() != lldb.eTypeClassStruct:
+        result.AppendWarning(f"visualize-heap: no struct type named {args.type}!")
+        return
+
+    pointer_size: int = target.GetAddressByteSize()
+    align: int = args.align or pointer_size
+    if align % pointer_size != 0:
         result.AppendWarning(
-            "visualize-diff requires exactly two arguments: a pair of graph indices!"
+            f"visualize-heap: --align must be a multiple of the pointer size {pointer_size}!"
         )
         return
 
-    server: Server = internal_dict[SERVER_DICT_KEY]
-    server.publish_diff_graph(index1, index2)
+    allocator = args.allocator or ("glibc" if "linux-gnu" in target.GetTriple() else "none")
+    header = None
+    if allocator == "glibc":
+        header = heap.glibc_header(struct_type.GetByteSize(), pointer_size)
+        # chunks are aligned to two words
+        align = max(align, 2 * pointer_size)
+
+    # misaligned (packed) pointers can't be checked word by word, nor fields
+    # spanning two words
+    self_offsets, other_offsets = utils.get_pointer_fields(struct_type)
+    layout = heap.HeapLayout(
+        size=struct_type.GetByteSize(),
+        pointer_size=pointer_size,
+        little_endian=target.GetByteOrder() == lldb.eByteOrderLittle,
+        self_offsets=[o for o in self_offsets if o % pointer_size == 0],
+        other_offsets=[o for o in other_offsets if o % pointer_size == 0],
+        align=align,
+        field_ranges=tuple(
+            heap.FieldRange(*r)
+            for r in utils.get_field_ranges(struct_type)
+            if r[0] % pointer_size + r[1] <= pointer_size
+        ),
+        header=header,
+    )
+    if not layout.self_offsets and not layout.other_offsets:
+        result.AppendWarning(
+            f"visualize-heap: {args.type} has no pointer fields to recognize instances by!"
+        )
+        return
+
+    heap_ranges, readable_ranges = utils.get_memory_regions(process)
+    start = time.perf_counter()
+    scan = heap.scan_heap(
+        [heap.HeapRegion(*r) for r in heap_ranges],
+        [heap.HeapRegion(*r) for r in readable_ranges],
+        lambda addr, size: utils.read_memory(process, addr, size),
+        layout,
+    )
+    elapsed = time.perf_counter() - start
+
+    session = _get_session(debugger, internal_dict, result)
+    if session is None:
+        return
+
+    allowed_types = {args.type}
+    frame = utils.get_current_frame(debugger)
+    label = utils.get_label_for_frame(frame, f"heap: {args.type}")
+
+    builder = _new_builder(args, allowed_types)
+    reachable: set[M.NodeId] = set()
+    orphans: list[M.NodeId] = []
+
+    variables = _pointer_variables(frame, allowed_types)
+
+    def batches() -> Iterator[M.GraphBatch]:
+        # traverse from variables first, what they reach isn't orphaned
+        yield from builder.iter_extend(
+            ((variable, {variable.name}) for variable in variables),
+            session.config.batch_size,
+        )
+        reachable.update(builder.nodes.keys())
+
+        yield from builder.iter_extend(
+            (
+                (utils.value_at_address(target, addr, struct_type), set())
+                for addr in scan.addresses.tolist()
+            ),
+            session.config.batch_size,
+        )
+
+        # names must be set before the stream ends
+        orphans.extend(
+            heap.orphan_roots(builder.nodes.keys(), builder.links.keys(), reachable)
+        )
+        for node in orphans:
+            builder.nodes[node].names[heap.ORPHAN_NAME] = M.NameDesc(diff_type=None)
+
+    try:
+        index = session.publish_graph_stream(label, batches())
+    except ConnectionError as e:
+        result.AppendWarning(f"visualize-heap: {e}")
+        return
+
+    result.AppendMessage(f"{index}: {label}")
+    result.AppendMessage(
+        f"{len(scan.addresses)} {args.type} instances found, "
+        f"{len(builder.nodes) - len(reachable)} unreachable from variables "
+        f"in {len(orphans)} structures"
+    )
+    # isolated instances are the likeliest false positives
+    result.AppendMessage(
+        f"{scan.candidates} candidates, {scan.linked} instances linked to others, "
+        f"{len(scan.addresses) - scan.linked} isolated "
+        f"(allocator: {allocator})"
+    )
+    result.AppendMessage(
+        f"scanned {scan.bytes_scanned / (1 << 20):.0f} MB in {elapsed:.2f}s"
+    )
+    _append_pruned(builder, result)
+
+
+_diff_parser = _ArgumentParser(prog="visualize-diff", add_help=False)
+_diff_parser.add_argument("uid1", type=int)
+_diff_parser.add_argument("uid2", type=int)
+_diff_parser.add_argument("--structural", action="store_true")
+
+
+def visualize_diff(
+    debugger: SBDebugger,
+    command: str,
+    result: SBCommandReturnObject,
+    internal_dict: dict,
+):
+    args = _parse_args(_diff_parser, command, result)
+    if args is None:
+        return
+
+    session = _get_session(debugger, internal_dict, result)
+    if session is None:
+        return
+    try:
+        session.publish_diff_graph(args.uid1, args.uid2, structural=args.structural)
+    except KeyError as e:
+        result.AppendWarning(f"visualize-diff: no graph with index {e}!")
+    except ConnectionError as e:
+        result.AppendWarning(f"visualize-diff: {e}")
 
 
 def visualize_history(
@@ -118,8 +429,118 @@ def visualize_history(
     result: SBCommandReturnObject,
     internal_dict: dict,
 ):
-    server: Server = internal_dict[SERVER_DICT_KEY]
+    session = _get_session(debugger, internal_dict, result)
+    if session is None:
+        return
 
-    for index, label in server.history:
+    try:
+        history = list(session.history)
+    except ConnectionError as e:
+        result.AppendWarning(f"visualize-history: {e}")
+        return
+
+    for index, label in history:
         result.AppendMessage(f"{index} {label}")
 
+
+_export_parser = _ArgumentParser(prog="visualize-export", add_help=False)
+_export_parser.add_argument("uid", type=int, nargs="?")
+_export_parser.add_argument("--history", action="store_true")
+_export_parser.add_argument("--format", choices=EXPORT_FORMATS, required=True)
+_export_parser.add_argument("file")
+
+
+def visualize_export(
+    debugger: SBDebugger,
+    command: str,
+    result: SBCommandReturnObject,
+    internal_dict: dict,
+):
+    args = _parse_args(_export_parser, command, result)
+    if args is None:
+        return
+
+    if (args.uid is None) == (not args.history):
+        result.AppendWarning(
+            "visualize-export requires exactly one of: a graph index or --history!"
+        )
+        return
+
+    session = _get_session(debugger, internal_dict, result)
+    if session is None:
+        return
+
+    if args.history:
+
+        def history_snapshots() -> Iterator[Snapshot]:
+            prev = None
+            for index, item in session.history.items():
+                yield Snapshot(index=index, label=item.label, graph=item.graph, prev=prev)
+                prev = item.graph
+
+        snapshots = history_snapshots()
+    else:
+        try:
+            item = session.history.at(args.uid)
+        except KeyError:
+            result.AppendWarning(f"visualize-export: no graph with index {args.uid}!")
+            return
+        except ConnectionError as e:
+            result.AppendWarning(f"visualize-export: {e}")
+            return
+
+        snapshots = iter([Snapshot(index=args.uid, label=item.label, graph=item.graph, prev=None)])
+
+    try:
+        export_snapshots(snapshots, args.format, args.file, history=args.history)
+    # ConnectionError is an OSError, history is read from a hub while exporting
+    except (RuntimeError, OSError) as e:
+        result.AppendWarning(f"visualize-export: {e}")
+        return
+
+    result.AppendMessage(f"exported to {args.file}")
+
+
+_query_parser = _ArgumentParser(
+    prog="visualize-query",
+    add_help=False,
+    epilog=QUERY_HELP,
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+)
+_query_parser.add_argument("uid", type=int)
+_query_parser.add_argument("query", nargs="+")
+_query_parser.add_argument("--hops", type=int, default=0)
+
+
+def visualize_query(
+    debugger: SBDebugger,
+    command: str,
+    result: SBCommandReturnObject,
+    internal_dict: dict,
+):
+    args = _parse_args(_query_parser, command, result)
+    if args is None:
+        return
+
+    query = " ".join(args.query)
+    session = _get_session(debugger, internal_dict, result)
+    if session is None:
+        return
+
+    try:
+        matches = session.publish_query_graph(args.uid, query, args.hops)
+    except KeyError:
+        result.AppendWarning(f"visualize-query: no graph with index {args.uid}!")
+        return
+    except QueryError as e:
+        result.AppendWarning(f"visualize-query: {e}")
+        return
+    except ConnectionError as e:
+        result.AppendWarning(f"visualize-query: {e}")
+        return
+
+    result.AppendMessage(f"{len(matches)} matching nodes")
+    for node in sorted(matches)[:20]:
+        result.AppendMessage(f"  {node}")
+    if len(matches) > 20:
+        result.AppendMessage(f"  ... {len(matches) - 20} more")
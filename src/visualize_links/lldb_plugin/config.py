@@ -0,0 +1,48 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+import os
+from typing import NamedTuple, Optional
+
+ENV_PREFIX = "VISUALIZE_LINKS_"
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.environ.get(ENV_PREFIX + name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"ignoring {ENV_PREFIX + name}={value!r}, expected an integer, using {default}")
+        return default
+
+
+class Config(NamedTuple):
+    host: str = "localhost"
+    port: int = 8765
+    # consecutive ports tried starting at port when it is already taken
+    port_attempts: int = 10
+    # port a hub process accepts publishing debuggers on
+    hub_port: int = 8764
+    # graphs kept in history before the oldest are evicted, None keeps all
+    max_history: Optional[int] = None
+    # nodes discovered before a partial graph is streamed to the ui
+    batch_size: int = 256
+    # zlib level of permessage-deflate on ui connections, 0 disables compression.
+    # graph json compresses ~20x, level 1 is several times faster than higher
+    # levels for a few percent larger messages
+    compression_level: int = 1
+
+    @staticmethod
+    def from_env() -> "Config":
+        default = Config()
+        return Config(
+            host=os.environ.get(ENV_PREFIX + "HOST", default.host),
+            port=_env_int("PORT", default.port) or default.port,
+            port_attempts=_env_int("PORT_ATTEMPTS", default.port_attempts) or default.port_attempts,
+            hub_port=_env_int("HUB_PORT", default.hub_port) or default.hub_port,
+            max_history=_env_int("MAX_HISTORY", default.max_history),
+            batch_size=_env_int("BATCH_SIZE", default.batch_size) or default.batch_size,
+            compression_level=_env_int("COMPRESSION_LEVEL", default.compression_level),
+        )
@@ -0,0 +1,422 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+import json
+import tempfile
+from typing import IO, Callable, Iterable, Iterator, Literal, NamedTuple, Optional, TypeAlias
+
+from . import model as M
+from .history import HistoryLabel
+
+ExportFormat: TypeAlias = Literal["dot", "graphml", "jsonl", "parquet"]
+ExportDiffType: TypeAlias = Literal["", "added", "removed", "changed"]
+
+EXPORT_FORMATS: tuple[ExportFormat, ...] = ("dot", "graphml", "jsonl", "parquet")
+
+# rows buffered per parquet row group, keeps memory bounded for huge graphs
+PARQUET_BATCH_SIZE = 65536
+
+# dot attribute name prefix of struct fields
+DOT_FIELD_PREFIX = "field_"
+
+
+class Snapshot(NamedTuple):
+    index: int
+    label: HistoryLabel
+    graph: M.Graph
+    # previous snapshot used to compute diff markers, None for standalone exports
+    prev: Optional[M.Graph]
+
+
+class NodeRecord(NamedTuple):
+    id: M.NodeId
+    type: str
+    attrs: dict[str, M.AttrScalar]
+    names: list[str]
+    diff: ExportDiffType
+
+
+class LinkRecord(NamedTuple):
+    source: M.NodeId
+    target: M.NodeId
+    accessors: list[str]
+    diff: ExportDiffType
+
+
+def _node_record(node: M.NodeId, desc: M.NodeDesc, diff: ExportDiffType) -> NodeRecord:
+    return NodeRecord(
+        id=node,
+        type=desc.type.name,
+        attrs={attr: value.scalar for attr, value in desc.attrs.items()},
+        names=sorted(desc.names.keys()),
+        diff=diff,
+    )
+
+
+def _link_record(link: M.LinkId, desc: M.LinkDesc, diff: ExportDiffType) -> LinkRecord:
+    source, target = link
+    return LinkRecord(
+        source=source, target=target, accessors=sorted(desc.accessors.keys()), diff=diff
+    )
+
+
+def _node_diff(old: M.NodeDesc, new: M.NodeDesc) -> ExportDiffType:
+    same = (
+        old.type == new.type
+        and {a: v.scalar for a, v in old.attrs.items()}
+        == {a: v.scalar for a, v in new.attrs.items()}
+        and old.names.keys() == new.names.keys()
+    )
+    return "" if same else "changed"
+
+
+def iter_nodes(g: M.Graph, prev: Optional[M.Graph] = None) -> Iterator[NodeRecord]:
+    """Yield node records of g, marked against prev when given.
+
+    Nodes only present in prev are yielded last with a "removed" marker.
+    """
+    for node, desc in g.nodes.items():
+        if prev is None:
+            yield _node_record(node, desc, "")
+        elif node not in prev.nodes:
+            yield _node_record(node, desc, "added")
+        else:
+            yield _node_record(node, desc, _node_diff(prev.nodes[node], desc))
+
+    if prev is not None:
+        for node, desc in prev.nodes.items():
+            if node not in g.nodes:
+                yield _node_record(node, desc, "removed")
+
+
+def iter_links(g: M.Graph, prev: Optional[M.Graph] = None) -> Iterator[LinkRecord]:
+    """Yield link records of g, marked against prev when given."""
+    for link, desc in g.links.items():
+        if prev is None:
+            yield _link_record(link, desc, "")
+        elif link not in prev.links:
+            yield _link_record(link, desc, "added")
+        elif prev.links[link].accessors.keys() != desc.accessors.keys():
+            yield _link_record(link, desc, "changed")
+        else:
+            yield _link_record(link, desc, "")
+
+    if prev is not None:
+        for link, desc in prev.links.items():
+            if link not in g.links:
+                yield _link_record(link, desc, "removed")
+
+
+def _dot_quote(s: str) -> str:
+    return '"' + s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+def _dot_attrs(attrs: dict[str, object]) -> str:
+    return ", ".join(f"{_dot_quote(k)}={_dot_quote(str(v))}" for k, v in attrs.items())
+
+
+def _history_id(s: Snapshot, node: M.NodeId) -> str:
+    # node ids repeat across snapshots
+    return f"{s.index}:{node}"
+
+
+def _iter_dot_elements(s: Snapshot, history: bool) -> Iterator[str]:
+    def node_id(node: M.NodeId) -> str:
+        return _dot_quote(_history_id(s, node) if history else node)
+
+    for n in iter_nodes(s.graph, s.prev):
+        attrs: dict[str, object] = {
+            "label": "\n".join([n.type] + [f"{a}: {v}" for a, v in n.attrs.items()]),
+            "type": n.type,
+            # prefixed so fields can't clash with or inject dot attributes
+            **{DOT_FIELD_PREFIX + a: v for a, v in n.attrs.items()},
+        }
+        if history:
+            attrs["snapshot"] = s.index
+            attrs["node_id"] = n.id
+        if n.names:
+            attrs["names"] = ",".join(n.names)
+        if n.diff:
+            attrs["diff"] = n.diff
+        if n.diff == "removed":
+            attrs["style"] = "dashed"
+        yield f"  {node_id(n.id)} [{_dot_attrs(attrs)}];\n"
+
+    for l in iter_links(s.graph, s.prev):
+        attrs = {"label": ",".join(l.accessors)}
+        if history:
+            attrs["snapshot"] = s.index
+        if l.diff:
+            attrs["diff"] = l.diff
+        if l.diff == "removed":
+            attrs["style"] = "dashed"
+        yield f"  {node_id(l.source)} -> {node_id(l.target)} [{_dot_attrs(attrs)}];\n"
+
+
+def iter_dot(snapshots: Iterable[Snapshot], history: bool = False) -> Iterator[str]:
+    """Yield a DOT document holding a single digraph.
+
+    Readers like networkx and Gephi only load the first graph of a document, so
+    with history every snapshot goes into one graph: each element carries the
+    index of its snapshot and node ids are prefixed by it.
+    """
+    if history:
+        yield 'digraph "history" {\n'
+        for s in snapshots:
+            yield from _iter_dot_elements(s, history=True)
+        yield "}\n"
+        return
+
+    for s in snapshots:
+        yield f"digraph {_dot_quote(f'snapshot_{s.index}')} {{\n"
+        yield f"  label={_dot_quote(f'#{s.index} ({s.label.desc})')};\n"
+        yield from _iter_dot_elements(s, history=False)
+        yield "}\n"
+
+
+def _xml_escape(s: str) -> str:
+    return (
+        s.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+    )
+
+
+def _graphml_type(scalar: M.AttrScalar) -> str:
+    if isinstance(scalar, int):
+        return "long"
+    if isinstance(scalar, float):
+        return "double"
+    return "string"
+
+
+def _graphml_data(key: str, value: object) -> str:
+    return f'<data key="{key}">{_xml_escape(str(value))}</data>'
+
+
+def iter_graphml(snapshots: Iterable[Snapshot], history: bool = False) -> Iterator[str]:
+    """Yield a GraphML document holding a single graph.
+
+    With history every snapshot goes into one graph as for dot. GraphML
+    declares attribute keys before the graph, so elements are spooled to a
+    temporary file while the keys are collected, walking the snapshots once
+    without holding them in memory.
+    """
+    attr_types: dict[str, str] = {}
+    attr_keys: dict[str, str] = {}
+
+    def node_data(n: NodeRecord) -> Iterator[str]:
+        for attr, value in n.attrs.items():
+            if attr not in attr_keys:
+                attr_keys[attr] = f"a{len(attr_keys)}"
+                attr_types[attr] = _graphml_type(value)
+            yield _graphml_data(attr_keys[attr], value)
+
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as body:
+        if history:
+            body.write('  <graph id="history" edgedefault="directed">\n')
+
+        for s in snapshots:
+            if history:
+                prefix = f"{s.index}:"
+                snapshot = [_graphml_data("snapshot", s.index)]
+            else:
+                prefix = ""
+                snapshot = []
+                body.write(f'  <graph id="snapshot_{s.index}" edgedefault="directed">\n')
+                body.write(f"    {_graphml_data('desc', s.label.desc)}\n")
+
+            for n in iter_nodes(s.graph, s.prev):
+                fields = [_graphml_data("type", n.type), *snapshot]
+                if history:
+                    fields.append(_graphml_data("node_id", n.id))
+                if n.names:
+                    fields.append(_graphml_data("names", ",".join(n.names)))
+                if n.diff:
+                    fields.append(_graphml_data("diff", n.diff))
+                fields.extend(node_data(n))
+                body.write(
+                    f'    <node id="{_xml_escape(prefix + n.id)}">{"".join(fields)}</node>\n'
+                )
+
+            for l in iter_links(s.graph, s.prev):
+                fields = [_graphml_data("accessors", ",".join(l.accessors)), *snapshot]
+                if l.diff:
+                    fields.append(_graphml_data("diff", l.diff))
+                body.write(
+                    f'    <edge source="{_xml_escape(prefix + l.source)}" '
+                    f'target="{_xml_escape(prefix + l.target)}">{"".join(fields)}</edge>\n'
+                )
+
+            if not history:
+                body.write("  </graph>\n")
+
+        if history:
+            body.write("  </graph>\n")
+
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+        yield '  <key id="type" for="node" attr.name="type" attr.type="string"/>\n'
+        yield '  <key id="names" for="node" attr.name="names" attr.type="string"/>\n'
+        yield '  <key id="accessors" for="edge" attr.name="accessors" attr.type="string"/>\n'
+        yield '  <key id="diff" for="all" attr.name="diff" attr.type="string"/>\n'
+        yield '  <key id="desc" for="graph" attr.name="desc" attr.type="string"/>\n'
+        if history:
+            yield '  <key id="snapshot" for="all" attr.name="snapshot" attr.type="long"/>\n'
+            yield '  <key id="node_id" for="node" attr.name="node_id" attr.type="string"/>\n'
+        for attr, key in attr_keys.items():
+            yield (
+                f'  <key id="{key}" for="node" attr.name="{_xml_escape(attr)}" '
+                f'attr.type="{attr_types[attr]}"/>\n'
+            )
+
+        body.seek(0)
+        yield from body
+        yield "</graphml>\n"
+
+
+def _node_json(n: NodeRecord) -> dict:
+    return {"id": n.id, "type": n.type, "attrs": n.attrs, "names": n.names, "diff": n.diff}
+
+
+def _link_json(l: LinkRecord) -> dict:
+    return {"source": l.source, "target": l.target, "accessors": l.accessors, "diff": l.diff}
+
+
+def iter_jsonl(snapshot: Snapshot) -> Iterator[str]:
+    """Yield one JSON line per node and link of a single snapshot, then one per
+    struct type with pruned fields."""
+    for n in iter_nodes(snapshot.graph, snapshot.prev):
+        yield json.dumps({"kind": "node", **_node_json(n)}) + "\n"
+    for l in iter_links(snapshot.graph, snapshot.prev):
+        yield json.dumps({"kind": "link", **_link_json(l)}) + "\n"
+    for type, fields in snapshot.graph.pruned_fields.items():
+        yield json.dumps({"kind": "pruned", "type": type, "fields": fields}) + "\n"
+
+
+def iter_history_jsonl(snapshots: Iterable[Snapshot]) -> Iterator[str]:
+    """Yield one JSON line per snapshot, elements marked against the previous one."""
+    for s in snapshots:
+        record = {
+            "index": s.index,
+            "label": s.label.model_dump(),
+            "nodes": [_node_json(n) for n in iter_nodes(s.graph, s.prev)],
+            "links": [_link_json(l) for l in iter_links(s.graph, s.prev)],
+            "pruned_fields": s.graph.pruned_fields,
+        }
+        yield json.dumps(record) + "\n"
+
+
+def _iter_parquet_rows(snapshots: Iterable[Snapshot]) -> Iterator[dict]:
+    for s in snapshots:
+        for n in iter_nodes(s.graph, s.prev):
+            yield {
+                "snapshot": s.index,
+                "kind": "node",
+                "id": n.id,
+                "source": None,
+                "target": None,
+                "type": n.type,
+                "attrs": json.dumps(n.attrs),
+                "names": n.names,
+                "accessors": None,
+                "fields": None,
+                "diff": n.diff,
+            }
+        for l in iter_links(s.graph, s.prev):
+            yield {
+                "snapshot": s.index,
+                "kind": "link",
+                "id": None,
+                "source": l.source,
+                "target": l.target,
+                "type": None,
+                "attrs": None,
+                "names": None,
+                "accessors": l.accessors,
+                "fields": None,
+                "diff": l.diff,
+            }
+        for type, fields in s.graph.pruned_fields.items():
+            yield {
+                "snapshot": s.index,
+                "kind": "pruned",
+                "id": None,
+                "source": None,
+                "target": None,
+                "type": type,
+                "attrs": None,
+                "names": None,
+                "accessors": None,
+                "fields": fields,
+                "diff": "",
+            }
+
+
+def write_parquet(snapshots: Iterable[Snapshot], path: str) -> None:
+    """Write one row per node, link and struct type with pruned fields, tagged
+    with its snapshot index.
+
+    Requires the optional pyarrow dependency.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("parquet export requires pyarrow to be installed") from e
+
+    schema = pa.schema(
+        [
+            ("snapshot", pa.int64()),
+            ("kind", pa.string()),
+            ("id", pa.string()),
+            ("source", pa.string()),
+            ("target", pa.string()),
+            ("type", pa.string()),
+            ("attrs", pa.string()),
+            ("names", pa.list_(pa.string())),
+            ("accessors", pa.list_(pa.string())),
+            ("fields", pa.list_(pa.string())),
+            ("diff", pa.string()),
+        ]
+    )
+
+    with pq.ParquetWriter(path, schema) as writer:
+        batch: list[dict] = []
+        for row in _iter_parquet_rows(snapshots):
+            batch.append(row)
+            if len(batch) == PARQUET_BATCH_SIZE:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch.clear()
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+
+def _write_chunks(chunks: Iterable[str], path: str) -> None:
+    f: IO[str]
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def export_snapshots(
+    snapshots: Iterable[Snapshot], format: ExportFormat, path: str, history: bool
+) -> None:
+    """Stream snapshots to path in the given format.
+
+    history selects the one-record-per-snapshot layout for jsonl and a single
+    graph of all snapshots for dot and graphml.
+    """
+    writers: dict[ExportFormat, Callable[[], None]] = {
+        "dot": lambda: _write_chunks(iter_dot(snapshots, history), path),
+        "graphml": lambda: _write_chunks(iter_graphml(snapshots, history), path),
+        "jsonl": lambda: _write_chunks(
+            iter_history_jsonl(snapshots)
+            if history
+            else (line for s in snapshots for line in iter_jsonl(s)),
+            path,
+        ),
+        "parquet": lambda: write_parquet(snapshots, path),
+    }
+    writers[format]()
@@ -1,7 +1,7 @@
 # Copyright (c) Indrajit Banerjee
 # Licensed under the MIT License.
 
-from typing import Optional, cast
+from typing import Iterable, Iterator, NamedTuple, Optional, cast
 
 import lldb
 from lldb import SBValue, SBTypeMember, SBType
@@ -10,42 +10,124 @@ from . import lldb_utils as utils
 from . import model as M
 
 
+class TypePlan(NamedTuple):
+    """Fields of one struct type read during traversal, in field order."""
+
+    # int fields decoded into node attributes
+    attrs: list[str]
+    # pointer fields followed to other nodes
+    follow: list[str]
+    # fields that would be captured but are excluded by the builder's filters
+    pruned: list[str]
+
+
 class GraphBuilder:
-    def __init__(self, allowed_types: Optional[set[str]]):
+    """Builds a graph by following pointers from root values.
+
+    allowed_types limits traversal to pointers to those struct types (None
+    allows all). follow and attrs limit the pointer fields followed and the
+    int fields shown to the given names (None keeps all). They are compiled
+    into a TypePlan per struct type on first sight, so pruned fields are never
+    read.
+    """
+
+    def __init__(
+        self,
+        allowed_types: Optional[set[str]],
+        follow: Optional[set[str]] = None,
+        attrs: Optional[set[str]] = None,
+    ):
         self.allowed_types = allowed_types
+        self.follow = follow
+        self.attrs = attrs
+        self.plans: dict[str, TypePlan] = dict()
 
         self.nodes: dict[M.NodeId, M.NodeDesc] = dict()
         self.links: dict[M.LinkId, M.LinkDesc] = dict()
         self.addr_to_node: dict[int, M.NodeId] = dict()
-
-    def extend_from_value(self, value: SBValue, names: set[str] = set()):
-        root = self._dfs(value)
-
-        if root is not None:
-            for name in names:
-                self.nodes[root].names[name] = M.NameDesc(diff_type=None)
-
-    def graph(self) -> M.Graph:
-        return M.Graph(nodes=self.nodes, links=self.links)
+        # nodes whose children were already pushed for traversal
+        self.visited_children: set[M.NodeId] = set()
+
+        self.pending_nodes: dict[M.NodeId, M.NodeDesc] = dict()
+        self.pending_links: dict[M.LinkId, M.LinkDesc] = dict()
+        self.pending_pruned: dict[str, list[str]] = dict()
+
+    def iter_extend(
+        self,
+        roots: Iterable[tuple[SBValue, set[str]]],
+        batch_size: int,
+    ) -> Iterator[M.GraphBatch]:
+        """Traverse from each root, yielding batches as nodes are discovered.
+
+        Names are attached to a root right after its traversal, batches only
+        carry the node descs so consumers see names once traversal finishes.
+        """
+        for value, names in roots:
+            root: Optional[M.NodeId] = None
+            for root in self._dfs(value):
+                if len(self.pending_nodes) >= batch_size:
+                    yield self._take_batch()
+
+            if root is not None:
+                for name in names:
+                    self.nodes[root].names[name] = M.NameDesc(diff_type=None)
+
+        if self.pending_nodes or self.pending_links or self.pending_pruned:
+            yield self._take_batch()
+
+    def _take_batch(self) -> M.GraphBatch:
+        batch = M.GraphBatch(
+            nodes=self.pending_nodes,
+            links=self.pending_links,
+            pruned_fields=self.pending_pruned,
+        )
+        self.pending_nodes = dict()
+        self.pending_links = dict()
+        self.pending_pruned = dict()
+        return batch
+
+    def pruned_fields(self) -> dict[str, list[str]]:
+        return {type: plan.pruned for type, plan in self.plans.items() if plan.pruned}
+
+    def _plan(self, struct_type: SBType) -> TypePlan:
+        name: str = struct_type.name
+        plan = self.plans.get(name)
+        if plan is None:
+            plan = self.plans[name] = self._compile_plan(struct_type)
+            if plan.pruned:
+                self.pending_pruned[name] = plan.pruned
+        return plan
+
+    def _compile_plan(self, struct_type: SBType) -> TypePlan:
+        plan = TypePlan(attrs=[], follow=[], pruned=[])
+        fields: list[SBTypeMember] = struct_type.fields
+        for field in fields:
+            # TODO: for now, only supporting int.
+            # support all primitive types & invalid-pointers which can be shown in hex.
+            if field.type.GetBasicType() == lldb.eBasicTypeInt:
+                wanted, kept = self.attrs, plan.attrs
+            elif self._is_valid_type(field.type):
+                wanted, kept = self.follow, plan.follow
+            else:
+                continue
+
+            if wanted is None or field.name in wanted:
+                kept.append(field.name)
+            else:
+                plan.pruned.append(field.name)
+        return plan
 
     def _get_addr_node_id(self, value: SBValue) -> M.NodeId:
         return f"ADDR{value.unsigned}"
 
-    def _get_addr_node_desc(self, value: SBValue) -> M.NodeDesc:
-        # TODO: for now, only supporting int.
-        # support all primitive types & invalid-pointers which can be shown in hex.
-
+    def _get_addr_node_desc(self, value: SBValue, plan: TypePlan) -> M.NodeDesc:
         attrs: dict[str, M.AttrValue] = {}
-        fields: list[SBTypeMember] = value.type.GetPointeeType().fields
-        for field in fields:
-            if field.type.GetBasicType() == lldb.eBasicTypeInt:
-                attrs[field.name] = M.AttrValue(
-                    scalar=cast(
-                        SBValue, value.GetChildMemberWithName(field.name)
-                    ).signed,
-                    diff_type=None,
-                    old_scalar=None,
-                )
+        for field in plan.attrs:
+            attrs[field] = M.AttrValue(
+                scalar=cast(SBValue, value.GetChildMemberWithName(field)).signed,
+                diff_type=None,
+                old_scalar=None,
+            )
 
         type_desc = M.TypeDesc(
             name=cast(SBType, cast(SBType, value.type).GetPointeeType()).name
@@ -53,12 +135,13 @@ class GraphBuilder:
 
         return M.NodeDesc(type=type_desc, attrs=attrs, names=dict())
 
-    def _add_node(self, value: SBValue) -> M.NodeId:
+    def _add_node(self, value: SBValue, plan: TypePlan) -> M.NodeId:
         id = self._get_addr_node_id(value)
-        desc = self._get_addr_node_desc(value)
+        desc = self._get_addr_node_desc(value, plan)
 
         assert id not in self.nodes
         self.nodes[id] = desc
+        self.pending_nodes[id] = desc
         return id
 
     def _add_link(self, source: M.NodeId, target: M.NodeId, accessor: str):
@@ -69,46 +152,67 @@ class GraphBuilder:
             self.links[link_id] = M.LinkDesc(
                 accessors={accessor: M.AccessorDesc(diff_type=None)}
             )
+        self.pending_links[link_id] = self.links[link_id]
 
     def _is_valid_type(self, type: SBType) -> bool:
         return utils.is_pointer_to_type(type, self.allowed_types)
 
-    def _dfs(
-        self, value: SBValue, parent: Optional[tuple[M.NodeId, str]] = None
-    ) -> Optional[M.NodeId]:
-        # terminate if we reach an invalid value, invalid type or the null pointer
+    def _dfs(self, value: SBValue) -> Iterator[Optional[M.NodeId]]:
+        """Depth-first traversal from value, yielding after each step.
+
+        The first yielded id is the root's (None if value is not a valid
+        pointer). An explicit stack keeps deep structures like long lists from
+        hitting the recursion limit.
+        """
+        # the root's type is checked, children come from fields the plan
+        # already found to be valid pointers
         if not value.IsValid() or not self._is_valid_type(value.type):
+            yield None
+            return
+
+        stack: list[tuple[SBValue, Optional[tuple[M.NodeId, str]]]] = [(value, None)]
+        root: Optional[M.NodeId] = None
+        is_root = True
+
+        while stack:
+            value, parent = stack.pop()
+            plan = self._plan(cast(SBType, value.type).GetPointeeType())
+            node = self._visit(value, parent, plan)
+            if is_root:
+                root = node
+                is_root = False
+            yield root
+
+            if node is None or node in self.visited_children:
+                continue
+            self.visited_children.add(node)
+
+            # push children in reverse to visit them in field order.
+            for field in reversed(plan.follow):
+                child_value: SBValue = value.GetChildMemberWithName(field)
+                stack.append((child_value, (node, field)))
+
+    def _visit(
+        self, value: SBValue, parent: Optional[tuple[M.NodeId, str]], plan: TypePlan
+    ) -> Optional[M.NodeId]:
+        # terminate if we reach an invalid value or the null pointer
+        if not value.IsValid():
             return None
 
         addr: int = value.unsigned
-        type: SBType = value.type
-        struct_type: SBType = type.GetPointeeType()
-        fields: list[SBTypeMember] = struct_type.fields
 
         if addr == 0:
             return None
 
-        # break if node is already visited but add incoming edge.
+        # node is already visited, only add incoming edge.
         if addr in self.addr_to_node:
             node = self.addr_to_node[addr]
-
-            if parent is not None:
-                parent_node, link_label = parent
-                self._add_link(parent_node, node, link_label)
-
-            return node
-
-        node = self._add_node(value)
-        self.addr_to_node[addr] = node
+        else:
+            node = self._add_node(value, plan)
+            self.addr_to_node[addr] = node
 
         if parent is not None:
             parent_node, link_label = parent
             self._add_link(parent_node, node, link_label)
 
-        # recurse for children.
-        for field in fields:
-            if self._is_valid_type(field.type):
-                child_value: SBValue = value.GetChildMemberWithName(field.name)
-                self._dfs(child_value, (node, field.name))
-
         return node
@@ -0,0 +1,461 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+from collections import defaultdict
+from typing import Callable, Iterable, NamedTuple, Optional
+
+import numpy as np
+
+from . import model as M
+
+# bytes read from the inferior at once, bounds memory used by a scan
+HEAP_CHUNK_SIZE = 64 << 20
+
+# name given to the entry node of every structure unreachable from variables
+ORPHAN_NAME = "(orphan)"
+
+ReadMemory = Callable[[int, int], Optional[bytes]]
+
+
+class HeapRegion(NamedTuple):
+    start: int
+    end: int
+
+
+class FieldRange(NamedTuple):
+    """Non-pointer field whose value must lie in [lo, hi], e.g. a bool or enum."""
+
+    offset: int
+    size: int
+    lo: int
+    hi: int
+
+
+class MallocHeader(NamedTuple):
+    """Size word an allocator keeps right before each allocation."""
+
+    # accepted chunk sizes, after masking out the flag bits
+    min_size: int
+    max_size: int
+    flag_bits: int
+
+
+def glibc_header(size: int, pointer_size: int) -> MallocHeader:
+    """Header of glibc malloc chunks holding size bytes.
+
+    A chunk is the request plus its size word rounded up to twice the word
+    size, at least MINSIZE bytes. A free chunk is only split when the rest
+    holds another MINSIZE chunk, so an allocation may get up to that much more.
+    """
+    align = 2 * pointer_size
+    min_chunk = 4 * pointer_size
+    chunk = max(min_chunk, (size + pointer_size + align - 1) & ~(align - 1))
+    return MallocHeader(min_size=chunk, max_size=chunk + min_chunk - align, flag_bits=3)
+
+
+class HeapLayout(NamedTuple):
+    """What a scan knows about the searched type."""
+
+    size: int
+    pointer_size: int
+    little_endian: bool
+    # offsets of pointers to the searched type, followed to check consistency
+    self_offsets: list[int]
+    # offsets of other pointers, only checked to be null or mapped
+    other_offsets: list[int]
+    # alignment of instances, a multiple of pointer_size. malloc aligns
+    # allocations to 16 bytes on most 64-bit platforms
+    align: int
+    # bools & enums, a cheap check on members that aren't pointers
+    field_ranges: tuple[FieldRange, ...] = ()
+    # checked in the word before each instance when instances are allocated
+    # on their own, instances inside arrays or other objects have none
+    header: Optional[MallocHeader] = None
+
+    def word_dtype(self) -> np.dtype:
+        return np.dtype(f"{'<' if self.little_endian else '>'}u{self.pointer_size}")
+
+
+class HeapScan(NamedTuple):
+    # sorted addresses of likely instances
+    addresses: np.ndarray
+    bytes_scanned: int
+    # positions that passed the field checks, before links were checked
+    candidates: int
+    # instances linked to or from another instance, isolated ones are the
+    # likeliest false positives
+    linked: int
+
+
+class AddressRanges:
+    """Sorted address ranges with vectorized membership tests."""
+
+    def __init__(self, regions: Iterable[HeapRegion]):
+        regions = sorted(regions)
+        self.starts = np.array([r.start for r in regions], dtype=np.uint64)
+        self.ends = np.array([r.end for r in regions], dtype=np.uint64)
+
+    def contains(self, addrs: np.ndarray, size: int = 1) -> np.ndarray:
+        """Whether [addr, addr + size) lies within a single range."""
+        if len(self.starts) == 0:
+            return np.zeros(len(addrs), dtype=bool)
+        addrs = addrs.astype(np.uint64, copy=False)
+        # most values are rejected by the overall bounds, only the rest are
+        # looked up. compared against end - size as addr + size may wrap
+        inside = (addrs >= self.starts[0]) & (addrs <= self.ends[-1] - np.uint64(size))
+        if len(self.starts) > 1:
+            candidates = np.flatnonzero(inside)
+            v = addrs[candidates]
+            i = np.searchsorted(self.starts, v, side="right") - 1
+            inside[candidates] = v <= self.ends[i] - np.uint64(size)
+        return inside
+
+
+def _field(
+    words: np.ndarray, idx: Optional[np.ndarray], first: int, n: int, step: int, word: int
+) -> np.ndarray:
+    if idx is None:
+        return words[first + word : first + word + n : step]
+    return words[idx + word]
+
+
+def _in_range(v: np.ndarray, f: FieldRange, layout: HeapLayout) -> np.ndarray:
+    ps = layout.pointer_size
+    byte = f.offset % ps
+    shift = 8 * (byte if layout.little_endian else ps - byte - f.size)
+    mask = (1 << (8 * f.size)) - 1
+    v = (v >> np.uint64(shift)) & np.uint64(mask)
+    # two's complement keeps negative enum values in one contiguous range
+    return ((v - np.uint64(f.lo & mask)) & np.uint64(mask)) <= np.uint64(f.hi - f.lo)
+
+
+def _filter(
+    words: np.ndarray,
+    idx: Optional[np.ndarray],
+    first: int,
+    n: int,
+    layout: HeapLayout,
+    mapped: AddressRanges,
+    heap: AddressRanges,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Keep instances starting at words[idx] whose fields are plausible.
+
+    idx None stands for every aligned position in words[first:first + n].
+    With a malloc header, words before each position must be readable.
+    Returns kept word indices, their pointers to the searched type (one column
+    per self field) and whether any of their pointers is non-null.
+    """
+    ps = layout.pointer_size
+    step = layout.align // ps
+    align_mask = np.uint64(layout.align - 1)
+
+    def narrow(keep: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(keep) * step + first if idx is None else idx[keep]
+
+    # fields narrowing candidates the most go first, later fields are only
+    # gathered for the survivors
+    if layout.header is not None:
+        header = layout.header
+        v = _field(words, idx, first, n, step, -1) & ~np.uint64((1 << header.flag_bits) - 1)
+        idx = narrow((v >= np.uint64(header.min_size)) & (v <= np.uint64(header.max_size)))
+    for offset in layout.self_offsets:
+        v = _field(words, idx, first, n, step, offset // ps)
+        idx = narrow(
+            (v == 0) | (((v & align_mask) == 0) & heap.contains(v, layout.size))
+        )
+    for f in layout.field_ranges:
+        idx = narrow(_in_range(_field(words, idx, first, n, step, f.offset // ps), f, layout))
+    for offset in layout.other_offsets:
+        v = _field(words, idx, first, n, step, offset // ps)
+        idx = narrow((v == 0) | mapped.contains(v))
+    if idx is None:
+        idx = np.arange(first, first + n, step)
+
+    self_ptrs = np.empty((len(idx), len(layout.self_offsets)), dtype=np.uint64)
+    nonnull = np.zeros(len(idx), dtype=bool)
+    for j, offset in enumerate(layout.self_offsets):
+        self_ptrs[:, j] = words[idx + offset // ps]
+        nonnull |= self_ptrs[:, j] != 0
+    for offset in layout.other_offsets:
+        nonnull |= words[idx + offset // ps] != 0
+
+    return idx, self_ptrs, nonnull
+
+
+def _scan_regions(
+    regions: list[HeapRegion],
+    read: ReadMemory,
+    layout: HeapLayout,
+    mapped: AddressRanges,
+    heap: AddressRanges,
+    chunk_size: int,
+) -> tuple[np.ndarray, np.ndarray, int, int]:
+    ps = layout.pointer_size
+    step = layout.align // ps
+    # words read before each instance, the malloc header
+    lead = 0 if layout.header is None else 1
+    dtype = layout.word_dtype()
+    addrs: list[np.ndarray] = []
+    ptrs: list[np.ndarray] = []
+    scanned = 0
+    candidates = 0
+
+    for region in regions:
+        for start in range(region.start, region.end, chunk_size):
+            stop = min(region.end, start + chunk_size)
+            # read past the chunk so instances straddling its end are whole
+            read_start = max(region.start, start - lead * ps)
+            data = read(read_start, min(region.end, stop + layout.size - ps) - read_start)
+            if data is None or len(data) < layout.size:
+                continue
+            scanned += stop - start
+
+            words = np.frombuffer(data, dtype=dtype, count=len(data) // ps)
+            first = (start - read_start) // ps
+            n = min((stop - start) // ps, (len(data) - layout.size) // ps + 1 - first)
+            if first < lead:
+                # no header before the start of a region
+                first, n = first + step, n - step
+            idx, self_ptrs, nonnull = _filter(words, None, first, n, layout, mapped, heap)
+            candidates += int(nonnull.sum())
+
+            # zeroed memory passes every check, all-null instances are only
+            # taken when another instance points to them. targets within the
+            # chunk are checked here, the others once all chunks are scanned
+            targets = self_ptrs[nonnull]
+            targets = np.unique(targets[(targets >= start) & (targets < stop)])
+            tails = (targets - np.uint64(read_start)) // np.uint64(ps)
+            tails = tails[tails >= lead]
+            tail_idx, tail_ptrs, tail_nonnull = _filter(
+                words, tails.astype(np.intp), 0, len(tails), layout, mapped, heap
+            )
+            candidates += int((~tail_nonnull).sum())
+
+            base = np.uint64(read_start)
+            addrs.append(base + idx[nonnull].astype(np.uint64) * np.uint64(ps))
+            ptrs.append(self_ptrs[nonnull])
+            addrs.append(base + tail_idx[~tail_nonnull].astype(np.uint64) * np.uint64(ps))
+            ptrs.append(tail_ptrs[~tail_nonnull])
+
+    if not addrs:
+        empty = np.empty(0, dtype=np.uint64)
+        return (
+            empty,
+            np.empty((0, len(layout.self_offsets)), dtype=np.uint64),
+            scanned,
+            candidates,
+        )
+    return np.concatenate(addrs), np.concatenate(ptrs), scanned, candidates
+
+
+def _read_targets(
+    targets: np.ndarray,
+    read: ReadMemory,
+    layout: HeapLayout,
+    mapped: AddressRanges,
+    heap: AddressRanges,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Check instances pointed to by candidates that the scan did not take."""
+    ps = layout.pointer_size
+    lead = 0 if layout.header is None else ps
+    size = layout.size + lead
+    stride = size // ps
+    buffers: list[bytes] = []
+    read_addrs: list[int] = []
+    for t in targets.tolist():
+        data = read(t - lead, size)
+        if data is not None and len(data) == size:
+            buffers.append(data)
+            read_addrs.append(t)
+
+    words = np.frombuffer(b"".join(buffers), dtype=layout.word_dtype())
+    idx, self_ptrs, _ = _filter(
+        words,
+        np.arange(len(read_addrs)) * stride + lead // ps,
+        0,
+        len(read_addrs),
+        layout,
+        mapped,
+        heap,
+    )
+    return np.array(read_addrs, dtype=np.uint64)[idx // stride], self_ptrs
+
+
+def _lookup(addrs: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Positions of values in sorted addrs, and whether each was found."""
+    if len(addrs) == 0:
+        return np.zeros(values.shape, dtype=np.intp), np.zeros(values.shape, dtype=bool)
+    pos = np.minimum(np.searchsorted(addrs, values), len(addrs) - 1)
+    return pos, addrs[pos] == values
+
+
+def _consistent(addrs: np.ndarray, ptrs: np.ndarray) -> np.ndarray:
+    """Mask of candidates whose links all lead to candidates, to a fixpoint."""
+    pos, found = _lookup(addrs, ptrs)
+    keep = ((ptrs == 0) | found).all(axis=1)
+    while True:
+        # links to dropped candidates are dangling too
+        next_keep = keep & ((ptrs == 0) | (found & keep[pos])).all(axis=1)
+        if (next_keep == keep).all():
+            return keep
+        keep = next_keep
+
+
+def _chain_sizes(addrs: np.ndarray, ptrs: np.ndarray) -> np.ndarray:
+    """Number of candidates linked to each candidate, directly or not.
+
+    Connected components of the links between candidates, labelled with their
+    lowest member by hooking roots along links and pointer jumping.
+    """
+    n = len(addrs)
+    values = ptrs.ravel()
+    pos, found = _lookup(addrs, values)
+    found &= values != 0
+    src = np.repeat(np.arange(n), ptrs.shape[1])[found]
+    dst = pos[found]
+
+    label = np.arange(n)
+    while True:
+        low = np.minimum(label[src], label[dst])
+        if (label[src] == label[dst]).all():
+            break
+        np.minimum.at(label, label[src], low)
+        np.minimum.at(label, label[dst], low)
+        while True:
+            jumped = label[label]
+            if (jumped == label).all():
+                break
+            label = jumped
+    return np.bincount(label, minlength=n)[label]
+
+
+def _overlapping(addrs: np.ndarray, ptrs: np.ndarray, size: int) -> np.ndarray:
+    """Mask of candidates to drop so that fewer overlap, scan_heap repeats it.
+
+    Real instances never overlap. Of overlapping candidates the one in the
+    longer chain of linked candidates is kept, a stray word pointing into a
+    real structure only makes a short one. Ties go to the one most pointed to,
+    then to the lower address. Candidates ranking above every candidate they
+    overlap are kept and the ones they overlap dropped, others are decided on
+    the next call.
+    """
+    n = len(addrs)
+    drop = np.zeros(n, dtype=bool)
+    if n < 2 or not (addrs[1:] < addrs[:-1] + np.uint64(size)).any():
+        return drop
+
+    chain = _chain_sizes(addrs, ptrs)
+    pos, found = _lookup(addrs, ptrs[ptrs != 0])
+    indegree = np.bincount(pos[found], minlength=n)
+    rank = np.empty(n, dtype=np.intp)
+    rank[np.lexsort((np.arange(n)[::-1], indegree, chain))] = np.arange(n)
+
+    # overlapping pairs (i, i + d), addrs are sorted so d stops at the first
+    # distance without any
+    pairs: list[tuple[np.ndarray, int]] = []
+    best = rank.copy()
+    d = 1
+    while True:
+        i = np.flatnonzero(addrs[d:] < addrs[:-d] + np.uint64(size))
+        if len(i) == 0:
+            break
+        pairs.append((i, d))
+        best[i] = np.maximum(best[i], rank[i + d])
+        best[i + d] = np.maximum(best[i + d], rank[i])
+        d += 1
+
+    winner = best == rank
+    for i, d in pairs:
+        drop[i[winner[i + d]]] = True
+        drop[i[winner[i]] + d] = True
+    return drop
+
+
+def scan_heap(
+    regions: list[HeapRegion],
+    mapped_regions: list[HeapRegion],
+    read: ReadMemory,
+    layout: HeapLayout,
+    chunk_size: int = HEAP_CHUNK_SIZE,
+) -> HeapScan:
+    """Find likely instances of a type in regions without following any root.
+
+    Every aligned position is a candidate. Candidates are narrowed with
+    vectorized checks on their fields: the malloc header before them must
+    fit the type's size, pointers to the searched type must be null or point
+    to an aligned, whole instance inside regions, other pointers must be null
+    or mapped and bools & enums must hold valid values. Links between
+    candidates must then be consistent, candidates pointing to a dropped
+    candidate are dropped in turn until nothing changes.
+    """
+    mapped = AddressRanges(mapped_regions)
+    heap = AddressRanges(regions)
+
+    addrs, ptrs, scanned, candidates = _scan_regions(
+        regions, read, layout, mapped, heap, chunk_size
+    )
+
+    order = np.argsort(addrs, kind="stable")
+    addrs, ptrs = addrs[order], ptrs[order]
+
+    # remaining tails of lists & other all-null instances in other chunks
+    targets = np.unique(ptrs[ptrs != 0])
+    missing = targets[~_lookup(addrs, targets)[1]]
+    if len(missing):
+        tail_addrs, tail_ptrs = _read_targets(missing, read, layout, mapped, heap)
+        candidates += len(tail_addrs)
+        addrs = np.concatenate([addrs, tail_addrs])
+        ptrs = np.concatenate([ptrs, tail_ptrs])
+
+    order = np.argsort(addrs, kind="stable")
+    addrs, ptrs = addrs[order], ptrs[order]
+
+    while True:
+        keep = _consistent(addrs, ptrs)
+        addrs, ptrs = addrs[keep], ptrs[keep]
+        drop = _overlapping(addrs, ptrs, layout.size)
+        if not drop.any():
+            break
+        addrs, ptrs = addrs[~drop], ptrs[~drop]
+
+    linked = int((_chain_sizes(addrs, ptrs) > 1).sum())
+    return HeapScan(
+        addresses=addrs, bytes_scanned=scanned, candidates=candidates, linked=linked
+    )
+
+
+def orphan_roots(
+    nodes: Iterable[M.NodeId], links: Iterable[M.LinkId], reachable: set[M.NodeId]
+) -> list[M.NodeId]:
+    """One entry node per structure of nodes outside reachable.
+
+    Entry nodes are orphans no other orphan points to, orphaned cycles get
+    their lowest id as entry.
+    """
+    orphans = set(nodes) - reachable
+    adj: defaultdict[M.NodeId, list[M.NodeId]] = defaultdict(list)
+    pointed: set[M.NodeId] = set()
+    for source, target in links:
+        if source in orphans:
+            adj[source].append(target)
+            if target != source:
+                pointed.add(target)
+
+    roots = sorted(orphans - pointed)
+    covered: set[M.NodeId] = set()
+
+    def cover(node: M.NodeId) -> None:
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node not in covered:
+                covered.add(node)
+                stack.extend(adj.get(node, ()))
+
+    for root in roots:
+        cover(root)
+    for node in sorted(orphans):
+        if node not in covered:
+            roots.append(node)
+            cover(node)
+    return roots
@@ -1,12 +1,15 @@
 # Copyright (c) Indrajit Banerjee
 # Licensed under the MIT License.
 
-from typing import Iterator
+from itertools import islice
+from threading import RLock
+from typing import Callable, Iterator, Optional
 
 from pydantic import BaseModel
 
 from . import model as M
 from . import cola_model as C
+from .query import GraphIndex
 
 
 class HistoryLabel(BaseModel):
@@ -24,16 +27,83 @@ class HistoryItem(BaseModel):
 
 
 class History:
-    def __init__(self):
+    """Graphs indexed by a counter, newest last.
+
+    When max_items is set the oldest graphs are evicted, so valid indices always
+    form the contiguous range [first_index, next_index). on_evict is called with
+    each evicted item.
+
+    Graphs are added from the debugger's thread while the server's thread pages
+    through them, every method holds a lock. It is reentrant so a caller can
+    hold it across calls that must agree, like a page and the total.
+    """
+
+    def __init__(
+        self,
+        max_items: Optional[int] = None,
+        on_evict: Optional[Callable[[HistoryItem], None]] = None,
+    ):
+        self.lock = RLock()
         self.h: dict[int, HistoryItem] = {}
+        self.max_items = max_items
+        self.on_evict = on_evict
+        self.next_index = 0
+        # query indices are built lazily on first query of a graph
+        self.indices: dict[int, GraphIndex] = {}
 
-    def add(self, label: HistoryLabel, g: M.Graph, cg: C.Graph) -> int:
-        index = len(self.h)
-        self.h[index] = HistoryItem(label=label, graph=g, cola_graph=cg)
-        return index
+    def add(self, label: HistoryLabel, g: M.Graph, cg: C.Graph) -> tuple[int, list[int]]:
+        """Add a graph, returning its index and the indices evicted to make room."""
+        evicted: dict[int, HistoryItem] = {}
+        with self.lock:
+            index = self.next_index
+            self.next_index += 1
+            self.h[index] = HistoryItem(label=label, graph=g, cola_graph=cg)
+
+            while self.max_items is not None and len(self.h) > self.max_items:
+                oldest = next(iter(self.h))
+                evicted[oldest] = self.h.pop(oldest)
+                self.indices.pop(oldest, None)
+
+        if self.on_evict is not None:
+            for item in evicted.values():
+                self.on_evict(item)
+        return index, list(evicted)
 
     def at(self, i: int) -> HistoryItem:
-        return self.h[i]
+        with self.lock:
+            return self.h[i]
+
+    def index_at(self, i: int) -> GraphIndex:
+        with self.lock:
+            index = self.indices.get(i)
+            g = self.h[i].graph
+        if index is None:
+            # built unlocked, adding graphs doesn't wait for a large index
+            index = GraphIndex(g)
+            with self.lock:
+                if i in self.h:
+                    index = self.indices.setdefault(i, index)
+        return index
+
+    def items(self) -> Iterator[tuple[int, HistoryItem]]:
+        with self.lock:
+            return iter(list(self.h.items()))
+
+    def page(self, offset: int, limit: int) -> list[tuple[int, HistoryLabel]]:
+        """Labels of up to limit graphs, skipping the offset newest ones."""
+        with self.lock:
+            return [
+                (i, item.label)
+                for i, item in islice(reversed(self.h.items()), offset, offset + limit)
+            ]
+
+    def newest_index(self) -> Optional[int]:
+        with self.lock:
+            return self.next_index - 1 if self.h else None
+
+    def __len__(self) -> int:
+        return len(self.h)
 
     def __iter__(self) -> Iterator[tuple[int, HistoryLabel]]:
-        return iter([(i, item.label) for i, item in reversed(self.h.items())])
+        with self.lock:
+            return iter([(i, item.label) for i, item in reversed(self.h.items())])
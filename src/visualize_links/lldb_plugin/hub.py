@@ -0,0 +1,463 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+import argparse
+import contextlib
+import json
+import socket
+import socketserver
+import sys
+from typing import IO, Iterable, Iterator, NamedTuple, Optional
+
+from pydantic import BaseModel
+
+from . import model as M
+from .config import Config
+from .history import HistoryLabel
+from .query import QueryError
+from .served_model import ServedHistoryItem
+from .server import Server
+from .session import Session
+
+# plugins fall back to an embedded server when no hub answers within this time
+HUB_CONNECT_TIMEOUT = 0.2
+# a hub not answering a request within this time is given up on, it covers
+# diffing & exporting large graphs
+HUB_READ_TIMEOUT = 60.0
+
+# Plugins talk to the hub with one JSON message per line over TCP. A plugin
+# says hello with its session name, then sends requests. Graphs are streamed
+# as graph_begin, any number of graph_batch and graph_end, which is answered
+# like every other request with a single reply line (or a run of graph lines
+# closed by end for graphs). A traversal failing partway sends graph_abort
+# instead of graph_end, answered by end.
+
+
+class WireLink(NamedTuple):
+    source: M.NodeId
+    target: M.NodeId
+    desc: M.LinkDesc
+
+
+class HubHello(BaseModel):
+    type: str = "hello"
+    session: str
+
+
+class HubGraphBegin(BaseModel):
+    type: str = "graph_begin"
+    label: HistoryLabel
+
+
+class HubGraphBatch(BaseModel):
+    type: str = "graph_batch"
+    nodes: dict[M.NodeId, M.NodeDesc]
+    # json objects can't have tuple keys
+    links: list[WireLink]
+    pruned_fields: dict[str, list[str]] = {}
+
+    @staticmethod
+    def from_batch(batch: M.GraphBatch) -> "HubGraphBatch":
+        return HubGraphBatch(
+            nodes=batch.nodes,
+            links=[WireLink(s, t, desc) for (s, t), desc in batch.links.items()],
+            pruned_fields=batch.pruned_fields,
+        )
+
+    def to_batch(self) -> M.GraphBatch:
+        return M.GraphBatch(
+            nodes=self.nodes,
+            links={(l.source, l.target): l.desc for l in self.links},
+            pruned_fields=self.pruned_fields,
+        )
+
+
+class HubGraphEnd(BaseModel):
+    type: str = "graph_end"
+    # names are attached after their nodes were sent
+    names: dict[M.NodeId, list[str]]
+
+
+class HubGraphAbort(BaseModel):
+    type: str = "graph_abort"
+
+
+class HubDiff(BaseModel):
+    type: str = "diff"
+    old_index: int
+    new_index: int
+    structural: bool
+
+
+class HubQuery(BaseModel):
+    type: str = "query"
+    index: int
+    query: str
+    hops: int
+
+
+class HubHistory(BaseModel):
+    type: str = "history"
+
+
+class HubGraphs(BaseModel):
+    type: str = "graphs"
+    # None requests every graph in history, oldest first
+    indices: Optional[list[int]]
+
+
+class HubPublished(BaseModel):
+    type: str = "published"
+    index: int
+
+
+class HubMatches(BaseModel):
+    type: str = "matches"
+    nodes: list[M.NodeId]
+
+
+class HubHistoryReply(BaseModel):
+    type: str = "history"
+    # newest first
+    history: list[ServedHistoryItem]
+
+
+class HubGraph(BaseModel):
+    type: str = "graph"
+    index: int
+    label: HistoryLabel
+    nodes: dict[M.NodeId, M.NodeDesc]
+    links: list[WireLink]
+    pruned_fields: dict[str, list[str]] = {}
+
+    def to_graph(self) -> M.Graph:
+        return M.Graph(
+            nodes=self.nodes,
+            links={(l.source, l.target): l.desc for l in self.links},
+            pruned_fields=self.pruned_fields,
+        )
+
+
+class HubEnd(BaseModel):
+    type: str = "end"
+
+
+class HubError(BaseModel):
+    type: str = "error"
+    kind: str
+    message: str
+    # missing history index for kind "key", other missing keys are kind "error"
+    key: Optional[int] = None
+
+
+class _GraphAborted(Exception):
+    pass
+
+
+class _IngestHandler(socketserver.StreamRequestHandler):
+    server: "_IngestServer"
+    # a graph is being received, its lines are not requests
+    streaming = False
+
+    def handle(self) -> None:
+        hello = HubHello.model_validate_json(self.rfile.readline())
+        session = self.server.ws.session(hello.session)
+
+        for line in self.rfile:
+            data = json.loads(line)
+            try:
+                self._dispatch(session, data)
+            except KeyError as e:
+                if e.args and isinstance(e.args[0], int):
+                    self._reply(HubError(kind="key", message=str(e), key=e.args[0]))
+                else:
+                    self._reply(HubError(kind="error", message=f"KeyError: {e}"))
+            except QueryError as e:
+                self._reply(HubError(kind="query", message=str(e)))
+            except Exception as e:
+                # every request is answered, the plugin waits for the reply
+                self._reply(HubError(kind="error", message=f"{type(e).__name__}: {e}"))
+
+    def _reply(self, msg: BaseModel) -> None:
+        self.wfile.write(msg.model_dump_json().encode() + b"\n")
+
+    def _batches(self) -> Iterator[M.GraphBatch]:
+        nodes: dict[M.NodeId, M.NodeDesc] = {}
+        for line in self.rfile:
+            data = json.loads(line)
+            if data["type"] == "graph_abort":
+                self.streaming = False
+                raise _GraphAborted()
+            if data["type"] == "graph_end":
+                self.streaming = False
+                end = HubGraphEnd.model_validate(data)
+                for node, names in end.names.items():
+                    for name in names:
+                        nodes[node].names[name] = M.NameDesc(diff_type=None)
+                return
+            batch = HubGraphBatch.model_validate(data).to_batch()
+            nodes.update(batch.nodes)
+            yield batch
+        # the plugin went away mid graph
+        raise _GraphAborted()
+
+    def _skip_graph(self) -> None:
+        # the rest of a failed graph, keeping replies in step with requests
+        while self.streaming:
+            line = self.rfile.readline()
+            if not line or json.loads(line)["type"] in ("graph_end", "graph_abort"):
+                self.streaming = False
+
+    def _dispatch(self, session: Session, data: dict) -> None:
+        if data["type"] == "graph_begin":
+            begin = HubGraphBegin.model_validate(data)
+            self.streaming = True
+            try:
+                index = session.publish_graph_stream(begin.label, self._batches())
+            except _GraphAborted:
+                self._reply(HubEnd())
+                return
+            finally:
+                self._skip_graph()
+            self._reply(HubPublished(index=index))
+        elif data["type"] == "diff":
+            diff = HubDiff.model_validate(data)
+            session.publish_diff_graph(diff.old_index, diff.new_index, diff.structural)
+            self._reply(HubEnd())
+        elif data["type"] == "query":
+            query = HubQuery.model_validate(data)
+            matches = session.publish_query_graph(query.index, query.query, query.hops)
+            self._reply(HubMatches(nodes=sorted(matches)))
+        elif data["type"] == "history":
+            self._reply(
+                HubHistoryReply(
+                    history=[
+                        ServedHistoryItem(index=index, label=label)
+                        for index, label in session.history
+                    ]
+                )
+            )
+        elif data["type"] == "graphs":
+            graphs = HubGraphs.model_validate(data)
+            indices = (
+                [index for index, _ in session.history.items()]
+                if graphs.indices is None
+                else graphs.indices
+            )
+            for index in indices:
+                item = session.history.at(index)
+                self._reply(
+                    HubGraph(
+                        index=index,
+                        label=item.label,
+                        nodes=item.graph.nodes,
+                        links=[WireLink(s, t, d) for (s, t), d in item.graph.links.items()],
+                        pruned_fields=item.graph.pruned_fields,
+                    )
+                )
+            self._reply(HubEnd())
+        else:
+            self._reply(HubError(kind="request", message=f"unknown request {data['type']}"))
+
+
+class _IngestServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, ws: Server):
+        self.ws = ws
+        super().__init__((ws.config.host, ws.config.hub_port), _IngestHandler)
+
+
+class Hub:
+    """Standalone process many plugins publish to, one session per debugger.
+
+    The hub owns history, diffing and layout of every session. Plugins only
+    traverse and ship raw graphs, ui clients pick the session to watch.
+    """
+
+    def __init__(self, config: Optional[Config] = None):
+        self.ws = Server(config)
+        self.config = self.ws.config
+        try:
+            self.ingest = _IngestServer(self.ws)
+        except OSError:
+            self.ws.stop()
+            raise
+
+    def serve_forever(self) -> None:
+        try:
+            self.ingest.serve_forever()
+        finally:
+            self.ingest.server_close()
+            self.ws.stop()
+
+    def shutdown(self) -> None:
+        self.ingest.shutdown()
+
+
+class RemoteItem(NamedTuple):
+    label: HistoryLabel
+    graph: M.Graph
+
+
+class RemoteHistory:
+    """Read-only view of a session's history kept by the hub."""
+
+    def __init__(self, client: "HubClient"):
+        self.client = client
+
+    def __iter__(self) -> Iterator[tuple[int, HistoryLabel]]:
+        reply = HubHistoryReply.model_validate(self.client._request(HubHistory()))
+        return ((item.index, item.label) for item in reply.history)
+
+    def items(self) -> Iterator[tuple[int, RemoteItem]]:
+        for g in self.client._request_graphs(None):
+            yield g.index, RemoteItem(label=g.label, graph=g.to_graph())
+
+    def at(self, index: int) -> RemoteItem:
+        (g,) = self.client._request_graphs([index])
+        return RemoteItem(label=g.label, graph=g.to_graph())
+
+
+class HubClient:
+    """Publishes to a session on a hub, standing in for a local Session."""
+
+    def __init__(self, config: Config, name: str, sock: socket.socket):
+        self.config = config
+        self.name = name
+        self.sock = sock
+        self.file: IO[bytes] = sock.makefile("rwb")
+        self.history = RemoteHistory(self)
+        # set once the connection failed, the hub may be gone
+        self.closed = False
+        self._send(HubHello(session=name))
+
+    @staticmethod
+    def connect(config: Config, name: str) -> Optional["HubClient"]:
+        """Connect to a running hub, None when there is none."""
+        try:
+            sock = socket.create_connection(
+                (config.host, config.hub_port), timeout=HUB_CONNECT_TIMEOUT
+            )
+        except OSError:
+            return None
+        sock.settimeout(HUB_READ_TIMEOUT)
+        return HubClient(config, name, sock)
+
+    def url(self) -> str:
+        return f"tcp://{self.config.host}:{self.config.hub_port}"
+
+    def stop(self) -> None:
+        self.file.close()
+        self.sock.close()
+
+    def _send(self, msg: BaseModel) -> None:
+        try:
+            self.file.write(msg.model_dump_json().encode() + b"\n")
+            self.file.flush()
+        except OSError as e:
+            self.closed = True
+            raise ConnectionError(f"visualize-links hub connection failed: {e}") from e
+
+    def _read(self) -> dict:
+        try:
+            line = self.file.readline()
+        except socket.timeout as e:
+            # the reply may still arrive, out of step with the next request
+            self.closed = True
+            raise ConnectionError(
+                f"visualize-links hub did not answer within {HUB_READ_TIMEOUT:.0f}s"
+            ) from e
+        except OSError as e:
+            self.closed = True
+            raise ConnectionError(f"visualize-links hub connection failed: {e}") from e
+        if not line:
+            self.closed = True
+            raise ConnectionError("visualize-links hub closed the connection")
+        data = json.loads(line)
+        if data["type"] == "error":
+            error = HubError.model_validate(data)
+            if error.kind == "key":
+                raise KeyError(error.key)
+            if error.kind == "query":
+                raise QueryError(error.message)
+            raise RuntimeError(error.message)
+        return data
+
+    def _request(self, msg: BaseModel) -> dict:
+        self._send(msg)
+        return self._read()
+
+    def _request_graphs(self, indices: Optional[list[int]]) -> Iterator[HubGraph]:
+        self._send(HubGraphs(indices=indices))
+        pending = True
+        try:
+            while True:
+                try:
+                    data = self._read()
+                except Exception:
+                    pending = False
+                    raise
+                if data["type"] == "end":
+                    pending = False
+                    return
+                yield HubGraph.model_validate(data)
+        finally:
+            # consumer stopped early, skip the rest to keep replies in step
+            while pending and self._read()["type"] != "end":
+                pass
+
+    def publish_graph_stream(
+        self, label: HistoryLabel, batches: Iterable[M.GraphBatch]
+    ) -> int:
+        self._send(HubGraphBegin(label=label))
+        sent: list[tuple[M.NodeId, M.NodeDesc]] = []
+        try:
+            for batch in batches:
+                sent.extend(batch.nodes.items())
+                self._send(HubGraphBatch.from_batch(batch))
+        except BaseException:
+            # traversal failed, the hub drops the partial graph
+            if not self.closed:
+                with contextlib.suppress(ConnectionError, RuntimeError):
+                    self._request(HubGraphAbort())
+            raise
+
+        names = {node: list(desc.names.keys()) for node, desc in sent if desc.names}
+        reply = HubPublished.model_validate(self._request(HubGraphEnd(names=names)))
+        return reply.index
+
+    def publish_diff_graph(self, index1: int, index2: int, structural: bool = False) -> None:
+        self._request(HubDiff(old_index=index1, new_index=index2, structural=structural))
+
+    def publish_query_graph(self, index: int, query: str, hops: int) -> set[M.NodeId]:
+        reply = HubMatches.model_validate(
+            self._request(HubQuery(index=index, query=query, hops=hops))
+        )
+        return set(reply.nodes)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Run a visualize-links hub that many lldb sessions publish to."
+    )
+    parser.parse_args()
+
+    try:
+        hub = Hub()
+    except OSError as e:
+        print(f"visualize-links hub failed to start: {e}")
+        return 1
+
+    print(f"visualize-links hub accepting debuggers on {hub.config.host}:{hub.config.hub_port}")
+    print(f"ui server listening on {hub.ws.ui_url()}")
+    try:
+        hub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,9 @@
 # Copyright (c) Indrajit Banerjee
 # Licensed under the MIT License.
 
-from typing import Optional
+import os
+import re
+from typing import Literal, Optional, TypeAlias
 
 import lldb
 from lldb import (
@@ -15,6 +17,11 @@ from lldb import (
     SBLineEntry,
     SBFileSpec,
     SBType,
+    SBExpressionOptions,
+    SBMemoryRegionInfo,
+    SBMemoryRegionInfoList,
+    SBError,
+    SBTypeMember,
 )
 
 from .history import HistoryLabel
@@ -28,6 +35,13 @@ def get_current_frame(debugger: SBDebugger) -> SBFrame:
     return frame
 
 
+def get_session_name(debugger: SBDebugger) -> str:
+    """Name identifying this debugger among the sessions of a hub."""
+    target: SBTarget = debugger.GetSelectedTarget()
+    exe: SBFileSpec = target.GetExecutable()
+    return f"{exe.GetFilename() or 'lldb'}:{os.getpid()}"
+
+
 def is_initialized_in_current_frame(value: SBValue, frame: SBFrame) -> bool:
     decl_pc: SBDeclaration = value.GetDeclaration()
     frame_pc: SBLineEntry = frame.line_entry
@@ -58,3 +72,163 @@ def get_label_for_frame(frame: SBFrame, desc: str) -> HistoryLabel:
         function_name=func_name,
         desc=desc,
     )
+
+
+MemoryRange: TypeAlias = tuple[int, int]
+
+
+def get_memory_regions(process: SBProcess) -> tuple[list[MemoryRange], list[MemoryRange]]:
+    """Ranges that may hold heap allocations, and every readable range.
+
+    Heap allocations live in the [heap] region and in anonymous writable
+    mappings (large allocations, arenas of other threads).
+    """
+    regions: SBMemoryRegionInfoList = process.GetMemoryRegions()
+    heap: list[MemoryRange] = []
+    readable: list[MemoryRange] = []
+    for i in range(regions.GetSize()):
+        region = SBMemoryRegionInfo()
+        if not regions.GetMemoryRegionAtIndex(i, region) or not region.IsReadable():
+            continue
+        r = (region.GetRegionBase(), region.GetRegionEnd())
+        readable.append(r)
+        if (
+            region.IsWritable()
+            and not region.IsExecutable()
+            and (region.GetName() or "[heap]") == "[heap]"
+        ):
+            heap.append(r)
+    return heap, readable
+
+
+def read_memory(process: SBProcess, addr: int, size: int) -> Optional[bytes]:
+    error = SBError()
+    data: bytes = process.ReadMemory(addr, size, error)
+    return data if error.Success() else None
+
+
+def get_pointer_fields(struct_type: SBType) -> tuple[list[int], list[int]]:
+    """Byte offsets of fields pointing to struct_type, and of other pointers."""
+    self_offsets: list[int] = []
+    other_offsets: list[int] = []
+    fields: list[SBTypeMember] = struct_type.fields
+    for field in fields:
+        if not field.type.is_pointer:
+            continue
+        if is_pointer_to_type(field.type, {struct_type.name}):
+            self_offsets.append(field.byte_offset)
+        else:
+            other_offsets.append(field.byte_offset)
+    return self_offsets, other_offsets
+
+
+def get_field_ranges(struct_type: SBType) -> list[tuple[int, int, int, int]]:
+    """(byte offset, size, lo, hi) of fields only holding values in [lo, hi].
+
+    Those are bools and enums. Enums may be used as flags, so any combination
+    of their bits is allowed.
+    """
+    ranges: list[tuple[int, int, int, int]] = []
+    fields: list[SBTypeMember] = struct_type.fields
+    for field in fields:
+        if field.IsBitfield():
+            continue
+        field_type: SBType = field.type.GetCanonicalType()
+        size: int = field_type.GetByteSize()
+        if field_type.GetBasicType() == lldb.eBasicTypeBool:
+            ranges.append((field.byte_offset, size, 0, 1))
+        elif field_type.GetTypeClass() == lldb.eTypeClassEnumeration:
+            members = field_type.GetEnumMembers()
+            values = [
+                members.GetTypeEnumMemberAtIndex(i).GetValueAsSigned()
+                for i in range(members.GetSize())
+            ]
+            if values:
+                lo = min(0, *values)
+                hi = (1 << max(0, *values).bit_length()) - 1
+                ranges.append((field.byte_offset, size, lo, hi))
+    return ranges
+
+
+def value_at_address(target: SBTarget, addr: int, struct_type: SBType) -> SBValue:
+    """Pointer to the struct_type instance at addr."""
+    value: SBValue = target.CreateValueFromAddress(
+        f"0x{addr:x}", lldb.SBAddress(addr, target), struct_type
+    )
+    return value.AddressOf()
+
+
+ResolutionPath: TypeAlias = Literal["variable", "variable path", "expression"]
+
+# identifiers chained with member access and constant subscripts, e.g. head->next[0].val
+_VARIABLE_PATH = re.compile(r"^[A-Za-z_]\w*(?:(?:->|\.)[A-Za-z_]\w*|\[\d+\])*$")
+
+
+class ExpressionResolver:
+    """Resolves expressions to values, avoiding the expression evaluator when possible.
+
+    Plain variables and variable paths are looked up directly in the frame,
+    which skips parsing and JIT compiling through clang. Only what does not
+    resolve that way goes through EvaluateExpression. The SB API does not hand
+    out compiled expressions, so for variables and variable paths what is cached
+    per frame function is the path that resolved them, letting later stops skip
+    a lookup known to fail. Other expressions always go through the evaluator
+    and are not cached.
+
+    Every path uses the target's dynamic value setting, so an expression
+    resolves to the same dynamic type whichever path handles it.
+    """
+
+    def __init__(self):
+        self.paths: dict[tuple[str, str], ResolutionPath] = {}
+
+        self.options = SBExpressionOptions()
+        # avoid creating a $N persistent variable on every stop
+        self.options.SetSuppressPersistentResult(True)
+
+    def _try_path(
+        self, frame: SBFrame, expr: str, path: ResolutionPath
+    ) -> Optional[SBValue]:
+        value: SBValue
+        match path:
+            case "variable":
+                value = frame.FindVariable(expr)
+            case "variable path":
+                value = frame.GetValueForVariablePath(expr)
+            case "expression":
+                # the options default to no dynamic values, unlike the lookups
+                target: SBTarget = frame.GetThread().GetProcess().GetTarget()
+                self.options.SetFetchDynamicValue(target.GetPreferDynamicValue())
+                value = frame.EvaluateExpression(expr, self.options)
+
+        if value.IsValid() and value.GetError().Success():
+            return value
+        return None
+
+    def _candidate_paths(self, expr: str) -> list[ResolutionPath]:
+        if expr.isidentifier():
+            return ["variable", "expression"]
+        if _VARIABLE_PATH.match(expr):
+            return ["variable path", "expression"]
+        return ["expression"]
+
+    def resolve(self, frame: SBFrame, expr: str) -> tuple[SBValue, ResolutionPath]:
+        key = (frame.GetFunctionName() or "", expr)
+
+        cached = self.paths.get(key)
+        if cached is not None:
+            value = self._try_path(frame, expr, cached)
+            if value is not None:
+                return value, cached
+
+        paths = self._candidate_paths(expr)
+        for path in paths:
+            if path == cached:
+                continue
+            value = self._try_path(frame, expr, path)
+            if value is not None:
+                if len(paths) > 1:
+                    self.paths[key] = path
+                return value, path
+
+        raise ValueError(f"Failed to evaluate expression: {expr}")
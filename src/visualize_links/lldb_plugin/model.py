@@ -207,9 +207,21 @@ class LinkDesc(BaseModel):
         return LinkDesc(accessors=accessors)
 
 
+def merge_pruned_fields(
+    old: dict[str, list[str]], new: dict[str, list[str]]
+) -> dict[str, list[str]]:
+    pruned = {type: list(fields) for type, fields in old.items()}
+    for type, fields in new.items():
+        kept = pruned.setdefault(type, [])
+        kept.extend(field for field in fields if field not in kept)
+    return pruned
+
+
 class Graph(BaseModel):
     nodes: dict[NodeId, NodeDesc]
     links: dict[LinkId, LinkDesc]
+    # struct type name -> fields left out of the capture by --follow / --attrs
+    pruned_fields: dict[str, list[str]] = {}
 
     def difference(self, new: Graph) -> Graph:
         old_nodes = set(self.nodes.keys())
@@ -234,4 +246,14 @@ class Graph(BaseModel):
         for link in old_links & new_links:
             links[link] = self.links[link].difference(new.links[link])
 
-        return Graph(nodes=nodes, links=links)
+        pruned_fields = merge_pruned_fields(self.pruned_fields, new.pruned_fields)
+        return Graph(nodes=nodes, links=links, pruned_fields=pruned_fields)
+
+
+class GraphBatch(BaseModel):
+    """Nodes discovered and links added or updated since the previous batch."""
+
+    nodes: dict[NodeId, NodeDesc]
+    links: dict[LinkId, LinkDesc]
+    # pruned fields of struct types first seen in this batch
+    pruned_fields: dict[str, list[str]] = {}
@@ -0,0 +1,188 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+import operator
+import re
+import shlex
+from collections import defaultdict, deque
+from typing import Callable, Iterable, Optional
+
+from . import model as M
+
+QUERY_HELP = """queries:
+  [TYPE.]FIELD OP VALUE   nodes whose attribute matches, OP is one of == != < <= > >=
+  name NAME               nodes pointed to by variable NAME
+  reach NODE              nodes reachable from NODE
+  path NODE NODE          nodes on a shortest path between the two nodes
+NODE is a variable name, a node id or a hex address."""
+
+_OPS: dict[str, Callable[[M.AttrScalar, M.AttrScalar], bool]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+_ATTR_QUERY = re.compile(r"^(?:(?P<type>[\w:<>, ]+)\.)?(?P<field>\w+)\s*(?P<op>==|!=|<=|>=|<|>)\s*(?P<value>.+)$")
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _parse_scalar(s: str) -> M.AttrScalar:
+    s = s.strip()
+    try:
+        return int(s, 0)
+    except ValueError:
+        pass
+    try:
+        return float(s)
+    except ValueError:
+        pass
+    return s.strip("\"'")
+
+
+class GraphIndex:
+    """Adjacency, reverse adjacency and attribute lookups for one graph."""
+
+    def __init__(self, g: M.Graph):
+        self.g = g
+
+        self.adj: defaultdict[M.NodeId, list[M.NodeId]] = defaultdict(list)
+        self.radj: defaultdict[M.NodeId, list[M.NodeId]] = defaultdict(list)
+        for source, target in g.links.keys():
+            self.adj[source].append(target)
+            self.radj[target].append(source)
+
+        # (type, field) -> value -> nodes
+        self.attrs: defaultdict[
+            tuple[str, str], defaultdict[M.AttrScalar, list[M.NodeId]]
+        ] = defaultdict(lambda: defaultdict(list))
+        # field -> types having that field
+        self.field_types: defaultdict[str, set[str]] = defaultdict(set)
+        self.names: defaultdict[str, list[M.NodeId]] = defaultdict(list)
+        for node, desc in g.nodes.items():
+            for attr, value in desc.attrs.items():
+                self.attrs[(desc.type.name, attr)][value.scalar].append(node)
+                self.field_types[attr].add(desc.type.name)
+            for name in desc.names.keys():
+                self.names[name].append(node)
+
+    def resolve(self, ref: str) -> M.NodeId:
+        if ref in self.names:
+            nodes = self.names[ref]
+            if len(nodes) > 1:
+                raise QueryError(f"name '{ref}' points to {len(nodes)} nodes")
+            return nodes[0]
+        if ref in self.g.nodes:
+            return ref
+        try:
+            node = f"ADDR{int(ref, 16)}"
+        except ValueError:
+            node = None
+        if node is not None and node in self.g.nodes:
+            return node
+        raise QueryError(f"unknown node '{ref}'")
+
+    def match_attr(
+        self, type: Optional[str], field: str, op: str, value: M.AttrScalar
+    ) -> set[M.NodeId]:
+        types = self.field_types.get(field, set()) if type is None else {type}
+        compare = _OPS[op]
+
+        matches: set[M.NodeId] = set()
+        for t in types:
+            values = self.attrs.get((t, field))
+            if values is None:
+                continue
+            if op == "==":
+                matches.update(values.get(value, ()))
+                continue
+            for v, nodes in values.items():
+                try:
+                    if compare(v, value):
+                        matches.update(nodes)
+                except TypeError:
+                    # values of mismatched kinds never compare
+                    pass
+        return matches
+
+    def reachable(self, sources: Iterable[M.NodeId]) -> set[M.NodeId]:
+        seen = set(sources)
+        queue = deque(seen)
+        while queue:
+            node = queue.popleft()
+            for next in self.adj.get(node, ()):
+                if next not in seen:
+                    seen.add(next)
+                    queue.append(next)
+        return seen
+
+    def path(self, source: M.NodeId, target: M.NodeId) -> list[M.NodeId]:
+        parent: dict[M.NodeId, Optional[M.NodeId]] = {source: None}
+        queue = deque([source])
+        while queue and target not in parent:
+            node = queue.popleft()
+            for next in self.adj.get(node, ()):
+                if next not in parent:
+                    parent[next] = node
+                    queue.append(next)
+
+        if target not in parent:
+            return []
+
+        path: list[M.NodeId] = []
+        node: Optional[M.NodeId] = target
+        while node is not None:
+            path.append(node)
+            node = parent[node]
+        return path[::-1]
+
+    def neighbourhood(self, nodes: Iterable[M.NodeId], hops: int) -> set[M.NodeId]:
+        """Nodes within hops links of any given node, ignoring link direction."""
+        seen = set(nodes)
+        frontier = list(seen)
+        for _ in range(hops):
+            next_frontier: list[M.NodeId] = []
+            for node in frontier:
+                for next in (*self.adj.get(node, ()), *self.radj.get(node, ())):
+                    if next not in seen:
+                        seen.add(next)
+                        next_frontier.append(next)
+            frontier = next_frontier
+        return seen
+
+    def subgraph(self, nodes: set[M.NodeId]) -> M.Graph:
+        links: dict[M.LinkId, M.LinkDesc] = {}
+        for source in nodes:
+            for target in self.adj.get(source, ()):
+                if target in nodes:
+                    links[(source, target)] = self.g.links[(source, target)]
+
+        return M.Graph(
+            nodes={node: self.g.nodes[node] for node in nodes},
+            links=links,
+            pruned_fields=self.g.pruned_fields,
+        )
+
+    def query(self, query: str) -> set[M.NodeId]:
+        """Evaluate a query string, see QUERY_HELP for the syntax."""
+        m = _ATTR_QUERY.match(query.strip())
+        if m is not None:
+            return self.match_attr(
+                m["type"], m["field"], m["op"], _parse_scalar(m["value"])
+            )
+
+        args = shlex.split(query)
+        match args:
+            case ["name", name]:
+                return set(self.names.get(name, ()))
+            case ["reach", ref]:
+                return self.reachable([self.resolve(ref)])
+            case ["path", source, target]:
+                return set(self.path(self.resolve(source), self.resolve(target)))
+            case _:
+                raise QueryError(f"invalid query '{query}'\n{QUERY_HELP}")
@@ -0,0 +1,208 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+from threading import Lock
+from typing import Callable, Hashable, Iterable, Optional, TypeVar
+
+from pydantic import BaseModel, TypeAdapter
+# pydantic requires it for TypedDict before python 3.12 and depends on it
+from typing_extensions import TypedDict
+
+from . import cola_model as C
+
+# orjson is optional, dumping plain dicts with it beats a pydantic call per model
+try:
+    import orjson
+
+    JSON_BACKEND = "orjson"
+
+    def _dump_node(node: C.Node) -> bytes:
+        return orjson.dumps({"id": node.id, "label": node.label, "tag": node.tag})
+
+    def _dump_link(link: C.Link) -> bytes:
+        return orjson.dumps(
+            {
+                "source": link.source,
+                "target": link.target,
+                "forward_labels": [
+                    {"label": l.label, "diff_type": l.diff_type} for l in link.forward_labels
+                ],
+                "backward_labels": [
+                    {"label": l.label, "diff_type": l.diff_type} for l in link.backward_labels
+                ],
+                "tag": link.tag,
+                "diff_type": link.diff_type,
+            }
+        )
+
+except ImportError:
+    JSON_BACKEND = "pydantic"
+
+    def _dump_node(node: C.Node) -> bytes:
+        return node.__pydantic_serializer__.to_json(node)
+
+    def _dump_link(link: C.Link) -> bytes:
+        return link.__pydantic_serializer__.to_json(link)
+
+
+T = TypeVar("T", bound=BaseModel)
+
+
+# a plain dict per update, building a model for each costs more than dumping it
+class _LinkUpdate(TypedDict):
+    index: int
+    link: C.Link
+
+
+_NODES = TypeAdapter(list[C.Node])
+_LINKS = TypeAdapter(list[C.Link])
+_LINK_UPDATES = TypeAdapter(list[_LinkUpdate])
+
+# fragment of an interned model serialized once in bulk, it is only dumped on
+# its own & cached once serialized again
+_SEEN = b""
+
+
+class FragmentCache:
+    """Interned cola nodes & links with their serialized JSON.
+
+    Consecutive snapshots share most nodes and links. ColaConverter interns
+    them here by content, so an unchanged node is validated and serialized once
+    and graph payloads are assembled by joining the cached fragments. Output
+    matches cola_model.Graph.model_dump_json().
+
+    Models are reference counted by the graphs interning them and dropped once
+    release() was called for all of them, history releases evicted graphs.
+    Graphs only shown once, like diffs, should not be interned at all.
+
+    Models serialized for the first time are dumped in bulk like an uncached
+    graph, only models serialized again are dumped one by one and cached. A
+    graph no later snapshot shares is thus never dumped piece by piece.
+
+    Sessions are used from the debugger's and the server's threads, every
+    method holds a lock.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.models: dict[Hashable, BaseModel] = {}
+        # keyed by id() of interned models, which self.models keeps alive.
+        # plain dicts of immutable values keep bookkeeping off the gc's hands
+        self.keys: dict[int, Hashable] = {}
+        self.refs: dict[int, int] = {}
+        # missing until first serialized
+        self.fragments: dict[int, bytes] = {}
+
+    def lookup(self, key: Hashable) -> Optional[BaseModel]:
+        """The model interned for key, taking a reference to it, or None."""
+        with self.lock:
+            model = self.models.get(key)
+            if model is not None:
+                self.refs[id(model)] += 1
+            return model
+
+    def add(self, models: Iterable[tuple[Hashable, BaseModel]]) -> None:
+        """Intern models by key, each referenced once.
+
+        A key interned meanwhile keeps its model, the other one is not shared.
+        """
+        with self.lock:
+            for key, model in models:
+                if key in self.models:
+                    continue
+                self.models[key] = model
+                self.keys[id(model)] = key
+                self.refs[id(model)] = 1
+
+    def release(self, models: Iterable[Optional[BaseModel]]) -> None:
+        """Drop one reference to each model, as taken by lookup() or add()."""
+        with self.lock:
+            for model in models:
+                refs = self.refs.get(id(model))
+                if refs is None:
+                    continue
+                if refs > 1:
+                    self.refs[id(model)] = refs - 1
+                    continue
+                del self.refs[id(model)]
+                del self.models[self.keys.pop(id(model))]
+                self.fragments.pop(id(model), None)
+
+    def release_graph(self, g: C.Graph) -> None:
+        self.release(g.nodes)
+        self.release(g.links)
+
+    def _fragments(self, models: list[T]) -> Optional[list[Optional[bytes]]]:
+        """Cached fragments of models, None when most were never serialized.
+
+        Interned models never serialized are marked seen, missing fragments
+        are None.
+        """
+        # nothing interned yet, as while the first graph is streamed
+        if not self.keys:
+            return None
+        cached = [self.fragments.get(id(model)) for model in models]
+        if 2 * cached.count(None) > len(models):
+            for model, fragment in zip(models, cached):
+                if fragment is None and id(model) in self.keys:
+                    self.fragments[id(model)] = _SEEN
+            return None
+        return [fragment or None for fragment in cached]
+
+    def _join(
+        self,
+        models: list[T],
+        fragments: list[Optional[bytes]],
+        dump: Callable[[T], bytes],
+    ) -> list[bytes]:
+        out: list[bytes] = []
+        for model, fragment in zip(models, fragments):
+            if fragment is None:
+                fragment = dump(model)
+                if id(model) in self.keys:
+                    self.fragments[id(model)] = fragment
+            out.append(fragment)
+        return out
+
+    def nodes_json(self, nodes: Iterable[C.Node]) -> bytes:
+        nodes = list(nodes)
+        with self.lock:
+            fragments = self._fragments(nodes)
+            if fragments is None:
+                return _NODES.dump_json(nodes)
+            return b"[" + b",".join(self._join(nodes, fragments, _dump_node)) + b"]"
+
+    def links_json(self, links: Iterable[C.Link]) -> bytes:
+        links = list(links)
+        with self.lock:
+            fragments = self._fragments(links)
+            if fragments is None:
+                return _LINKS.dump_json(links)
+            return b"[" + b",".join(self._join(links, fragments, _dump_link)) + b"]"
+
+    def link_updates_json(self, updates: Iterable[tuple[int, C.Link]]) -> bytes:
+        """Serialize (index, link) pairs as {"index": ..., "link": ...} objects."""
+        updates = list(updates)
+        indices = [index for index, _ in updates]
+        links = [link for _, link in updates]
+        with self.lock:
+            fragments = self._fragments(links)
+            if fragments is None:
+                return _LINK_UPDATES.dump_json(
+                    [{"index": index, "link": link} for index, link in updates]
+                )
+            return (
+                b"["
+                + b",".join(
+                    b'{"index":%d,"link":%s}' % (index, fragment)
+                    for index, fragment in zip(
+                        indices, self._join(links, fragments, _dump_link)
+                    )
+                )
+                + b"]"
+            )
+
+    def graph_json(self, g: C.Graph) -> bytes:
+        return (
+            b'{"nodes":' + self.nodes_json(g.nodes) + b',"links":' + self.links_json(g.links) + b"}"
+        )
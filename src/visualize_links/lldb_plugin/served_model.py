@@ -5,6 +5,7 @@ from pydantic import BaseModel
 
 from . import cola_model as C
 from .history import HistoryLabel
+from .serialize import FragmentCache
 
 class ServedData(BaseModel):
     type: str
@@ -15,11 +16,75 @@ class ServedHistoryItem(BaseModel):
 
 class ServedHistory(ServedData):
     type: str = "history"
+    # page of items, newest first, starting offset items after the newest
     history: list[ServedHistoryItem]
+    offset: int
+    total: int
+    newest_index: int | None
+
+
+class ServedHistoryAppend(ServedData):
+    type: str = "history_append"
+    item: ServedHistoryItem
+
+
+class ServedHistoryEvict(ServedData):
+    type: str = "history_evict"
+    indices: list[int]
 
 
 class ServedGraph(ServedData):
     type: str = "graph"
     title: str
     graph: C.Graph
-    history: list[ServedHistoryItem] | None = None
+    # history index of the shown graph, None for derived graphs like diffs
+    index: int | None = None
+
+    def dump_json(self, fragments: FragmentCache) -> str:
+        """model_dump_json() with the graph assembled from cached fragments."""
+        envelope = self.model_dump_json(exclude={"graph"})
+        graph = fragments.graph_json(self.graph).decode()
+        return f'{envelope[:-1]},"graph":{graph}}}'
+
+
+class ServedLinkUpdate(BaseModel):
+    # position in the graph's links, links past the end are appended
+    index: int
+    link: C.Link
+
+
+class ServedGraphBatch(ServedData):
+    """Part of a graph streamed while traversal is still running."""
+
+    type: str = "graph_batch"
+    stream: int
+    nodes: list[C.Node]
+    links: list[ServedLinkUpdate]
+
+    def dump_json(self, fragments: FragmentCache) -> str:
+        nodes = fragments.nodes_json(self.nodes).decode()
+        links = fragments.link_updates_json((l.index, l.link) for l in self.links).decode()
+        return (
+            f'{{"type":"{self.type}","stream":{self.stream},'
+            f'"nodes":{nodes},"links":{links}}}'
+        )
+
+
+class ServedGraphComplete(ServedData):
+    """Marks the end of a streamed graph, which is now in history."""
+
+    type: str = "graph_complete"
+    stream: int
+    title: str
+    item: ServedHistoryItem
+
+
+class ServedSessions(ServedData):
+    type: str = "sessions"
+    # names of the publishing debuggers, oldest first
+    sessions: list[str]
+
+
+class ServedError(ServedData):
+    type: str = "error"
+    message: str
@@ -3,108 +3,216 @@
 
 import json
 import asyncio
-from threading import Thread
+import mimetypes
+from http import HTTPStatus
+from pathlib import Path
+from threading import Event, Lock, Thread
 from queue import Queue
+from typing import Optional
 import websockets.server as wss
+from websockets.datastructures import Headers
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
 
-from . import model as M
-from .cola_graph import convert_to_cola
-from .history import History, HistoryLabel
+from .config import Config
+from .session import Session
 from . import served_model as S
 
+# built ui, served over http on the websocket port
+STATIC_DIR = Path(__file__).parent.parent / "static"
+
 
 class Server:
-    def __init__(self):
-        self.history = History()
-        self.queue: Queue[str] = Queue()
-        self.client = None
+    """Websocket server the ui connects to, serving one or more sessions.
+
+    Each connected ui client watches one session at a time. Session messages
+    are queued tagged with the session name and only delivered to the clients
+    watching it, untagged messages go to every client. Clients that never
+    picked a session, like uis built before sessions, watch the newest one.
+
+    Plain http requests on the same port are answered with the static ui, so a
+    single forwarded port is enough to debug remotely.
+    """
+
+    def __init__(self, config: Optional[Config] = None):
+        self.config = config or Config.from_env()
+        self.sessions: dict[str, Session] = {}
+        self.newest_session: Optional[str] = None
+        # sessions are created from the threads of every publishing debugger
+        self.sessions_lock = Lock()
+        # None is a sentinel stopping the send loop. messages are moved from
+        # this thread-safe queue to the loop's outbox by a daemon reader thread,
+        # a blocked executor worker would hold up interpreter shutdown
+        self.queue: Queue[Optional[tuple[Optional[str], str]]] = Queue()
+        self.outbox: Optional[asyncio.Queue[Optional[tuple[Optional[str], str]]]] = None
+        # connected clients & the session each one watches
+        self.clients: dict[wss.WebSocketServerProtocol, Optional[str]] = {}
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.port: Optional[int] = None
+        self.error: Optional[OSError] = None
+        self.ready = Event()
+
         self.t = Thread(target=self._run_server_loop, daemon=True)
         self.t.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
 
-    def publish_new_graph(self, label: HistoryLabel, g: M.Graph) -> int:
-        cg = convert_to_cola(g)
-        index = self.history.add(label, g, cg)
-
-        history = list(
-            S.ServedHistoryItem(index=index, label=label)
-            for index, label in self.history
-        )
-        data = S.ServedGraph(
-            title=f"#{index} ({label.desc})", graph=cg, history=history
-        )
-
-        self.queue.put(data.model_dump_json())
-        return index
-
-    def publish_diff_graph(self, index1: int, index2: int) -> None:
-        g1 = self.history.at(index1).graph
-        g2 = self.history.at(index2).graph
+    def url(self) -> str:
+        return f"ws://{self.config.host}:{self.port}"
 
-        data = S.ServedGraph(
-            title=f"comparing #{index1}→#{index2}",
-            graph=convert_to_cola(g1.difference(g2)),
-        )
+    def ui_url(self) -> str:
+        return f"http://{self.config.host}:{self.port}/"
 
-        self.queue.put(data.model_dump_json())
+    def stop(self, timeout: float = 1.0) -> None:
+        if self.loop is None or not self.t.is_alive():
+            return
+        self.queue.put(None)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.t.join(timeout)
+
+    def session(self, name: str) -> Session:
+        """Return the named session, creating it on first use."""
+        with self.sessions_lock:
+            if name not in self.sessions:
+                self.sessions[name] = Session(
+                    name, self.config, lambda msg: self.queue.put((name, msg))
+                )
+                self.newest_session = name
+                self.queue.put((None, self._sessions_json()))
+            return self.sessions[name]
+
+    def _sessions_json(self) -> str:
+        return S.ServedSessions(sessions=list(self.sessions.keys())).model_dump_json()
 
     def _run_server_loop(self) -> None:
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
-        server = wss.serve(self._ws_handler, "localhost", 8765)
-        loop.run_until_complete(server)
-        loop.create_task(self._send_loop())
+        try:
+            server = loop.run_until_complete(self._serve())
+        except OSError as e:
+            self.error = e
+            loop.close()
+            self.ready.set()
+            return
+
+        self.loop = loop
+        self.outbox = asyncio.Queue()
+        self.ready.set()
+
+        send_task = loop.create_task(self._send_loop())
+        Thread(target=self._read_queue, args=(loop,), daemon=True).start()
         loop.run_forever()
 
-    async def _ws_handler(self, conn: wss.WebSocketServerProtocol):
-        # reject new clients as long as connected to one client instance
-        if self.client is not None:
-            await conn.close(code=1013, reason="Server already connected to a client!")
-            return
+        # stopped, close client connections & drain the send loop
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.run_until_complete(send_task)
+        loop.close()
+
+    async def _serve(self) -> wss.WebSocketServer:
+        # fall back to the following ports when the configured one is taken
+        first = self.config.port
+        last = first + self.config.port_attempts - 1
+        for port in range(first, last + 1):
+            try:
+                server = await wss.serve(
+                    self._ws_handler,
+                    self.config.host,
+                    port,
+                    process_request=self._process_request,
+                    compression=None,
+                    extensions=self._extensions(),
+                )
+            except OSError:
+                continue
+            self.port = port
+            return server
+        raise OSError(f"No free port for visualize-links server in {first}-{last}")
+
+    def _extensions(self) -> list[ServerPerMessageDeflateFactory]:
+        if self.config.compression_level <= 0:
+            return []
+        # websockets' default window & memory, with a faster compression level
+        return [
+            ServerPerMessageDeflateFactory(
+                server_max_window_bits=12,
+                client_max_window_bits=12,
+                compress_settings={
+                    "memLevel": 5,
+                    "level": self.config.compression_level,
+                },
+            )
+        ]
+
+    def _process_request(
+        self, path: str, headers: Headers
+    ) -> Optional[tuple[HTTPStatus, list[tuple[str, str]], bytes]]:
+        if headers.get("Upgrade", "").lower() == "websocket":
+            return None
+
+        name = path.split("?", 1)[0].lstrip("/") or "index.html"
+        file = (STATIC_DIR / name).resolve()
+        if not file.is_relative_to(STATIC_DIR.resolve()) or not file.is_file():
+            return HTTPStatus.NOT_FOUND, [], b"Not Found\n"
+
+        content_type = mimetypes.guess_type(file.name)[0] or "application/octet-stream"
+        return HTTPStatus.OK, [("Content-Type", content_type)], file.read_bytes()
 
-        self.client = conn
+    async def _ws_handler(self, conn: wss.WebSocketServerProtocol):
+        self.clients[conn] = None
 
         try:
+            await conn.send(self._sessions_json())
             async for message in conn:
                 try:
                     data = json.loads(message)
-                    if data["type"] == "history":
-                        history = list(
-                            S.ServedHistoryItem(index=index, label=label)
-                            for index, label in self.history
-                        )
-                        data = S.ServedHistory(history=history)
-                        await self.client.send(data.model_dump_json())
-                    elif data["type"] == "graph":
-                        index: int = data["index"]
-                        hi = self.history.at(index)
-                        data = S.ServedGraph(
-                            title=f"#{index} ({hi.label.desc})", graph=hi.cola_graph
-                        )
-                        await self.client.send(data.model_dump_json())
-                    elif data["type"] == "diff_graph":
-                        old_index: int = data["old_index"]
-                        new_index: int = data["new_index"]
-                        old_graph = self.history.at(old_index).graph
-                        new_graph = self.history.at(new_index).graph
-                        data = S.ServedGraph(
-                            title=f"comparing #{old_index}→#{new_index}",
-                            graph=convert_to_cola(old_graph.difference(new_graph)),
-                        )
-                        await self.client.send(data.model_dump_json())
-                except Exception:
-                    pass
+                    if data["type"] == "session":
+                        if data["name"] in self.sessions:
+                            self.clients[conn] = data["name"]
+                        continue
+
+                    name = self._watched(conn)
+                    if name is None:
+                        continue
+                    reply = self.sessions[name].handle_request(data)
+                except Exception as e:
+                    # the ui waits for an answer behind its loading screen
+                    reply = S.ServedError(message=f"{type(e).__name__}: {e}").model_dump_json()
+                if reply is not None:
+                    await conn.send(reply)
         finally:
-            if self.client is conn:
-                self.client = None
+            self.clients.pop(conn, None)
+
+    def _watched(self, conn: wss.WebSocketServerProtocol) -> Optional[str]:
+        return self.clients.get(conn) or self.newest_session
+
+    def _read_queue(self, loop: asyncio.AbstractEventLoop) -> None:
+        assert self.outbox is not None
+        while True:
+            item = self.queue.get()
+            try:
+                loop.call_soon_threadsafe(self.outbox.put_nowait, item)
+            except RuntimeError:
+                # loop already closed
+                return
+            if item is None:
+                return
 
     async def _send_loop(self) -> None:
-        loop = asyncio.get_event_loop()
+        assert self.outbox is not None
         while True:
-            msg = await loop.run_in_executor(None, self.queue.get)
-            if self.client is not None:
+            item = await self.outbox.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            name, msg = item
+            for conn in list(self.clients):
+                if name is not None and self._watched(conn) != name:
+                    continue
                 try:
-                    await self.client.send(msg)
+                    await conn.send(msg)
                 except Exception:
-                    self.client = None
+                    self.clients.pop(conn, None)
             self.queue.task_done()
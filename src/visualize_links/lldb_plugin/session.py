@@ -0,0 +1,184 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+from typing import Callable, Iterable, Optional
+
+from . import model as M
+from . import served_model as S
+from .cola_graph import ColaConverter, convert_to_cola
+from .config import Config
+from .history import History, HistoryLabel
+from .query import QueryError
+from .serialize import FragmentCache
+from .structural import structural_difference
+
+HISTORY_PAGE_SIZE = 50
+
+
+class Session:
+    """History, diffing and layout of the graphs published by one debugger.
+
+    Messages for the ui are handed to emit, which delivers them to the clients
+    watching this session.
+    """
+
+    def __init__(self, name: str, config: Config, emit: Callable[[str], None]):
+        self.name = name
+        self.config = config
+        self.emit = emit
+        self.fragments = FragmentCache()
+        # history entries hold the references to interned nodes & links
+        self.history = History(
+            max_items=config.max_history,
+            on_evict=lambda item: self.fragments.release_graph(item.cola_graph),
+        )
+        # id of the latest streamed graph, lets the ui drop stale batches
+        self.stream = 0
+
+    def publish_graph_stream(
+        self, label: HistoryLabel, batches: Iterable[M.GraphBatch]
+    ) -> int:
+        """Publish a graph batch by batch while it is still being traversed.
+
+        Each batch is converted and sent as soon as it arrives, so the ui can
+        lay out the part discovered so far. Name nodes are sent last, once
+        traversal is done and names are known, followed by the history entry.
+        """
+        self.stream += 1
+        stream = self.stream
+        converter = ColaConverter(self.fragments)
+        nodes: dict[M.NodeId, M.NodeDesc] = {}
+        links: dict[M.LinkId, M.LinkDesc] = {}
+        pruned_fields: dict[str, list[str]] = {}
+
+        try:
+            for batch in batches:
+                nodes.update(batch.nodes)
+                links.update(batch.links)
+                pruned_fields = M.merge_pruned_fields(pruned_fields, batch.pruned_fields)
+                data = S.ServedGraphBatch(
+                    stream=stream,
+                    nodes=converter.add_nodes(batch.nodes.items()),
+                    links=[
+                        S.ServedLinkUpdate(index=index, link=link)
+                        for index, link in converter.add_links(batch.links.items())
+                    ],
+                )
+                self.emit(data.dump_json(self.fragments))
+        except BaseException:
+            # never added to history, nothing else releases the partial graph
+            converter.release()
+            raise
+
+        name_nodes, name_links = converter.finish(nodes.items())
+        data = S.ServedGraphBatch(
+            stream=stream,
+            nodes=name_nodes,
+            links=[S.ServedLinkUpdate(index=index, link=link) for index, link in name_links],
+        )
+        self.emit(data.dump_json(self.fragments))
+
+        g = M.Graph(nodes=nodes, links=links, pruned_fields=pruned_fields)
+        index, evicted = self.history.add(label, g, converter.graph())
+
+        if evicted:
+            self.emit(S.ServedHistoryEvict(indices=evicted).model_dump_json())
+        item = S.ServedHistoryItem(index=index, label=label)
+        complete = S.ServedGraphComplete(
+            stream=stream, title=f"#{index} ({label.desc})", item=item
+        )
+        self.emit(complete.model_dump_json())
+        converter.intern()
+        return index
+
+    def history_page(self, offset: int, limit: int) -> S.ServedHistory:
+        # the page, total & newest index must agree while graphs are added
+        with self.history.lock:
+            return S.ServedHistory(
+                history=[
+                    S.ServedHistoryItem(index=index, label=label)
+                    for index, label in self.history.page(offset, limit)
+                ],
+                offset=offset,
+                total=len(self.history),
+                newest_index=self.history.newest_index(),
+            )
+
+    def graph(self, index: int) -> S.ServedGraph:
+        hi = self.history.at(index)
+        return S.ServedGraph(
+            title=f"#{index} ({hi.label.desc})", graph=hi.cola_graph, index=index
+        )
+
+    def diff_graph(self, index1: int, index2: int, structural: bool) -> S.ServedGraph:
+        g1 = self.history.at(index1).graph
+        g2 = self.history.at(index2).graph
+
+        if structural:
+            g = structural_difference(g1, g2)
+        else:
+            g = g1.difference(g2)
+
+        return S.ServedGraph(
+            title=f"comparing #{index1}→#{index2}" + (" (structural)" if structural else ""),
+            graph=convert_to_cola(g),
+        )
+
+    def publish_diff_graph(self, index1: int, index2: int, structural: bool = False) -> None:
+        data = self.diff_graph(index1, index2, structural)
+        self.emit(data.dump_json(self.fragments))
+
+    def query_graph(
+        self, index: int, query: str, hops: int
+    ) -> tuple[S.ServedGraph, set[M.NodeId]]:
+        graph_index = self.history.index_at(index)
+        matches = graph_index.query(query)
+        nodes = graph_index.neighbourhood(matches, hops) if hops > 0 else matches
+
+        data = S.ServedGraph(
+            title=f"#{index} query: {query}" + (f" (±{hops} hops)" if hops > 0 else ""),
+            graph=convert_to_cola(graph_index.subgraph(nodes)),
+        )
+        return data, matches
+
+    def publish_query_graph(self, index: int, query: str, hops: int) -> set[M.NodeId]:
+        data, matches = self.query_graph(index, query, hops)
+        self.emit(data.dump_json(self.fragments))
+        return matches
+
+    def handle_request(self, data: dict) -> Optional[str]:
+        """Answer a ui request, returning the reply if there is one.
+
+        Requests for graphs missing from history, like evicted ones, are
+        answered with an error.
+        """
+        try:
+            return self._handle_request(data)
+        except KeyError as e:
+            # history indices are ints, other keys are missing request fields
+            if not isinstance(e.args[0], int):
+                raise
+            return S.ServedError(message=f"no graph with index {e}").model_dump_json()
+
+    def _handle_request(self, data: dict) -> Optional[str]:
+        if data["type"] == "history":
+            page = self.history_page(
+                data.get("offset", 0), data.get("limit", HISTORY_PAGE_SIZE)
+            )
+            return page.model_dump_json()
+        elif data["type"] == "graph":
+            return self.graph(data["index"]).dump_json(self.fragments)
+        elif data["type"] == "diff_graph":
+            diff = self.diff_graph(
+                data["old_index"], data["new_index"], data.get("structural", False)
+            )
+            return diff.dump_json(self.fragments)
+        elif data["type"] == "query":
+            try:
+                result, _ = self.query_graph(
+                    data["index"], data["query"], data.get("hops", 0)
+                )
+                return result.dump_json(self.fragments)
+            except QueryError as e:
+                return S.ServedError(message=str(e)).model_dump_json()
+        return None
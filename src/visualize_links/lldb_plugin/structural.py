@@ -0,0 +1,182 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+from collections import defaultdict, deque
+from typing import Iterable
+
+from . import model as M
+
+# number of Weisfeiler-Lehman refinement rounds, each round widens the
+# neighbourhood a hash summarizes by one link
+WL_ROUNDS = 3
+
+
+class _Adjacency:
+    def __init__(self, g: M.Graph):
+        self.out: defaultdict[M.NodeId, dict[str, M.NodeId]] = defaultdict(dict)
+        self.out_links: defaultdict[M.NodeId, list[tuple[str, M.NodeId]]] = defaultdict(list)
+        self.in_links: defaultdict[M.NodeId, list[tuple[str, M.NodeId]]] = defaultdict(list)
+        for (source, target), desc in g.links.items():
+            for accessor in desc.accessors.keys():
+                self.out[source][accessor] = target
+                self.out_links[source].append((accessor, target))
+                self.in_links[target].append((accessor, source))
+
+
+def wl_hashes(g: M.Graph, adj: _Adjacency, rounds: int = WL_ROUNDS) -> list[dict[M.NodeId, int]]:
+    """Per-round node hashes, round 0 covers the node itself.
+
+    Round r hashes a node together with the round r-1 hashes of its incoming
+    and outgoing neighbours keyed by accessor, so equal hashes mean equal
+    r-hop neighbourhoods (up to collisions). Names are left out on purpose,
+    they anchor the matching instead.
+    """
+    h: dict[M.NodeId, int] = {
+        node: hash((desc.type.name, tuple(sorted((a, v.scalar) for a, v in desc.attrs.items()))))
+        for node, desc in g.nodes.items()
+    }
+    hashes = [h]
+    for _ in range(rounds):
+        prev = h
+        h = {
+            node: hash(
+                (
+                    prev[node],
+                    tuple(sorted((a, prev[t]) for a, t in adj.out_links.get(node, ()))),
+                    tuple(sorted((a, prev[s]) for a, s in adj.in_links.get(node, ()))),
+                )
+            )
+            for node in g.nodes.keys()
+        }
+        hashes.append(h)
+    return hashes
+
+
+class _Matching:
+    def __init__(self, old: M.Graph, new: M.Graph, rounds: int):
+        self.old = old
+        self.new = new
+        self.old_adj = _Adjacency(old)
+        self.new_adj = _Adjacency(new)
+        self.old_hashes = wl_hashes(old, self.old_adj, rounds)
+        self.new_hashes = wl_hashes(new, self.new_adj, rounds)
+        self.old2new: dict[M.NodeId, M.NodeId] = {}
+        self.new2old: dict[M.NodeId, M.NodeId] = {}
+
+    def _compatible(self, o: M.NodeId, n: M.NodeId) -> bool:
+        return (
+            o not in self.old2new
+            and n not in self.new2old
+            and self.old.nodes[o].type == self.new.nodes[n].type
+        )
+
+    def match(self, o: M.NodeId, n: M.NodeId) -> bool:
+        if not self._compatible(o, n):
+            return False
+        self.old2new[o] = n
+        self.new2old[n] = o
+        return True
+
+    def propagate(self, pairs: Iterable[tuple[M.NodeId, M.NodeId]]) -> None:
+        """Extend matches along links sharing an accessor with a matched pair."""
+        queue = deque(pairs)
+        while queue:
+            o, n = queue.popleft()
+            new_out = self.new_adj.out.get(n, {})
+            for accessor, ot in self.old_adj.out.get(o, {}).items():
+                nt = new_out.get(accessor)
+                if nt is not None and self.match(ot, nt):
+                    queue.append((ot, nt))
+
+    def anchor_names(self, same_value: bool) -> None:
+        """Match the nodes a variable name points to in both graphs.
+
+        With same_value only nodes whose round 0 hashes agree are anchored. A
+        name moved to another node, like a prepended list head, would otherwise
+        pin the wrong pair and propagation would shift every match after it.
+        """
+        old_names: defaultdict[str, list[M.NodeId]] = defaultdict(list)
+        for node, desc in self.old.nodes.items():
+            for name in desc.names.keys():
+                old_names[name].append(node)
+        new_names: defaultdict[str, list[M.NodeId]] = defaultdict(list)
+        for node, desc in self.new.nodes.items():
+            for name in desc.names.keys():
+                new_names[name].append(node)
+
+        anchors: list[tuple[M.NodeId, M.NodeId]] = []
+        for name, old_nodes in old_names.items():
+            new_nodes = new_names.get(name, [])
+            if len(old_nodes) != 1 or len(new_nodes) != 1:
+                continue
+            o, n = old_nodes[0], new_nodes[0]
+            if same_value and self.old_hashes[0][o] != self.new_hashes[0][n]:
+                continue
+            if self.match(o, n):
+                anchors.append((o, n))
+        self.propagate(anchors)
+
+    def match_round(self, round: int) -> None:
+        """Match unmatched nodes whose round hash is unique on both sides."""
+        old_groups: defaultdict[int, list[M.NodeId]] = defaultdict(list)
+        for node, h in self.old_hashes[round].items():
+            if node not in self.old2new:
+                old_groups[h].append(node)
+        new_groups: defaultdict[int, list[M.NodeId]] = defaultdict(list)
+        for node, h in self.new_hashes[round].items():
+            if node not in self.new2old:
+                new_groups[h].append(node)
+
+        matched: list[tuple[M.NodeId, M.NodeId]] = []
+        for h, old_nodes in old_groups.items():
+            new_nodes = new_groups.get(h, [])
+            if len(old_nodes) == 1 and len(new_nodes) == 1:
+                if self.match(old_nodes[0], new_nodes[0]):
+                    matched.append((old_nodes[0], new_nodes[0]))
+        self.propagate(matched)
+
+    def match_addresses(self) -> None:
+        for node in self.old.nodes.keys():
+            if node in self.new.nodes:
+                self.match(node, node)
+
+
+def match_nodes(old: M.Graph, new: M.Graph, rounds: int = WL_ROUNDS) -> dict[M.NodeId, M.NodeId]:
+    """Map old node ids to the new node ids they structurally correspond to.
+
+    Matching runs in order of confidence, each match followed along shared
+    accessors: unique WL hashes of the widest neighbourhood, variable names
+    whose nodes kept their value, unique hashes of narrower and narrower
+    neighbourhoods, the remaining names and finally equal addresses.
+    """
+    m = _Matching(old, new, rounds)
+    m.match_round(rounds)
+    m.anchor_names(same_value=True)
+    for round in reversed(range(rounds)):
+        m.match_round(round)
+    m.anchor_names(same_value=False)
+    m.match_addresses()
+    return m.old2new
+
+
+def structural_difference(old: M.Graph, new: M.Graph) -> M.Graph:
+    """Graph.difference with nodes matched structurally instead of by address."""
+    old2new = match_nodes(old, new)
+
+    def relabel(node: M.NodeId) -> M.NodeId:
+        if node in old2new:
+            return old2new[node]
+        # unmatched old node whose address got reused by another new node
+        if node in new.nodes:
+            return f"{node}@old"
+        return node
+
+    relabeled = M.Graph(
+        nodes={relabel(node): desc for node, desc in old.nodes.items()},
+        links={
+            (relabel(source), relabel(target)): desc
+            for (source, target), desc in old.links.items()
+        },
+        pruned_fields=old.pruned_fields,
+    )
+    return relabeled.difference(new)
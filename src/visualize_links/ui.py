@@ -1,12 +1,17 @@
 # Copyright (c) Indrajit Banerjee
 # Licensed under the MIT License.
 
+import argparse
 from pathlib import Path
 import shutil
+import socket
 import sys
 import subprocess
+from typing import Optional
 import webbrowser
 
+from .lldb_plugin.config import Config
+
 # good enough heuristic...
 def is_wsl():
     try:
@@ -16,27 +21,90 @@ def is_wsl():
         return False
 
 
-def main() -> int:
+def _open_file(query: str) -> bool:
     index_file = Path(__file__).parent / "static" / "index.html"
 
     if is_wsl():
         print("Detected WSL environment...")
         if shutil.which("/usr/bin/wslpath") is None:
             print(f"wslpath not found, open manually: {index_file.resolve()}")
-            return 1
+            return False
         if shutil.which("/mnt/c/Windows/explorer.exe") is None:
             print(f"explorer.exe not found, open manually: {index_file.resolve()}")
-            return 1
+            return False
+
+        if query:
+            print(f"explorer.exe drops url queries, append {query} to the opened url")
 
         win_uri = subprocess.check_output(["wslpath", "-w", str(index_file)], text=True)
         subprocess.run(["/mnt/c/Windows/explorer.exe", win_uri])
-        return 0
+        return True
     else:
-        if webbrowser.open(index_file.as_uri()):
-            return 0
+        if webbrowser.open(index_file.as_uri() + query):
+            return True
         else:
             print(f"webbrowser open failed, open manually: {index_file.resolve()}")
-            return 1
+            return False
+
+
+def _open_url(url: str) -> bool:
+    if is_wsl() and shutil.which("/mnt/c/Windows/explorer.exe") is not None:
+        subprocess.run(["/mnt/c/Windows/explorer.exe", url])
+        return True
+    if webbrowser.open(url):
+        return True
+    print(f"webbrowser open failed, open manually: {url}")
+    return False
+
+
+def _is_listening(host: str, port: int) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+
+def open_ui(port: Optional[int] = None) -> bool:
+    """Open the ui served by the plugin server, or the bundled file if none runs yet."""
+    config = Config.from_env()
+    port = port or config.port
+    if _is_listening(config.host, port):
+        return _open_url(f"http://{config.host}:{port}/")
+    return _open_file("" if port == Config().port else f"?port={port}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Open the visualize-links ui.")
+    parser.add_argument(
+        "--port", type=int, help="port the lldb plugin server listens on (default 8765)"
+    )
+    parser.add_argument(
+        "--hub",
+        action="store_true",
+        help="also run a hub that several lldb sessions publish to, until interrupted",
+    )
+    args = parser.parse_args()
+
+    if not args.hub:
+        return 0 if open_ui(args.port) else 1
+
+    from .lldb_plugin.hub import Hub
+
+    try:
+        hub = Hub()
+    except OSError as e:
+        print(f"visualize-links hub failed to start: {e}")
+        return 1
+    print(f"visualize-links hub accepting debuggers on {hub.config.host}:{hub.config.hub_port}")
+
+    print(f"ui server listening on {hub.ws.ui_url()}")
+    open_ui(hub.ws.port)
+    try:
+        hub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
 
 
 if __name__ == "__main__":
@@ -0,0 +1,48 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+"""Synthetic graphs shaped like the ones GraphBuilder captures."""
+
+from typing import Optional, Sequence
+
+from visualize_links.lldb_plugin import model as M
+from visualize_links.lldb_plugin.history import HistoryLabel
+
+
+def node(type: str = "ListNode", names: Sequence[str] = (), **attrs: M.AttrScalar) -> M.NodeDesc:
+    return M.NodeDesc(
+        type=M.TypeDesc(name=type),
+        attrs={
+            attr: M.AttrValue(scalar=value, diff_type=None, old_scalar=None)
+            for attr, value in attrs.items()
+        },
+        names={name: M.NameDesc(diff_type=None) for name in names},
+    )
+
+
+def link(*accessors: str) -> M.LinkDesc:
+    return M.LinkDesc(
+        accessors={accessor: M.AccessorDesc(diff_type=None) for accessor in accessors}
+    )
+
+
+def list_graph(
+    values: Sequence[int],
+    addrs: Optional[Sequence[int]] = None,
+    head: Optional[str] = "head",
+) -> M.Graph:
+    """Singly linked list of ListNodes holding values, named head at the front."""
+    addrs = addrs if addrs is not None else [0x1000 + 0x20 * i for i in range(len(values))]
+    ids = [f"ADDR{addr}" for addr in addrs]
+    nodes = {
+        id: node(names=[head] if i == 0 and head else [], val=value)
+        for i, (id, value) in enumerate(zip(ids, values))
+    }
+    links = {(ids[i], ids[i + 1]): link("next") for i in range(len(ids) - 1)}
+    return M.Graph(nodes=nodes, links=links)
+
+
+def label(desc: str, line: int = 1) -> HistoryLabel:
+    return HistoryLabel(
+        filename="list.cpp", line=line, column=1, function_name="main", desc=desc
+    )
@@ -0,0 +1,28 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+from visualize_links.lldb_plugin.config import Config
+
+
+def test_from_env_reads_integers(monkeypatch):
+    monkeypatch.setenv("VISUALIZE_LINKS_PORT", "9000")
+    monkeypatch.setenv("VISUALIZE_LINKS_MAX_HISTORY", "5")
+    monkeypatch.setenv("VISUALIZE_LINKS_COMPRESSION_LEVEL", "0")
+    config = Config.from_env()
+    assert config.port == 9000
+    assert config.max_history == 5
+    assert config.compression_level == 0
+
+
+def test_from_env_falls_back_on_malformed_values(monkeypatch, capsys):
+    monkeypatch.setenv("VISUALIZE_LINKS_PORT", "80a")
+    monkeypatch.setenv("VISUALIZE_LINKS_BATCH_SIZE", "1e3")
+    monkeypatch.setenv("VISUALIZE_LINKS_MAX_HISTORY", "all")
+    config = Config.from_env()
+    default = Config()
+    assert config.port == default.port
+    assert config.batch_size == default.batch_size
+    assert config.max_history is None
+    out = capsys.readouterr().out
+    assert "VISUALIZE_LINKS_PORT='80a'" in out
+    assert "VISUALIZE_LINKS_BATCH_SIZE" in out
@@ -0,0 +1,96 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+import json
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from graphs import label, list_graph
+from visualize_links.lldb_plugin.export import Snapshot, export_snapshots
+
+GRAPHML = "{http://graphml.graphdrawing.org/xmlns}"
+
+
+def history() -> Iterator[Snapshot]:
+    # a generator like the hub's, it can only be walked once
+    g1 = list_graph([1, 2, 3])
+    g2 = list_graph([1, 5, 3, 4])
+    g2.pruned_fields = {"ListNode": ["prev"]}
+    yield Snapshot(index=0, label=label("first"), graph=g1, prev=None)
+    yield Snapshot(index=1, label=label("second"), graph=g2, prev=g1)
+
+
+def single() -> Iterator[Snapshot]:
+    _, s = history()
+    return iter([s._replace(prev=None)])
+
+
+def test_history_dot_is_one_graph(tmp_path: Path):
+    path = tmp_path / "history.dot"
+    export_snapshots(history(), "dot", str(path), history=True)
+    dot = path.read_text()
+
+    assert dot.count("digraph") == 1
+    assert '"0:ADDR4096" [' in dot and '"1:ADDR4096" [' in dot
+    assert '"0:ADDR4096" -> "0:ADDR4128"' in dot
+    # value 2 became 5, 4 was appended
+    assert '"snapshot"="1", "node_id"="ADDR4128", "diff"="changed"' in dot
+    assert '"snapshot"="1", "node_id"="ADDR4192", "diff"="added"' in dot
+
+
+def test_history_graphml_is_one_graph(tmp_path: Path):
+    path = tmp_path / "history.graphml"
+    export_snapshots(history(), "graphml", str(path), history=True)
+    root = ET.parse(path).getroot()
+
+    keys = {key.get("id"): key.get("attr.name") for key in root.iter(f"{GRAPHML}key")}
+    (graph,) = root.iter(f"{GRAPHML}graph")
+    nodes = graph.findall(f"{GRAPHML}node")
+    edges = graph.findall(f"{GRAPHML}edge")
+    assert len(nodes) == 3 + 4
+    assert len(edges) == 2 + 3
+
+    def data(element: ET.Element) -> dict[str, str]:
+        return {keys[d.get("key")]: d.text for d in element.iter(f"{GRAPHML}data")}
+
+    assert data(nodes[4]) == {
+        "type": "ListNode", "snapshot": "1", "node_id": "ADDR4128", "diff": "changed", "val": "5"
+    }
+    assert {data(e)["snapshot"] for e in edges} == {"0", "1"}
+    assert edges[-1].get("source") == "1:ADDR4160"
+
+
+def test_single_graphml_keeps_ids(tmp_path: Path):
+    path = tmp_path / "single.graphml"
+    export_snapshots(single(), "graphml", str(path), history=False)
+    root = ET.parse(path).getroot()
+
+    (graph,) = root.iter(f"{GRAPHML}graph")
+    assert graph.get("id") == "snapshot_1"
+    assert [n.get("id") for n in graph.findall(f"{GRAPHML}node")][:1] == ["ADDR4096"]
+    assert "snapshot" not in {key.get("id") for key in root.iter(f"{GRAPHML}key")}
+
+
+def test_jsonl_keeps_pruned_fields(tmp_path: Path):
+    path = tmp_path / "single.jsonl"
+    export_snapshots(single(), "jsonl", str(path), history=False)
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+
+    assert [line["kind"] for line in lines] == ["node"] * 4 + ["link"] * 3 + ["pruned"]
+    assert lines[-1] == {"kind": "pruned", "type": "ListNode", "fields": ["prev"]}
+
+
+def test_parquet_keeps_pruned_fields(tmp_path: Path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    path = tmp_path / "history.parquet"
+    export_snapshots(history(), "parquet", str(path), history=True)
+    rows = pq.read_table(path).to_pylist()
+
+    assert len(rows) == 3 + 2 + 4 + 3 + 1
+    assert rows[-1]["kind"] == "pruned"
+    assert (rows[-1]["snapshot"], rows[-1]["type"], rows[-1]["fields"]) == (1, "ListNode", ["prev"])
@@ -0,0 +1,157 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+"""Heap scans of hand-built memory, a ListNode { int val; ListNode *next; }
+allocated with glibc malloc on a 64-bit little-endian target.
+
+Each malloc chunk is four words: prev_size, size | flags, then the instance
+(val, next), so instances sit at word 2 of every chunk and their header word
+right before.
+"""
+
+from typing import Optional
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from visualize_links.lldb_plugin import heap as H
+
+BASE = 0x10000
+PS = 8
+CHUNK = 4
+# glibc size word of a chunk in use, previous chunk in use
+SIZE = 0x21
+
+LAYOUT = H.HeapLayout(
+    size=16,
+    pointer_size=PS,
+    little_endian=True,
+    self_offsets=[8],
+    other_offsets=[],
+    align=16,
+    header=H.glibc_header(16, PS),
+)
+
+
+def addr(chunk: int) -> int:
+    """Address of the instance in chunk."""
+    return BASE + (chunk * CHUNK + 2) * PS
+
+
+def memory(chunks: list[Optional[tuple[int, int]]]) -> np.ndarray:
+    """Words of consecutive chunks, (val, next) of the instance or None for free."""
+    words = np.zeros(len(chunks) * CHUNK, dtype=np.uint64)
+    for i, instance in enumerate(chunks):
+        if instance is not None:
+            words[i * CHUNK + 1 : i * CHUNK + 4] = (SIZE, *instance)
+    return words
+
+
+def reader(words: np.ndarray):
+    data = words.astype("<u8").tobytes()
+
+    def read(start: int, size: int) -> Optional[bytes]:
+        if start < BASE or start + size > BASE + len(data):
+            return None
+        return data[start - BASE : start - BASE + size]
+
+    return read
+
+
+def scan(words: np.ndarray, chunk_size: int = H.HEAP_CHUNK_SIZE) -> list[int]:
+    region = [H.HeapRegion(BASE, BASE + len(words) * PS)]
+    return H.scan_heap(region, region, reader(words), LAYOUT, chunk_size).addresses.tolist()
+
+
+def test_glibc_header_sizes():
+    assert H.glibc_header(16, 8) == H.MallocHeader(min_size=32, max_size=48, flag_bits=3)
+    assert H.glibc_header(40, 8) == H.MallocHeader(min_size=48, max_size=64, flag_bits=3)
+
+
+def test_filter_checks_header_word_before_each_position():
+    words = memory([(1, addr(1)), (2, 0), None])
+    # a bad size word before an otherwise plausible instance
+    words[2 * CHUNK + 1 : 2 * CHUNK + 4] = (0x1000, 3, addr(0))
+    heap = H.AddressRanges([H.HeapRegion(BASE, BASE + len(words) * PS)])
+
+    # every second word from the first instance on
+    idx, self_ptrs, nonnull = H._filter(words, None, 2, len(words) - 2, LAYOUT, heap, heap)
+
+    assert idx.tolist() == [2, 6]
+    assert self_ptrs.tolist() == [[addr(1)], [0]]
+    assert nonnull.tolist() == [True, False]
+
+
+def test_filter_gathers_given_positions():
+    words = memory([(1, addr(1)), (2, 0), (3, BASE + 4)])
+    heap = H.AddressRanges([H.HeapRegion(BASE, BASE + len(words) * PS)])
+
+    # the misaligned pointer of the last one fails
+    idx, self_ptrs, _ = H._filter(words, np.array([2, 6, 10]), 0, 3, LAYOUT, heap, heap)
+
+    assert idx.tolist() == [2, 6]
+    assert self_ptrs.tolist() == [[addr(1)], [0]]
+
+
+def test_scan_finds_linked_instances_and_skips_zeroed_memory():
+    words = memory([(1, addr(2)), None, (2, addr(3)), (3, 0), None, (4, 0)])
+    # the list, not the unlinked all-null instance nor free chunks
+    assert scan(words) == [addr(0), addr(2), addr(3)]
+
+
+def test_scan_has_no_header_before_region_start():
+    # an instance at the region start pointing to the one at word 4, the last
+    # word looks like its header if the word before wrapped around
+    words = np.array([1, BASE + 4 * PS, 0, SIZE, 2, 0, 0, SIZE], dtype=np.uint64)
+    assert scan(words) == []
+
+
+def test_scan_reads_list_tail_in_another_chunk():
+    words = memory([(1, addr(1)), (2, addr(3)), None, (3, 0)])
+    # one malloc chunk per scanned chunk, the tail is only reached by pointer
+    assert scan(words, chunk_size=CHUNK * PS) == [addr(0), addr(1), addr(3)]
+
+
+def test_consistent_drops_dangling_links_to_a_fixpoint():
+    addrs = np.array([0x100, 0x200, 0x300, 0x400], dtype=np.uint64)
+    # 0x100 -> 0x200 -> 0x300 -> 0x999 (no candidate), 0x400 ends
+    ptrs = np.array([[0x200], [0x300], [0x999], [0]], dtype=np.uint64)
+    assert H._consistent(addrs, ptrs).tolist() == [False, False, False, True]
+
+
+def test_chain_sizes_counts_components():
+    addrs = np.array([0x100, 0x200, 0x300, 0x400, 0x500, 0x600], dtype=np.uint64)
+    # 0x100 -> 0x200 <- 0x300, 0x400 alone, 0x500 <-> 0x600
+    ptrs = np.array(
+        [[0x200, 0], [0, 0], [0, 0x200], [0, 0], [0x600, 0], [0x500, 0]], dtype=np.uint64
+    )
+    assert H._chain_sizes(addrs, ptrs).tolist() == [3, 3, 3, 1, 2, 2]
+
+
+def test_overlapping_keeps_longer_chain():
+    addrs = np.array([0x100, 0x108, 0x120, 0x130], dtype=np.uint64)
+    # 0x108 -> 0x120 -> 0x130 is a chain of 3, 0x100 overlaps 0x108 alone
+    ptrs = np.array([[0], [0x120], [0x130], [0]], dtype=np.uint64)
+    assert H._overlapping(addrs, ptrs, 16).tolist() == [True, False, False, False]
+
+
+def test_overlapping_ties_keep_lower_address():
+    addrs = np.array([0x100, 0x108], dtype=np.uint64)
+    ptrs = np.zeros((2, 1), dtype=np.uint64)
+    assert H._overlapping(addrs, ptrs, 16).tolist() == [False, True]
+
+
+def test_overlapping_only_drops_what_a_kept_candidate_overlaps():
+    # 0x108 overlaps both 0x100 & 0x110, which don't overlap each other.
+    # chains: 0x110 of 3, 0x108 of 2, 0x100 alone
+    addrs = np.array([0x100, 0x108, 0x110, 0x200, 0x300, 0x400], dtype=np.uint64)
+    ptrs = np.array([[0], [0x200], [0x300], [0], [0x400], [0]], dtype=np.uint64)
+    assert H._overlapping(addrs, ptrs, 16).tolist() == [False, True, False, False, False, False]
+
+
+def test_orphan_roots_one_entry_per_structure():
+    nodes = ["a", "b", "c", "d", "e", "f"]
+    links = [("a", "b"), ("b", "c"), ("d", "e"), ("e", "d"), ("f", "f")]
+    # b is only pointed to from reachable a, d & e form a cycle, f loops on itself
+    assert H.orphan_roots(nodes, links, reachable={"a"}) == ["b", "f", "d"]
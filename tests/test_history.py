@@ -0,0 +1,51 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+from graphs import label, list_graph
+from visualize_links.lldb_plugin.cola_graph import convert_to_cola
+from visualize_links.lldb_plugin.history import History, HistoryItem
+
+
+def add(history: History, n: int) -> tuple[int, list[int]]:
+    g = list_graph(list(range(n)))
+    return history.add(label(f"list {n}"), g, convert_to_cola(g))
+
+
+def test_pages_newest_first():
+    history = History()
+    for n in range(1, 6):
+        add(history, n)
+
+    assert [i for i, _ in history.page(0, 2)] == [4, 3]
+    assert [(i, l.desc) for i, l in history.page(3, 10)] == [(1, "list 2"), (0, "list 1")]
+    assert history.page(5, 2) == []
+    assert history.newest_index() == 4
+
+
+def test_evicts_oldest():
+    evicted: list[HistoryItem] = []
+    history = History(max_items=2, on_evict=evicted.append)
+
+    assert add(history, 1) == (0, [])
+    assert add(history, 2) == (1, [])
+    assert add(history, 3) == (2, [0])
+    assert [item.label.desc for item in evicted] == ["list 1"]
+    assert [i for i, _ in history] == [2, 1]
+    assert len(history) == 2
+
+
+def test_iterators_survive_adds():
+    # the server pages while the debugger adds & evicts
+    history = History(max_items=3)
+    for n in range(1, 4):
+        add(history, n)
+
+    labels = iter(history)
+    items = history.items()
+    next(labels)
+    for n in range(4, 8):
+        add(history, n)
+
+    assert [i for i, _ in labels] == [1, 0]
+    assert [i for i, _ in items] == [0, 1, 2]
+    assert [i for i, _ in history] == [6, 5, 4]
@@ -0,0 +1,72 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+import socket
+import threading
+
+import pytest
+
+from graphs import label, link, list_graph, node
+from visualize_links.lldb_plugin import hub as H
+from visualize_links.lldb_plugin import model as M
+from visualize_links.lldb_plugin.config import Config
+
+
+@pytest.fixture
+def config():
+    return Config(port=8945, port_attempts=50, hub_port=8944)
+
+
+@pytest.fixture
+def hub(config: Config):
+    hub = H.Hub(config)
+    thread = threading.Thread(target=hub.serve_forever, daemon=True)
+    thread.start()
+    yield hub
+    hub.shutdown()
+    thread.join(timeout=5)
+
+
+@pytest.fixture
+def client(hub: H.Hub, config: Config):
+    client = H.HubClient.connect(config, "test")
+    assert client is not None
+    yield client
+    client.stop()
+
+
+def test_link_to_unknown_node_is_answered(client: H.HubClient):
+    batch = M.GraphBatch(
+        nodes={"ADDR1": node(val=1)}, links={("ADDR1", "ADDR2"): link("next")}
+    )
+    with pytest.raises(RuntimeError, match="KeyError: 'ADDR2'"):
+        client.publish_graph_stream(label("dangling"), [batch])
+    assert not client.closed
+
+    # the hub keeps serving the connection
+    g = list_graph([1, 2, 3])
+    batch = M.GraphBatch(nodes=g.nodes, links=g.links)
+    assert client.publish_graph_stream(label("list 3"), [batch]) == 0
+    assert [index for index, _ in client.history] == [0]
+
+
+def test_missing_history_index_raises_key_error(client: H.HubClient):
+    with pytest.raises(KeyError) as e:
+        client.publish_diff_graph(5, 6)
+    assert e.value.args[0] == 5
+    assert not client.closed
+
+
+def test_stalled_hub_times_out(config: Config, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(H, "HUB_READ_TIMEOUT", 0.2)
+    # accepts plugins but never answers
+    stalled = socket.create_server((config.host, config.hub_port))
+    try:
+        client = H.HubClient.connect(config, "test")
+        assert client is not None
+        with pytest.raises(ConnectionError, match="did not answer"):
+            list(client.history)
+        assert client.closed
+        client.stop()
+    finally:
+        stalled.close()
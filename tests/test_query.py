@@ -0,0 +1,110 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+import pytest
+
+from graphs import label, link, list_graph, node
+from visualize_links.lldb_plugin import model as M
+from visualize_links.lldb_plugin.cola_graph import convert_to_cola
+from visualize_links.lldb_plugin.history import History
+from visualize_links.lldb_plugin.query import GraphIndex, QueryError
+
+
+@pytest.fixture
+def index() -> GraphIndex:
+    # head: 1 -> 2 -> 3 -> 4, a pair node pointing at 3, a lone tree node
+    g = list_graph([1, 2, 3, 4])
+    g.nodes["ADDR1"] = node("std::pair<int, int>", names=["p"], first=16, second=-1)
+    g.nodes["ADDR2"] = node("TreeNode", names=["root"], val=1, weight=0.5)
+    g.nodes["ADDR3"] = node("TreeNode", tag="leaf")
+    g.links[("ADDR1", "ADDR4160")] = link("ptr")
+    g.pruned_fields = {"ListNode": ["prev"]}
+    return GraphIndex(g)
+
+
+@pytest.mark.parametrize(
+    "query, matches",
+    [
+        ("val == 2", {"ADDR4128"}),
+        ("val>=3", {"ADDR4160", "ADDR4192"}),
+        ("val != 1", {"ADDR4128", "ADDR4160", "ADDR4192"}),
+        ("ListNode.val == 1", {"ADDR4096"}),
+        ("TreeNode.val == 1", {"ADDR2"}),
+        ("val == 1", {"ADDR4096", "ADDR2"}),
+        ("std::pair<int, int>.first == 0x10", {"ADDR1"}),
+        ("second < 0", {"ADDR1"}),
+        ("weight < 1.5", {"ADDR2"}),
+        ("tag == 'leaf'", {"ADDR3"}),
+        ('tag == "leaf"', {"ADDR3"}),
+        ("missing == 1", set()),
+        # values of different kinds never compare
+        ("tag < 3", set()),
+    ],
+)
+def test_attr_queries(index: GraphIndex, query: str, matches: set[M.NodeId]):
+    assert index.query(query) == matches
+
+
+def test_name_reach_and_path(index: GraphIndex):
+    assert index.query("name head") == {"ADDR4096"}
+    assert index.query("name nobody") == set()
+    assert index.query("reach ADDR4128") == {"ADDR4128", "ADDR4160", "ADDR4192"}
+    assert index.query("path p 0x1060") == {"ADDR1", "ADDR4160", "ADDR4192"}
+    assert index.path("ADDR4096", "ADDR4192") == ["ADDR4096", "ADDR4128", "ADDR4160", "ADDR4192"]
+    # links are followed forwards only
+    assert index.query("path ADDR4192 head") == set()
+
+
+def test_resolve(index: GraphIndex):
+    assert index.resolve("head") == "ADDR4096"
+    assert index.resolve("ADDR4128") == "ADDR4128"
+    assert index.resolve("0x1020") == "ADDR4128"
+    assert index.resolve("1020") == "ADDR4128"
+
+    with pytest.raises(QueryError, match="unknown node '0x9999'"):
+        index.resolve("0x9999")
+    with pytest.raises(QueryError, match="unknown node 'tail'"):
+        index.resolve("tail")
+
+    index.names["twice"] = ["ADDR1", "ADDR2"]
+    with pytest.raises(QueryError, match="points to 2 nodes"):
+        index.resolve("twice")
+
+
+@pytest.mark.parametrize("query", ["reach", "path head", "val ~ 3", "", "walk head"])
+def test_invalid_queries(index: GraphIndex, query: str):
+    with pytest.raises(QueryError, match="invalid query"):
+        index.query(query)
+
+
+def test_neighbourhood_and_subgraph(index: GraphIndex):
+    # hops ignore link direction
+    assert index.neighbourhood({"ADDR4160"}, 0) == {"ADDR4160"}
+    assert index.neighbourhood({"ADDR4160"}, 1) == {"ADDR4128", "ADDR4160", "ADDR4192", "ADDR1"}
+    assert index.neighbourhood({"ADDR4160"}, 2) == {
+        "ADDR4096", "ADDR4128", "ADDR4160", "ADDR4192", "ADDR1"
+    }
+
+    sub = index.subgraph({"ADDR4096", "ADDR4128", "ADDR4192"})
+    assert sub.nodes.keys() == {"ADDR4096", "ADDR4128", "ADDR4192"}
+    assert sub.links.keys() == {("ADDR4096", "ADDR4128")}
+    assert sub.pruned_fields == {"ListNode": ["prev"]}
+
+
+def test_history_caches_indices_until_evicted():
+    history = History(max_items=2)
+    for values in ([1], [1, 2], [1, 2, 3]):
+        g = list_graph(values)
+        history.add(label(f"{len(values)} nodes"), g, convert_to_cola(g))
+
+    index = history.index_at(2)
+    assert history.index_at(2) is index
+    assert index.query("val == 3") == {"ADDR4160"}
+
+    history.index_at(1)
+    g = list_graph([7])
+    history.add(label("evicts #1"), g, convert_to_cola(g))
+    assert 1 not in history.indices
+    with pytest.raises(KeyError):
+        history.index_at(1)
+    assert history.index_at(2) is index
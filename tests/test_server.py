@@ -0,0 +1,96 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+import json
+import urllib.request
+
+import pytest
+from websockets.sync.client import connect
+
+from graphs import label, list_graph
+from visualize_links.lldb_plugin import model as M
+from visualize_links.lldb_plugin.config import Config
+from visualize_links.lldb_plugin.server import STATIC_DIR, Server
+
+
+def publish(server: Server, session: str, n: int) -> int:
+    g = list_graph(list(range(n)))
+    batch = M.GraphBatch(nodes=g.nodes, links=g.links)
+    return server.session(session).publish_graph_stream(label(f"list {n}"), [batch])
+
+
+@pytest.fixture
+def server():
+    server = Server(Config(port=8965, port_attempts=50))
+    yield server
+    server.stop()
+
+
+def test_serves_ui_over_http(server: Server):
+    with urllib.request.urlopen(server.ui_url(), timeout=5) as response:
+        assert response.headers["Content-Type"] == "text/html"
+        assert response.read() == (STATIC_DIR / "index.html").read_bytes()
+
+
+def test_websocket_lists_sessions_then_pages_history(server: Server):
+    for n in (3, 4, 5):
+        publish(server, "demo", n)
+
+    with connect(server.url(), max_size=None) as ws:
+        extensions = ws.response.headers.get("Sec-WebSocket-Extensions", "")
+        assert extensions.startswith("permessage-deflate")
+
+        assert json.loads(ws.recv(timeout=5)) == {"type": "sessions", "sessions": ["demo"]}
+
+        ws.send(json.dumps({"type": "session", "name": "demo"}))
+        ws.send(json.dumps({"type": "history", "offset": 1, "limit": 1}))
+        page = json.loads(ws.recv(timeout=5))
+
+    assert page["type"] == "history"
+    assert page["offset"] == 1
+    assert page["total"] == 3
+    assert page["newest_index"] == 2
+    assert [item["index"] for item in page["history"]] == [1]
+    assert page["history"][0]["label"]["desc"] == "list 4"
+
+
+def test_websocket_without_compression(server: Server):
+    plain = Server(Config(port=server.port + 1, port_attempts=50, compression_level=0))
+    try:
+        with connect(plain.url()) as ws:
+            assert "Sec-WebSocket-Extensions" not in ws.response.headers
+            assert json.loads(ws.recv(timeout=5))["type"] == "sessions"
+    finally:
+        plain.stop()
+
+
+def test_websocket_answers_missing_graphs_with_errors():
+    server = Server(Config(port=8965, port_attempts=50, max_history=2))
+    try:
+        for n in (3, 4, 5):
+            publish(server, "demo", n)
+
+        with connect(server.url(), max_size=None) as ws:
+            ws.recv(timeout=5)  # sessions
+
+            def request(data: dict) -> dict:
+                ws.send(json.dumps(data))
+                return json.loads(ws.recv(timeout=5))
+
+            # evicted
+            assert request({"type": "graph", "index": 0}) == {
+                "type": "error", "message": "no graph with index 0"
+            }
+            assert request({"type": "diff_graph", "old_index": 1, "new_index": 7}) == {
+                "type": "error", "message": "no graph with index 7"
+            }
+            assert request({"type": "query", "index": 9, "query": "val == 1"}) == {
+                "type": "error", "message": "no graph with index 9"
+            }
+            assert request({"type": "graph"}) == {"type": "error", "message": "KeyError: 'index'"}
+
+            graph = request({"type": "diff_graph", "old_index": 1, "new_index": 2})
+            assert graph["type"] == "graph"
+            assert graph["title"] == "comparing #1→#2"
+    finally:
+        server.stop()
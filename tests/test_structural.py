@@ -0,0 +1,88 @@
+# Copyright (c) Indrajit Banerjee
+# Licensed under the MIT License.
+
+from graphs import link, list_graph, node
+from visualize_links.lldb_plugin import model as M
+from visualize_links.lldb_plugin.structural import match_nodes, structural_difference
+
+A, B, C, X = 0x1000, 0x1020, 0x1040, 0x1060
+
+
+def ids(*addrs: int) -> list[M.NodeId]:
+    return [f"ADDR{addr}" for addr in addrs]
+
+
+def test_reallocated_copy_has_no_changes():
+    old = list_graph([1, 2, 3], addrs=[A, B, C])
+    new = list_graph([1, 2, 3], addrs=[0x8000, 0x8020, 0x8040])
+
+    assert match_nodes(old, new) == dict(zip(ids(A, B, C), ids(0x8000, 0x8020, 0x8040)))
+
+    diff = structural_difference(old, new)
+    assert diff.nodes.keys() == new.nodes.keys()
+    assert {v.diff_type for desc in diff.nodes.values() for v in desc.attrs.values()} == {
+        "both_same"
+    }
+    assert diff.nodes["ADDR32768"].names == {"head": M.NameDesc(diff_type="both")}
+    assert diff.links.keys() == new.links.keys()
+    assert {a.diff_type for desc in diff.links.values() for a in desc.accessors.values()} == {
+        "both"
+    }
+
+
+def test_prepended_head_does_not_shift_matches():
+    # head moved to a new node, the rest was reallocated
+    old = list_graph([1, 2, 3], addrs=[A, B, C])
+    new = list_graph([0, 1, 2, 3], addrs=[0x8000, 0x8020, 0x8040, 0x8060])
+
+    assert match_nodes(old, new) == dict(zip(ids(A, B, C), ids(0x8020, 0x8040, 0x8060)))
+
+    diff = structural_difference(old, new)
+    assert diff.nodes["ADDR32768"].attrs["val"].diff_type == "new"
+    assert diff.nodes["ADDR32800"].names == {"head": M.NameDesc(diff_type="old")}
+    assert diff.nodes["ADDR32800"].attrs["val"].diff_type == "both_same"
+
+
+def test_name_anchors_a_changed_node():
+    old = list_graph([1, 2, 3], addrs=[A, B, C])
+    new = list_graph([9, 2, 3], addrs=[0x8000, 0x8020, 0x8040])
+
+    assert match_nodes(old, new)[f"ADDR{A}"] == "ADDR32768"
+    assert structural_difference(old, new).nodes["ADDR32768"].attrs["val"] == M.AttrValue(
+        scalar=9, diff_type="both_diff", old_scalar=1
+    )
+
+
+def test_reused_address_gets_old_id():
+    # the front node was freed and its address reused for a new second node,
+    # the tail node's address was reused for the head
+    old = list_graph([1, 2, 3], addrs=[A, B, C])
+    new = list_graph([1, 2], addrs=[C, A])
+
+    assert match_nodes(old, new) == {f"ADDR{A}": f"ADDR{C}", f"ADDR{B}": f"ADDR{A}"}
+
+    diff = structural_difference(old, new)
+    assert diff.nodes.keys() == {f"ADDR{C}", f"ADDR{A}", f"ADDR{C}@old"}
+    assert diff.nodes[f"ADDR{C}@old"].attrs["val"] == M.AttrValue(
+        scalar=3, diff_type="old", old_scalar=None
+    )
+    assert diff.links[(f"ADDR{A}", f"ADDR{C}@old")].accessors["next"].diff_type == "old"
+
+
+def test_falls_back_to_addresses():
+    # identical isolated nodes can't be told apart by structure
+    old = M.Graph(nodes={id: node(val=0) for id in ids(A, B)}, links={})
+    new = M.Graph(nodes={id: node(val=0) for id in ids(B, A, X)}, links={})
+
+    assert match_nodes(old, new) == {f"ADDR{A}": f"ADDR{A}", f"ADDR{B}": f"ADDR{B}"}
+
+
+def test_types_never_match():
+    old = M.Graph(nodes={f"ADDR{A}": node("ListNode", val=1)}, links={})
+    new = M.Graph(
+        nodes={f"ADDR{A}": node("TreeNode", val=1), f"ADDR{B}": node("TreeNode", val=1)},
+        links={(f"ADDR{A}", f"ADDR{B}"): link("left")},
+    )
+
+    assert match_nodes(old, new) == {}
+    assert f"ADDR{A}@old" in structural_difference(old, new).nodes
@@ -6,7 +6,18 @@ import * as cola from 'webcola';
 
 import * as M from "./model";
 
-const WS_URL = "ws://localhost:8765";
+const URL_PARAMS = new URLSearchParams(window.location.search);
+// served by the plugin, the websocket shares the page's host & port (e.g. through
+// an ssh tunnel). opened as a file, the plugin falls back to the next free port
+// when 8765 is taken, pass it as ?port=N
+const SERVED = window.location.protocol === "http:" || window.location.protocol === "https:";
+const WS_HOST = SERVED ? window.location.hostname : "localhost";
+const WS_PORT = URL_PARAMS.get("port");
+const WS_URL = `${window.location.protocol === "https:" ? "wss" : "ws"}://` +
+  (WS_PORT !== null ? `${WS_HOST}:${WS_PORT}` : SERVED ? window.location.host : `${WS_HOST}:8765`);
+// a hub serves several debuggers, ?session=NAME picks the one to watch so that
+// sessions can be shown side by side in separate windows
+const URL_SESSION = URL_PARAMS.get("session");
 
 let WS_CLIENT: WebSocket | null = null;
 
@@ -19,6 +30,10 @@ const title = d3.select("#title");
 const canvasSvg = d3.select("#canvasSvg").attr("viewBox", `0 0 ${WIDTH} ${HEIGHT}`);
 const canvas = canvasSvg.select("#canvas");
 const historyCanvas = d3.select("#historyItemListDiv");
+const historyViewport = historyCanvas.append("div").attr("id", "historyViewportDiv");
+const sessionSelect = document.getElementById("sessionSelect") as HTMLSelectElement;
+// session whose graphs are shown, null until the server lists sessions
+let currentSession: string | null = null;
 
 canvasSvg.call(
   d3.zoom()
@@ -27,11 +42,41 @@ canvasSvg.call(
 
 const compareBtn = document.getElementById("compareBtn")!;
 const modal = document.getElementById("compareModal")!;
-const oldSelect = document.getElementById("oldSelect")!;
-const newSelect = document.getElementById("newSelect")!;
+const oldInput = document.getElementById("oldInput") as HTMLInputElement;
+const newInput = document.getElementById("newInput") as HTMLInputElement;
 const cancelBtn = document.getElementById("cancelCompareBtn")!;
 const confirmBtn = document.getElementById("confirmCompareBtn")!;
-let currentHistory: M.History = [];
+const structuralCheckbox = document.getElementById("structuralCheckbox") as HTMLInputElement;
+
+// history pane is virtualized: rows have a fixed height and only the visible
+// ones (plus some overscan) exist in the DOM. items are fetched page by page
+// and kept by index, row r shows the r-th newest item.
+const HISTORY_ROW_HEIGHT = 112;
+const HISTORY_PAGE_SIZE = 50;
+const HISTORY_OVERSCAN = 4;
+// a failed page request gets no reply, rows it didn't deliver may be requested
+// again after this many ms
+const HISTORY_PAGE_TIMEOUT = 5000;
+const historyItems = new Map<number, M.HistoryItem>();
+const historyRequested = new Set<number>();
+let historyTotal = 0;
+let historyNewest = -1;
+
+const queryInput = document.getElementById("queryInput") as HTMLInputElement;
+const hopsInput = document.getElementById("hopsInput") as HTMLInputElement;
+const queryBtn = document.getElementById("queryBtn")!;
+// history index of the shown graph, queries run against it
+let currentIndex: number | null = null;
+
+// graphs are streamed batch by batch while the debugger traverses them, the
+// partial graph is re-rendered at most once per STREAM_RENDER_INTERVAL ms
+const STREAM_RENDER_INTERVAL = 250;
+let streamId: number | null = null;
+let streamNodes: M.Node[] = [];
+let streamLinks: M.Link[] = [];
+// false once another graph is shown, batches then only accumulate
+let streamShown = false;
+let streamRenderTimer: number | null = null;
 
 // node margin helps keep space between node & edge boundaries
 const nodeMargin = 4;
@@ -40,12 +85,27 @@ const nodePad = 8;
 // extra space used when computing link lengths based on label width
 const linkPad = 10;
 
+// layout of the rendered graph, stopped before the canvas is cleared
+let currentSimulation: ReturnType<typeof cola.d3adaptor> | null = null;
+
+function stopSimulation() {
+  if (currentSimulation === null) {
+    return;
+  }
+  // the adaptor still fires end on its next timer tick after stop(), detach
+  // the handlers so it neither touches removed elements nor the loading screen
+  currentSimulation.on("tick", () => { }).on("end", () => { });
+  currentSimulation.stop();
+  currentSimulation = null;
+}
+
 function renderGraph(graph: M.Graph) {
   showLoadingScreen();
 
   console.log("graph", graph);
 
   // reset render
+  stopSimulation();
   canvas.selectAll("*").remove();
 
   // recover internal pointers
@@ -328,6 +388,7 @@ function renderGraph(graph: M.Graph) {
   simulation.on("tick", tick);
   simulation.on("end", hideLoadingScreen);
 
+  currentSimulation = simulation;
   simulation.start(25, 50, 50);
   [valueNodesRect, nameNodesRect, valueNodesText, nameNodesText].forEach(d => d.call(simulation.drag));
 
@@ -359,17 +420,85 @@ function renderGraph(graph: M.Graph) {
   // });
 }
 
-function renderHistory(history: M.History) {
-  currentHistory = history;
-  console.log(history);
+function requestHistoryPage(offset: number) {
+  if (!WS_CLIENT) {
+    return;
+  }
+  const indices: number[] = [];
+  for (let r = offset; r < offset + HISTORY_PAGE_SIZE; r++) {
+    indices.push(historyNewest - r);
+  }
+  indices.forEach(index => historyRequested.add(index));
+  window.setTimeout(() => expireHistoryPage(indices), HISTORY_PAGE_TIMEOUT);
+  WS_CLIENT.send(JSON.stringify({ type: "history", offset: offset, limit: HISTORY_PAGE_SIZE }));
+}
 
-  // reset render
-  historyCanvas.selectAll("*").remove();
+function expireHistoryPage(indices: number[]) {
+  const missing = indices.filter(index => !historyItems.has(index) && historyRequested.delete(index));
+  if (missing.length > 0) {
+    renderHistory();
+  }
+}
+
+function resetHistory(page: M.HistoryPage) {
+  historyItems.clear();
+  historyRequested.clear();
+  historyTotal = page.total;
+  historyNewest = page.newest_index ?? -1;
+  receiveHistoryPage(page);
+}
+
+function receiveHistoryPage(page: M.HistoryPage) {
+  page.history.forEach(item => historyItems.set(item.index, item));
+  renderHistory();
+}
+
+function appendHistoryItem(item: M.HistoryItem) {
+  historyItems.set(item.index, item);
+  historyTotal += 1;
+  historyNewest = item.index;
+  renderHistory();
+}
+
+function evictHistoryItems(indices: number[]) {
+  indices.forEach(index => {
+    historyItems.delete(index);
+    historyRequested.delete(index);
+  });
+  historyTotal -= indices.length;
+  renderHistory();
+}
+
+function renderHistory() {
+  const viewport = historyCanvas.node() as HTMLElement;
+  historyViewport.style("height", `${historyTotal * HISTORY_ROW_HEIGHT}px`);
+
+  const firstRow = Math.max(0, Math.floor(viewport.scrollTop / HISTORY_ROW_HEIGHT) - HISTORY_OVERSCAN);
+  const lastRow = Math.min(historyTotal, Math.ceil((viewport.scrollTop + viewport.clientHeight) / HISTORY_ROW_HEIGHT) + HISTORY_OVERSCAN);
+
+  const rows: M.HistoryRow[] = [];
+  let missingRow = -1;
+  for (let row = firstRow; row < lastRow; row++) {
+    const item = historyItems.get(historyNewest - row);
+    if (item) {
+      rows.push({ row: row, item: item });
+    } else if (missingRow < 0 && !historyRequested.has(historyNewest - row)) {
+      missingRow = row;
+    }
+  }
+  if (missingRow >= 0) {
+    requestHistoryPage(missingRow);
+  }
+
+  const rowsDiv = historyViewport.selectAll<HTMLDivElement, M.HistoryRow>(".historyItem")
+    .data(rows, historyRow => `${historyRow.item.index}`);
+
+  rowsDiv.exit().remove();
+
+  rowsDiv.enter().append("div").classed("historyItem", true)
+    .each(function (historyRow) {
+      const item = historyRow.item;
 
-  historyCanvas.selectAll(".historyItem")
-    .data(history)
-    .enter().append("div").classed("historyItem", true)
-    .each(function (item) {
       d3.select(this)
         .append("p")
         .text(`#${item.index}`);
@@ -386,14 +515,107 @@ function renderHistory(history: M.History) {
         .append("p")
         .text(`${item.label.desc}`);
     })
-    .on("click", item => {
+    .on("click", historyRow => {
       if (WS_CLIENT) {
         showLoadingScreen();
-        WS_CLIENT.send(JSON.stringify({ type: "graph", index: item.index }));
+        WS_CLIENT.send(JSON.stringify({ type: "graph", index: historyRow.item.index }));
       }
-    });
+    })
+    .merge(rowsDiv)
+    .style("top", historyRow => `${historyRow.row * HISTORY_ROW_HEIGHT}px`);
+}
+
+historyCanvas.on("scroll", renderHistory);
+
+function cancelStreamRender() {
+  if (streamRenderTimer !== null) {
+    clearTimeout(streamRenderTimer);
+    streamRenderTimer = null;
+  }
 }
 
+function renderStream() {
+  cancelStreamRender();
+  // renderGraph resolves link endpoints in place, so render copies of the links
+  renderGraph({
+    nodes: streamNodes.slice(),
+    links: streamLinks.map(link => ({ ...link })),
+  });
+}
+
+function receiveGraphBatch(batch: M.GraphBatch) {
+  if (batch.stream !== streamId) {
+    streamId = batch.stream;
+    streamNodes = [];
+    streamLinks = [];
+    streamShown = true;
+    currentIndex = null;
+    setTitle("streaming graph…");
+  }
+
+  batch.nodes.forEach(node => streamNodes.push(node));
+  // links past the end are new, others replace a link with updated labels
+  batch.links.forEach(({ index, link }) => streamLinks[index] = link);
+
+  if (streamShown && streamRenderTimer === null) {
+    streamRenderTimer = window.setTimeout(renderStream, STREAM_RENDER_INTERVAL);
+  }
+}
+
+function completeGraphStream(stream: number, t: string, item: M.HistoryItem) {
+  appendHistoryItem(item);
+  if (stream !== streamId || !streamShown) {
+    return;
+  }
+  setTitle(t);
+  currentIndex = item.index;
+  renderStream();
+}
+
+function receiveSessions(sessions: string[]) {
+  const options = d3.select(sessionSelect).selectAll<HTMLOptionElement, string>("option")
+    .data(sessions, name => name);
+  options.exit().remove();
+  options.enter().append("option")
+    .merge(options)
+    .attr("value", name => name)
+    .text(name => name);
+  sessionSelect.classList.toggle("hidden", sessions.length < 2);
+
+  if (currentSession !== null && sessions.includes(currentSession)) {
+    sessionSelect.value = currentSession;
+    return;
+  }
+  const name = URL_SESSION !== null && sessions.includes(URL_SESSION)
+    ? URL_SESSION
+    : sessions[sessions.length - 1];
+  if (name !== undefined) {
+    watchSession(name);
+  }
+}
+
+function watchSession(name: string) {
+  if (!WS_CLIENT) {
+    return;
+  }
+  currentSession = name;
+  sessionSelect.value = name;
+
+  // forget everything shown for the previous session
+  streamId = null;
+  streamShown = false;
+  cancelStreamRender();
+  currentIndex = null;
+  stopSimulation();
+  canvas.selectAll("*").remove();
+  setTitle(name);
+
+  WS_CLIENT.send(JSON.stringify({ type: "session", name: name }));
+  WS_CLIENT.send(JSON.stringify({ type: "history", offset: 0, limit: HISTORY_PAGE_SIZE }));
+}
+
+sessionSelect.addEventListener("change", () => watchSession(sessionSelect.value));
+
 function setTitle(t: string) {
   title.text(`Active: ${t}`);
 }
@@ -413,20 +635,18 @@ function hideLoadingScreen() {
   document.getElementById("loadingScreenDiv")!.classList.remove("visible");
 }
 
-function populateCompareSelects() {
-  [oldSelect, newSelect].forEach(select => {
-    select.innerHTML = "";
-    currentHistory.forEach(hi => {
-      const opt = document.createElement("option");
-      opt.value = `${hi.index}`;
-      opt.textContent = `#${hi.index}`;
-      select.appendChild(opt);
-    });
+function populateCompareInputs() {
+  const oldest = historyNewest - historyTotal + 1;
+  [oldInput, newInput].forEach(input => {
+    input.min = `${oldest}`;
+    input.max = `${historyNewest}`;
   });
+  oldInput.value = `${Math.max(oldest, historyNewest - 1)}`;
+  newInput.value = `${historyNewest}`;
 }
 
 compareBtn.addEventListener("click", () => {
-  populateCompareSelects();
+  populateCompareInputs();
   modal.classList.remove("hidden");
 });
 
@@ -435,12 +655,31 @@ cancelBtn.addEventListener("click", () => {
 });
 
 confirmBtn.addEventListener("click", () => {
-  const oldIndex = Number(oldSelect.value);
-  const newIndex = Number(newSelect.value);
+  // min & max only bound the spinner, typed indices are checked here
+  if (!oldInput.reportValidity() || !newInput.reportValidity()) {
+    return;
+  }
+  const oldIndex = Number(oldInput.value);
+  const newIndex = Number(newInput.value);
   modal.classList.add("hidden");
   if (WS_CLIENT) {
     showLoadingScreen();
-    WS_CLIENT.send(JSON.stringify({ type: "diff_graph", old_index: oldIndex, new_index: newIndex }));
+    WS_CLIENT.send(JSON.stringify({ type: "diff_graph", old_index: oldIndex, new_index: newIndex, structural: structuralCheckbox.checked }));
+  }
+});
+
+function sendQuery() {
+  const query = queryInput.value.trim();
+  if (WS_CLIENT && currentIndex !== null && query) {
+    showLoadingScreen("Querying graph…");
+    WS_CLIENT.send(JSON.stringify({ type: "query", index: currentIndex, query: query, hops: Number(hopsInput.value) }));
+  }
+}
+
+queryBtn.addEventListener("click", sendQuery);
+queryInput.addEventListener("keydown", event => {
+  if (event.key === "Enter") {
+    sendQuery();
   }
 });
 
@@ -451,21 +690,43 @@ function connect() {
   ws.onopen = () => {
     setStatus('connected', 'ok');
     WS_CLIENT = ws;
-    ws.send(JSON.stringify({ type: 'history' }));
+    // the server lists its sessions first, the watched one is picked again
+    currentSession = null;
   };
 
   ws.onmessage = (event: MessageEvent<string>) => {
     try {
       const data: M.Data = JSON.parse(event.data);
 
-      if (data.type === "history") {
-        renderHistory(data.history);
+      if (data.type === "sessions") {
+        receiveSessions(data.sessions);
+      } else if (data.type === "history") {
+        if (data.offset === 0) {
+          resetHistory(data);
+        } else {
+          receiveHistoryPage(data);
+        }
+      } else if (data.type === "history_append") {
+        appendHistoryItem(data.item);
+      } else if (data.type === "history_evict") {
+        evictHistoryItems(data.indices);
+      } else if (data.type === "graph_batch") {
+        setStatus('connected', 'ok');
+        receiveGraphBatch(data);
+      } else if (data.type === "graph_complete") {
+        completeGraphStream(data.stream, data.title, data.item);
       } else if (data.type === "graph") {
+        setStatus('connected', 'ok');
+        streamShown = false;
+        cancelStreamRender();
         setTitle(data.title);
-        if (data.history) {
-          renderHistory(data.history);
+        if (data.index !== undefined && data.index !== null) {
+          currentIndex = data.index;
         }
         renderGraph(data.graph);
+      } else if (data.type === "error") {
+        hideLoadingScreen();
+        setStatus(data.message, 'warn');
       }
     } catch (e) {
       console.error('Invalid graph message:', e);
@@ -59,12 +59,53 @@ export type HistoryItem = {
 
 export type History = HistoryItem[];
 
+export type HistoryPage = {
+  history: History,
+  offset: number,
+  total: number,
+  newest_index: number | null,
+};
+
+export type HistoryRow = {
+  row: number,
+  item: HistoryItem,
+};
+
+export type LinkUpdate = {
+  index: number,
+  link: Link,
+};
+
+export type GraphBatch = {
+  stream: number,
+  nodes: Node[],
+  links: LinkUpdate[],
+};
+
 export type Data = {
+  type: "sessions",
+  sessions: string[],
+} | ({
   type: "history",
-  history: History,
+} & HistoryPage) | {
+  type: "history_append",
+  item: HistoryItem,
+} | {
+  type: "history_evict",
+  indices: number[],
 } | {
   type: "graph",
   title: string,
   graph: Graph,
-  history?: History,
+  index?: number,
+} | ({
+  type: "graph_batch",
+} & GraphBatch) | {
+  type: "graph_complete",
+  stream: number,
+  title: string,
+  item: HistoryItem,
+} | {
+  type: "error",
+  message: string,
 };